@@ -7,26 +7,45 @@ from backend.mqtt.mqtt_client import start_mqtt_client
 from backend.routes import register_routes
 # Necessary s.t. create_all() knows what models to create
 from backend.models import models
+from backend.models.migrations import upgrade_sensor_data_schema, start_sensor_data_backfill, enable_sensor_data_partitioning
+from backend.models.retention import PARTITIONING_MONTHLY
+from backend.models.pool import get_engine_options, install_pool_metrics
+from backend.models.timeseries import init_timeseries_store
+from backend.aiplaning.utils.planCacheUtils import init_plan_cache
 from backend.cron.deviceCron import start_scheduler
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = get_engine_options(app.config)
     
     # Initialize extensions with app
     db.init_app(app)
     pddl_service.init_app(app)
+    with app.app_context():
+        install_pool_metrics(db.engine)
     
     # Configure logging
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
+
+    # Sensor readings go to the app database or an embedded store
+    init_timeseries_store(app)
+    # Solved plans are shared by rooms in the same state
+    init_plan_cache(app)
     
     try:
         with app.app_context():
             # Only creates new tables if they don't already exist
             db.create_all()
+        # Existing tables get new columns and indexes here
+        column_added = upgrade_sensor_data_schema(app)
+        if app.config['SENSOR_DATA_PARTITIONING'] == PARTITIONING_MONTHLY:
+            enable_sensor_data_partitioning(app)
+        if column_added or app.config['SENSOR_DATA_BACKFILL']:
+            start_sensor_data_backfill(app, app.config['SENSOR_DATA_BACKFILL_BATCH_SIZE'])
     except Exception as e:
         app.logger.error(f"Error initializing database: {e}")
     
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""Module splits the building planner input into independent room and cleaning subproblems."""
+
+from typing import Dict, List
+
+
+def _filter_dict(values: Dict, keys):
+    return {key: value for key, value in values.items() if key in keys}
+
+
+def _filter_matrix(matrix: Dict[str,List[str]], actuators, sensors):
+    filtered = {}
+    for actuator, sensor_list in matrix.items():
+        if actuator not in actuators:
+            continue
+        sensor_list = [sensor for sensor in sensor_list if sensor in sensors]
+        if sensor_list:
+            filtered[actuator] = sensor_list
+    return filtered
+
+
+def create_room_input(input_dictionary: Dict, floor_uid: str, room_uid: str):
+    """
+    Input dictionary of one room, the same as query_input_over_db for that room number:
+    its floor, its devices and the mappings between them, without the cleaning goal.
+    Sensor actuator mappings across rooms are dropped, the room goals are room local.
+
+    Returns:
+        dict with the keys of the building input dictionary
+    """
+    sensors = list(input_dictionary['sensor_room_mapping'].get(room_uid, []))
+    actuators = list(input_dictionary['actuator_room_mapping'].get(room_uid, []))
+
+    room_input = dict(input_dictionary)
+    room_input.update({
+        'problem_name': f"{input_dictionary['problem_name']}_room",
+        'plan_cleaning': False,
+        'floor_uids': [floor_uid],
+        'room_uids_per_floor': {floor_uid: [room_uid]},
+        'sensor_room_mapping': {room_uid: sensors} if sensors else {},
+        'actuator_room_mapping': {room_uid: actuators} if actuators else {},
+        'sensor_types': _filter_dict(input_dictionary['sensor_types'], sensors),
+        'actuator_increases_sensor_mapping_matrix': _filter_matrix(input_dictionary['actuator_increases_sensor_mapping_matrix'], actuators, sensors),
+        'actuator_decreases_sensor_mapping_matrix': _filter_matrix(input_dictionary['actuator_decreases_sensor_mapping_matrix'], actuators, sensors),
+        'sensor_initial_values': _filter_dict(input_dictionary['sensor_initial_values'], sensors),
+        'sensor_initial_locked': [sensor for sensor in input_dictionary['sensor_initial_locked'] if sensor in sensors],
+        'sensor_goal_values': _filter_dict(input_dictionary['sensor_goal_values'], sensors),
+        'actuator_initial_values': _filter_dict(input_dictionary['actuator_initial_values'], actuators),
+        'room_occupied_initial_values': {room_uid: input_dictionary['room_occupied_initial_values'][room_uid]},
+    })
+    return room_input
+
+
+def create_cleaning_input(input_dictionary: Dict):
+    """
+    Input dictionary of the cleaning route: the whole floor, room and elevator topology with
+    the room occupation but without devices and without the sensor and activity goals.
+
+    Returns:
+        dict with the keys of the building input dictionary
+    """
+    cleaning_input = dict(input_dictionary)
+    cleaning_input.update({
+        'problem_name': f"{input_dictionary['problem_name']}_cleaning",
+        'plan_activitys': False,
+        'sensor_room_mapping': {},
+        'actuator_room_mapping': {},
+        'sensor_types': {},
+        'actuator_increases_sensor_mapping_matrix': {},
+        'actuator_decreases_sensor_mapping_matrix': {},
+        'sensor_initial_values': {},
+        'sensor_initial_locked': [],
+        'sensor_goal_values': {},
+        'actuator_initial_values': {},
+    })
+    return cleaning_input
+
+
+def decompose_input(input_dictionary: Dict):
+    """
+    Splits the building input into one subproblem per room with devices (sensor, actuator and
+    activity goals) and one cleaning route subproblem. Rooms without devices have no room goal
+    left to plan and get no subproblem.
+
+    Args:
+        input_dictionary: Building input from query_input_over_db
+
+    Returns:
+        list of (room uid or None for the cleaning route, input dictionary)
+    """
+    subproblems = []
+    if input_dictionary['plan_activitys']:
+        for floor_uid in input_dictionary['floor_uids']:
+            for room_uid in input_dictionary['room_uids_per_floor'].get(floor_uid, []):
+                if room_uid not in input_dictionary['sensor_room_mapping'] and room_uid not in input_dictionary['actuator_room_mapping']:
+                    continue
+                subproblems.append((room_uid, create_room_input(input_dictionary, floor_uid, room_uid)))
+    if input_dictionary['plan_cleaning']:
+        subproblems.append((None, create_cleaning_input(input_dictionary)))
+    return subproblems
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Module builds the pddl domain and caches it across planner runs."""
+
+# pip install pddl==0.4.3
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from typing import Dict
+from pddl.core import Domain
+from pddl.requirements import Requirements
+
+from backend.aiplaning import pddl_converter_actions
+from backend.aiplaning import pddl_converter_types
+from backend.aiplaning import pddl_converter_predicates
+
+# Distinct domains kept, one per combination of activity mappings seen
+DOMAIN_CACHE_SIZE = 8
+
+# domain_text is str(domain), pddl_variable_types, predicates_dict and execution_mapper are
+# shared with the problem generation and the plan filtering and must not be modified
+CachedDomain = namedtuple('CachedDomain', ['key', 'domain', 'domain_text', 'pddl_variable_types',
+                                           'predicates_dict', 'execution_mapper'])
+
+_domain_cache = OrderedDict()
+_domain_cache_lock = threading.Lock()
+_domain_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def domain_cache_key(domain_name: str, activity_detect_mapping: Dict[str,Dict[str,str]], activity_fulfill_mapping: Dict[str,Dict[str,str]]):
+    """
+    Content hash of everything the domain is built from: its name, the activity mappings
+    and the type hierarchy (the sensor and actuator types the actions refer to).
+    Live sensor values, devices and rooms only end up in the problem.
+
+    Returns:
+        str: sha256 hex digest
+    """
+    content = json.dumps({'domain_name': domain_name,
+                          'activity_detect_mapping': activity_detect_mapping,
+                          'activity_fulfill_mapping': activity_fulfill_mapping,
+                          'types': pddl_converter_types.create_type_dict()},
+                         sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(content.encode('utf8')).hexdigest()
+
+
+def build_domain(domain_name: str, activity_detect_mapping: Dict[str,Dict[str,str]], activity_fulfill_mapping: Dict[str,Dict[str,str]], key: str = None):
+    # set up variables and constants
+    pddl_variable_types = pddl_converter_types.create_type_variables()
+
+    predicates_dict = pddl_converter_predicates.create_predicates_variables(pddl_variable_types, activity_fulfill_mapping.keys())
+
+    # set up types
+    type_dict = pddl_converter_types.create_type_dict()
+
+    # define actions
+    actions_list, execution_mapper = pddl_converter_actions.create_actions(predicates_dict, pddl_variable_types, activity_detect_mapping, activity_fulfill_mapping)
+
+    # define the domain object.
+    requirements = [Requirements.STRIPS, Requirements.TYPING, Requirements.ADL]
+    domain = Domain(domain_name,
+                    requirements=requirements,
+                    types=type_dict,
+                    predicates=list(predicates_dict.values()),
+                    actions=actions_list)
+
+    return CachedDomain(key, domain, str(domain), pddl_variable_types, predicates_dict, execution_mapper)
+
+
+def get_domain(input_dictionary) -> CachedDomain:
+    """
+    Returns the domain for the activity mappings of the input dictionary, built on the
+    first request and then served from the cache until the mappings change.
+
+    Args:
+        input_dictionary: Planner input with domain_name, activity_detect_mapping and activity_fulfill_mapping
+
+    Returns:
+        CachedDomain
+    """
+    domain_name = input_dictionary['domain_name']
+    activity_detect_mapping = input_dictionary['activity_detect_mapping']
+    activity_fulfill_mapping = input_dictionary['activity_fulfill_mapping']
+    key = domain_cache_key(domain_name, activity_detect_mapping, activity_fulfill_mapping)
+
+    with _domain_cache_lock:
+        cached = _domain_cache.get(key)
+        if cached is not None:
+            _domain_cache.move_to_end(key)
+            _domain_cache_stats['hits'] += 1
+            return cached
+
+    # Built outside the lock, two threads missing at once both build the same domain
+    cached = build_domain(domain_name, activity_detect_mapping, activity_fulfill_mapping, key)
+    with _domain_cache_lock:
+        _domain_cache_stats['misses'] += 1
+        _domain_cache[key] = cached
+        while len(_domain_cache) > DOMAIN_CACHE_SIZE:
+            _domain_cache.popitem(last=False)
+    logging.info(f"Built pddl domain {domain_name} ({key[:12]}), {len(cached.domain_text)} characters")
+    return cached
+
+
+def clear_domain_cache():
+    with _domain_cache_lock:
+        _domain_cache.clear()
+
+
+def get_domain_cache_stats():
+    """Returns: dict with hits, misses and the number of cached domains"""
+    with _domain_cache_lock:
+        return {**_domain_cache_stats, 'size': len(_domain_cache)}
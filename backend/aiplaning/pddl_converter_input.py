@@ -5,8 +5,7 @@ import logging
 import json
 import os
 import configparser
-from backend.aiplaning.utils.dbUtils import get_floor_uids, get_room_uids_per_floor, get_room_occupied_initial_values, get_sensor_room_mapping, get_actuator_room_mapping, get_sensor_types, get_sensor_initial_values, get_actuator_initial_values
-from backend.mqtt.utils.mappingParserUtils import get_actuator_sensor_matrices
+from backend.aiplaning.utils.planningSnapshot import load_planning_snapshot
 from typing import List, Dict, Optional
 
 def query_input_over_db(sensor_goal_values: Optional[Dict[str, int]] = {}, sensor_initial_locked: Optional[List[str]] = [], room_number: str = None, plan_cleaning: bool = False, plan_activitys: bool = True):
@@ -16,65 +15,36 @@ def query_input_over_db(sensor_goal_values: Optional[Dict[str, int]] = {}, senso
     domaine_file_name = 'test_domain'
     problem_file_name = 'test_problem'
 
+    # One immutable snapshot of the floors, rooms, online devices and mappings (three queries), e.g.
     # floor_uids = ['f0','f1']
-    floor_uids = get_floor_uids(room_number)
     # room_uids_per_floor = {'f0':['r0','r1','r3'],'f1':['r2']}
-    room_uids_per_floor = get_room_uids_per_floor(room_number)
-    
-    # TODO what if sensor with room is not part of anny floor?
     # room_occupied_initial_values = {'r0':False, 'r1': True, 'r2':False, 'r3': True}
-    room_occupied_initial_values = get_room_occupied_initial_values(room_number)
-    #floor_list = db.list_all_floors()
-    #floor_uids = [floor['id'] for floor in floor_list]
-    #room_uids_per_floor = {floor['id']:floor['rooms'] for floor in floor_list}
-    #for floor in floor_list:
-    #    room_occupied_initial_values = {room['id']:room['is_occupied'] for room in room_uids_per_floor[floor]}
-
     # sensor_room_mapping = {'r0':['s1'], 'r2':['s2'], 'r3':['s3', 's4']}
     # actuator_room_mapping = {'r0':['a1'], 'r2':['a2']}
-    sensor_room_mapping = get_sensor_room_mapping(room_number)
-    logging.info(f"sensor_room_mapping: {sensor_room_mapping}")
-    actuator_room_mapping = get_actuator_room_mapping(room_number)
-    logging.info(f"actuator_room_mapping: {actuator_room_mapping}")
-    #for floor in floor_uids:
-    #    for room in room_uids_per_floor[floor]:
-    #        device_list = db.list_devices_in_room(floor,room)['devices']
-    #        sensor_uids = []
-    #        actuator_uids = []
-    #        for device in device_list:
-    #            if device is_sensor():
-    #                sensor_uids.append(device)
-    #            elif device is_actuator():
-    #                actuator_uids.append(device)
-    #        sensor_room_mapping.update({room:sensor_uids})
-    #        actuator_room_mapping.update({room:actuator_uids})
-
     # sensor_types = {'s1':'light_s', 's2':'humidity_s', 's3':'temperature_s', 's4':'temperature_s'}
-    sensor_types = get_sensor_types(room_number)
-
-    # TODO get info from db
     # actuator_increases_sensor_mapping_matrix = {'a1':['s1','s2'], 'a2':['s2']}
     # actuator_decreases_sensor_mapping_matrix = {'a1':['s1']}
-    actuator_increases_sensor_mapping_matrix, actuator_decreases_sensor_mapping_matrix = get_actuator_sensor_matrices(None, room_number)
+    # sensor_initial_values = {'s1': -1, 's2':1, 's3':-1}
+    # actuator_initial_values = {'a1': True, 'a2':False}
+    # TODO what if sensor with room is not part of anny floor?
+    snapshot = load_planning_snapshot(room_number).as_input_values()
+    floor_uids = snapshot['floor_uids']
+    room_uids_per_floor = snapshot['room_uids_per_floor']
+    room_occupied_initial_values = snapshot['room_occupied_initial_values']
+    sensor_room_mapping = snapshot['sensor_room_mapping']
+    logging.info(f"sensor_room_mapping: {sensor_room_mapping}")
+    actuator_room_mapping = snapshot['actuator_room_mapping']
+    logging.info(f"actuator_room_mapping: {actuator_room_mapping}")
+    sensor_types = snapshot['sensor_types']
+    actuator_increases_sensor_mapping_matrix = snapshot['actuator_increases_sensor_mapping_matrix']
+    actuator_decreases_sensor_mapping_matrix = snapshot['actuator_decreases_sensor_mapping_matrix']
     logging.info(f"actuator_increases_sensor_mapping_matrix: {actuator_increases_sensor_mapping_matrix}")
     logging.info(f"actuator_decreases_sensor_mapping_matrix: {actuator_decreases_sensor_mapping_matrix}")
-
-    # sensor_initial_values = {'s1': -1, 's2':1, 's3':-1}
-    sensor_initial_values = get_sensor_initial_values(room_number)
+    sensor_initial_values = snapshot['sensor_initial_values']
     logging.info(f"sensor_initial_values: {sensor_initial_values}")
     # sensor_goal_values = {'s1': -1, 's2':1}
-
-    # actuator_initial_values = {'a1': True, 'a2':False}
-    actuator_initial_values = get_actuator_initial_values(room_number)
+    actuator_initial_values = snapshot['actuator_initial_values']
     logging.info(f"actuator_initial_values: {actuator_initial_values}")
-    #for floor in floor_uids:
-    #    for room in room_uids_per_floor[floor]:
-    #        for device in sensor_room_mapping[room]:
-    #            curent_value = db.request_current_value_hierarchical(floor,room,device)
-    #            sensor_initial_values.update({device:curent_value})
-    #        for device in actuator_room_mapping[room]:
-    #            curent_value = db.request_current_value_hierarchical(floor,room,device)
-    #            sensor_initial_values.update({device:curent_value})
 
     # potential to make stuff unchangable for the ai as long as the room is occupied
     # sensor_initial_locked = ['s4']
@@ -5,17 +5,16 @@
 import sys
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
 from pddl.logic import variables
-from pddl.core import Domain, Problem
-from pddl.requirements import Requirements
+from pddl.core import Problem
 import logging
 from backend.extensions import pddl_service
 
-from backend.aiplaning import pddl_converter_actions
+from backend.aiplaning import pddl_converter_domain
+from backend.aiplaning import pddl_converter_decomposition
 from backend.aiplaning import pddl_converter_goals
-from backend.aiplaning import pddl_converter_types
-from backend.aiplaning import pddl_converter_predicates
 from backend.aiplaning import pddl_converter_objects
 from backend.aiplaning import pddl_converter_input
 from backend.aiplaning import pddl_converter_initial_state
@@ -23,36 +22,24 @@ from backend.aiplaning import pddl_converter_help
 from backend.aiplaning.pddl_converter_execution import PlanerTag, pddl_actions_to_execution_mapper
 from backend.aiplaning.utils.updateActuators import updateActuators
 from backend.aiplaning.utils.dbUtils import save_to_database
+from backend.aiplaning.utils import dirtyRoomUtils
+from backend.aiplaning.utils.planCacheUtils import solve_with_plan_cache
 from backend.models.models import PlanScope
 
 
-def create(input_dictionary):
+def create_problem(input_dictionary, cached_domain: pddl_converter_domain.CachedDomain):
+    """
+    Builds the problem for the live building state of the input dictionary against a
+    domain from pddl_converter_domain.get_domain.
 
+    Returns:
+        Problem, None if it could not be created
+    """
     try: 
-        # set up variables and constants
-        pddl_variable_types = pddl_converter_types.create_type_variables()
-
-        activity_detect_mapping: Dict[str,Dict[str,str]] = input_dictionary['activity_detect_mapping']
-        activity_fulfill_mapping: Dict[str,Dict[str,str]] = input_dictionary['activity_fulfill_mapping']
-
-        predicates_dict = pddl_converter_predicates.create_predicates_variables(pddl_variable_types, activity_fulfill_mapping.keys())
-        
-        # set up types
-        type_dict = pddl_converter_types.create_type_dict()
+        domain = cached_domain.domain
+        predicates_dict = cached_domain.predicates_dict
+        pddl_variable_types = cached_domain.pddl_variable_types
 
-        # define actions
-        actions_list, execution_mapper = pddl_converter_actions.create_actions(predicates_dict, pddl_variable_types, activity_detect_mapping, activity_fulfill_mapping)
-
-        # define the domain object.
-        requirements = [Requirements.STRIPS, Requirements.TYPING, Requirements.ADL]
-        domain = Domain(input_dictionary['domain_name']+ f'Time{str(time.time()).replace('.','')}',
-                        requirements=requirements,
-                        types=type_dict,
-                        predicates=list(predicates_dict.values()),
-                        actions=actions_list)
-
-        #print(domain)
-        
         all_objects, uid_to_pddl_variable_floor, uid_to_pddl_variable_rooms, uid_to_pddl_variable_sensors,uid_to_pddl_variable_actuators, uid_to_pddl_variable_elevators, uid_to_pddl_variable_cleaning_teams, uid_to_pddl_variable_room_positions = pddl_converter_objects.create_all_obbjects(input_dictionary)
 
         # create initial state
@@ -80,7 +67,14 @@ def create(input_dictionary):
         )
         #print(problem)
 
-        return domain, problem, execution_mapper
+        return problem
+    except Exception as e:
+        logging.error({'Failed to create pddl': str(e)})
+
+def create(input_dictionary):
+    try: 
+        cached_domain = pddl_converter_domain.get_domain(input_dictionary)
+        return cached_domain.domain, create_problem(input_dictionary, cached_domain), cached_domain.execution_mapper
     except Exception as e:
         logging.error({'Failed to create pddl': str(e)})
 
@@ -126,23 +120,187 @@ def main():
     json_text = {'excludeActions': helper_action_names}
     pddl_converter_help.write_out_pddl(output_path, domaine_file_name + ".planviz.json", json.dumps(json_text))
 
+AUTO_GENERATED_PATH = "/backend/aiplaning/auto_generated"
+_written_domain_key = None
+
+def _write_out_domain(cached_domain: pddl_converter_domain.CachedDomain):
+    # rewrite d.pddl (and rotate the old version) only when the domain changed
+    global _written_domain_key
+    if _written_domain_key == cached_domain.key:
+        return
+    pddl_converter_help.write_out_pddl(AUTO_GENERATED_PATH, "d" + ".pddl", cached_domain.domain_text)
+    _written_domain_key = cached_domain.key
+
+def solve_decomposed(input_dictionary, cached_domain: pddl_converter_domain.CachedDomain, planner: str, max_parallel_jobs: int = 4,
+                     only_changed: bool = False, max_plan_age_seconds: int = 0):
+    """
+    Solves the building as independent per room subproblems and one cleaning route subproblem.
+    The problems are sent to the planner service at the same time, so its workers solve them in
+    parallel and the planning latency is the one of the slowest subproblem. Rooms in the same
+    state as an already solved one are answered from the plan cache.
+
+    Args:
+        input_dictionary: Building input from query_input_over_db
+        cached_domain: Domain from pddl_converter_domain.get_domain, shared by all subproblems
+        planner: Name of the planner to use
+        max_parallel_jobs: Maximum number of planner jobs in flight
+        only_changed: Only solve the subproblems whose input changed since their last successful
+                      plan, the others reuse that plan in the merged result
+        max_plan_age_seconds: With only_changed, replan subproblems with an older plan anyway (0 never)
+
+    Returns:
+        (merged solve result, list of (room uid or None for cleaning, solve result) solved in this run)
+    """
+    subproblems = pddl_converter_decomposition.decompose_input(input_dictionary)
+    if not subproblems:
+        return None, []
+
+    keys = [room_uid if room_uid is not None else dirtyRoomUtils.CLEANING_KEY for room_uid, _ in subproblems]
+    fingerprints = [dirtyRoomUtils.planning_input_fingerprint(sub_input, cached_domain.key) for _, sub_input in subproblems]
+    dirty = [not only_changed or dirtyRoomUtils.is_room_dirty(key, fingerprint, max_plan_age_seconds)
+             for key, fingerprint in zip(keys, fingerprints)]
+
+    problems = {}
+    solved = {}
+    for i, (room_uid, sub_input) in enumerate(subproblems):
+        if not dirty[i]:
+            continue
+        problem = create_problem(sub_input, cached_domain)
+        if problem is None:
+            # Recorded as a failed subproblem, the other subproblems are still solved
+            label = f"room {room_uid}" if room_uid is not None else "cleaning"
+            solved[i] = {'success': False, 'error': f"Failed to create the pddl problem of {label}"}
+            continue
+        problems[i] = problem
+
+    if problems:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, min(max_parallel_jobs, len(problems))), thread_name_prefix='pddl-subproblem') as executor:
+            futures = {i: executor.submit(solve_with_plan_cache, cached_domain.domain_text, cached_domain.key, problem, planner)
+                       for i, problem in problems.items()}
+            for i, future in futures.items():
+                try:
+                    solved[i] = future.result()
+                except Exception as e:
+                    label = f"room {subproblems[i][0]}" if subproblems[i][0] is not None else "cleaning"
+                    logging.error(f"Error solving planning subproblem {label}: {str(e)}")
+                    solved[i] = {'success': False, 'error': str(e)}
+        cache_hits = sum(1 for solve_result in solved.values() if solve_result and solve_result.get('plan_cache_hit'))
+        logging.info(f"Solved {len(problems)} of {len(subproblems)} planning subproblems ({cache_hits} from the plan cache) in {time.perf_counter() - start:.2f}s")
+
+    results = []
+    for i, (room_uid, _) in enumerate(subproblems):
+        if i in solved:
+            solve_result = solved[i]
+            if solve_result and solve_result.get('success') and solve_result.get('plan') is not None:
+                dirtyRoomUtils.remember_room_plan(keys[i], fingerprints[i], solve_result)
+        else:
+            solve_result = dirtyRoomUtils.get_last_solve_result(keys[i])
+        results.append((room_uid, solve_result))
+    dirtyRoomUtils.count_room_plans(len(solved), len(subproblems) - len(solved))
+
+    return merge_solve_results(results), [(subproblems[i][0], solved[i]) for i in sorted(solved)]
+
+def merge_solve_results(results):
+    """
+    Merges the subproblem results into one solve result. Plans are concatenated in subproblem
+    order, costs are summed and the time is the one of the slowest subproblem. Failed
+    subproblems are left out.
+
+    Returns:
+        dict like solve_planning_problem, None if no subproblem was solved
+    """
+    plan = []
+    raw_plans = []
+    costs = []
+    times = []
+    for room_uid, solve_result in results:
+        label = f"room {room_uid}" if room_uid is not None else "cleaning"
+        if not solve_result or not solve_result.get('success') or solve_result.get('plan') is None:
+            logging.warning(f"Planning subproblem {label} failed: {(solve_result or {}).get('error')}")
+            continue
+        plan = plan + list(solve_result['plan'])
+        raw_plans.append(f"; {label}\n{solve_result.get('raw_plan') or ''}")
+        if solve_result.get('cost') is not None:
+            costs.append(solve_result['cost'])
+        if solve_result.get('time') is not None:
+            times.append(solve_result['time'])
+
+    if not raw_plans:
+        return None
+    return {'success': True,
+            'plan': plan,
+            'cost': sum(costs) if costs else None,
+            'time': max(times) if times else None,
+            'raw_plan': '\n'.join(raw_plans)}
+
 def run_planner_with_db_data(plan_cleaning = False,
                             sensor_goal_values: Optional[Dict[str, int]] = {},
                             sensor_initial_locked: Optional[List[str]] = [],
                             plan_activitys: bool = True,
-                            room_number: str = None):
+                            room_number: str = None,
+                            decompose: Optional[bool] = None,
+                            only_changed: bool = False):
+    """
+    Plans the building (or one room) with the live db state, sends the actuator updates and saves the plan.
+
+    Args:
+        decompose: Solve the building as concurrent per room and cleaning subproblems merged into
+                   one plan (None uses PLANNER_DECOMPOSE_ROOMS), ignored for a single room
+        only_changed: Skip the building run (or the unchanged rooms when decomposed) if the planning
+                      input did not change since the last successful plan, ignored for a single room
+
+    Returns:
+        The saved PDDLPlan, None if planning failed or nothing changed
+    """
+    from flask import current_app
     planner = "dual-bfws-ffparser"
     pddl_converter_help.check_lib_versions()
 
     input_dictionary = pddl_converter_input.query_input_over_db(sensor_goal_values, sensor_initial_locked, room_number, plan_cleaning, plan_activitys)
     # logging.info(input_dictionary)
     
-    d, p, execution_mapper = create(input_dictionary)
-    pddl_converter_help.write_out_pddl("/backend/aiplaning/auto_generated", "d" + ".pddl", d)
-    pddl_converter_help.write_out_pddl("/backend/aiplaning/auto_generated", "p" + ".pddl", p)
-    solve_result = pddl_service.solve_planning_problem(str(d), str(p), planner, False)
+    # the domain only changes with the activity mappings, only the problem is regenerated every run
+    cached_domain = pddl_converter_domain.get_domain(input_dictionary)
+    execution_mapper = cached_domain.execution_mapper
+    _write_out_domain(cached_domain)
+
+    if decompose is None:
+        decompose = current_app.config.get('PLANNER_DECOMPOSE_ROOMS', False)
+    only_changed = only_changed and room_number is None
+    max_plan_age_seconds = current_app.config.get('PLANNER_MAX_PLAN_AGE_SECONDS', 0)
+    if decompose and room_number is None:
+        solve_result, solved = solve_decomposed(input_dictionary, cached_domain, planner, current_app.config.get('PLANNER_MAX_PARALLEL_JOBS', 4),
+                                                only_changed, max_plan_age_seconds)
+        if only_changed and not solved:
+            logging.info("No room changed since its last plan, planner skipped")
+            return None
+        if solve_result is None:
+            logging.error("No planning subproblem could be solved")
+            return None
+        # reused room plans were already sent to the actuators when they were planned
+        actuator_result = merge_solve_results(solved) or {}
+    else:
+        fingerprint = dirtyRoomUtils.planning_input_fingerprint(input_dictionary, cached_domain.key)
+        if only_changed and not dirtyRoomUtils.is_room_dirty(dirtyRoomUtils.BUILDING_KEY, fingerprint, max_plan_age_seconds):
+            dirtyRoomUtils.count_room_plans(0, 1)
+            logging.info("Building did not change since its last plan, planner skipped")
+            return None
+        p = create_problem(input_dictionary, cached_domain)
+        if p is None:
+            logging.error("Failed to create the pddl problem, planner skipped")
+            return None
+        pddl_converter_help.write_out_pddl(AUTO_GENERATED_PATH, "p" + ".pddl", p)
+        solve_result = solve_with_plan_cache(cached_domain.domain_text, cached_domain.key, p, planner)
+        if room_number is None:
+            dirtyRoomUtils.count_room_plans(1, 0)
+            if solve_result and solve_result.get('success') and solve_result.get('plan') is not None:
+                dirtyRoomUtils.remember_room_plan(dirtyRoomUtils.BUILDING_KEY, fingerprint, solve_result)
+        actuator_result = solve_result
     
     filtered_plan, cleaning_plan, increse_actuator_plans, turn_off_actuator_plans, decrese_actuator_plans, two_actuators_involved_actioin_plans, detected_activity_plan = execution_mapper.filter_plan(solve_result.get('plan'))
+    if actuator_result is not solve_result:
+        _, _, increse_actuator_plans, turn_off_actuator_plans, decrese_actuator_plans, _, _ = execution_mapper.filter_plan(actuator_result.get('plan', []))
     
     updateActuators(increse_actuator_plans, turn_off_actuator_plans, decrese_actuator_plans)
     if room_number is None:
@@ -152,6 +310,5 @@ def run_planner_with_db_data(plan_cleaning = False,
 
     return plan
 
-
 if __name__ == '__main__':
     main()
@@ -0,0 +1,68 @@
+import json
+import time
+import hashlib
+import threading
+
+# Key of the whole building problem when the building is planned without decomposition
+BUILDING_KEY = '__building__'
+# Key of the cleaning route subproblem
+CLEANING_KEY = '__cleaning__'
+
+# room uid (or BUILDING_KEY / CLEANING_KEY) -> {'fingerprint', 'solve_result', 'planned_at'} of the last successful plan
+room_plans = {}
+room_plan_stats = {'planned': 0, 'reused': 0}
+_room_plans_lock = threading.Lock()
+
+
+def planning_input_fingerprint(input_dictionary, domain_key=None):
+    """
+    Hash of everything a (sub)problem is generated from: the topology, occupancy, online devices,
+    simplified sensor values, actuator states and mappings, plus the domain it is planned with.
+
+    Returns:
+        str: hex digest, equal inputs give equal fingerprints
+    """
+    content = json.dumps([domain_key, input_dictionary], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def is_room_dirty(key, fingerprint, max_plan_age_seconds=0):
+    """
+    True if the room has no successful plan yet, its planning input changed since that plan
+    or the plan is older than max_plan_age_seconds (0 keeps plans until the input changes).
+    """
+    with _room_plans_lock:
+        entry = room_plans.get(key)
+    if entry is None or entry['fingerprint'] != fingerprint:
+        return True
+    return bool(max_plan_age_seconds) and time.time() - entry['planned_at'] >= max_plan_age_seconds
+
+
+def get_last_solve_result(key):
+    """Returns: solve result of the last successful plan of the room or None"""
+    with _room_plans_lock:
+        entry = room_plans.get(key)
+    return entry['solve_result'] if entry is not None else None
+
+
+def remember_room_plan(key, fingerprint, solve_result):
+    with _room_plans_lock:
+        room_plans[key] = {'fingerprint': fingerprint, 'solve_result': solve_result, 'planned_at': time.time()}
+
+
+def count_room_plans(planned, reused):
+    with _room_plans_lock:
+        room_plan_stats['planned'] += planned
+        room_plan_stats['reused'] += reused
+
+
+def clear_room_plans():
+    """Forget all plans, the next planner run replans every room"""
+    with _room_plans_lock:
+        room_plans.clear()
+
+
+def get_room_plan_stats():
+    """Returns: dict with planned and reused subproblem counts and the number of rooms with a plan"""
+    with _room_plans_lock:
+        return {**room_plan_stats, 'rooms': len(room_plans)}
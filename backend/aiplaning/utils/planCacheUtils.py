@@ -0,0 +1,203 @@
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pddl.logic.base import Not
+from pddl.logic.predicates import Predicate
+from backend.extensions import pddl_service
+
+# Rounds of neighbourhood refinement before objects with the same colour are ordered by name
+CANONICAL_REFINEMENT_ROUNDS = 4
+# Placeholders can not clash with planner output, '?' only starts variables in pddl
+PLACEHOLDER_PREFIX = '?o'
+
+_object_token_pattern = re.compile(r'[^\s()]+')
+
+
+class PlanCache:
+    """
+    Thread-safe LRU cache of solved plan templates keyed by the canonical problem, with a time to live.
+    A stand-in for a shared cache like Redis, entries live in process memory.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'uncacheable': 0}
+
+    def get(self, key):
+        """Returns: the cached template or None on a miss (expired entries are removed)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds and time.time() - entry[0] >= self.ttl_seconds:
+                del self._entries[key]
+                self._stats['expirations'] += 1
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[1]
+
+    def put(self, key, template):
+        with self._lock:
+            self._entries[key] = (time.time(), template)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def count_uncacheable(self):
+        with self._lock:
+            self._stats['uncacheable'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        """Returns: dict with hits, misses, hit_rate, evictions, expirations, uncacheable problems and size"""
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {**self._stats,
+                    'hit_rate': round(self._stats['hits'] / lookups, 4) if lookups else None,
+                    'size': len(self._entries),
+                    'max_entries': self.max_entries,
+                    'ttl_seconds': self.ttl_seconds}
+
+
+plan_cache = PlanCache()
+
+
+def init_plan_cache(app):
+    """Create the plan cache from PLAN_CACHE_ENABLED, PLAN_CACHE_MAX_ENTRIES and PLAN_CACHE_TTL_SECONDS"""
+    global plan_cache
+    if not app.config.get('PLAN_CACHE_ENABLED', True):
+        plan_cache = None
+        logging.info("Plan cache disabled")
+        return None
+    plan_cache = PlanCache(app.config.get('PLAN_CACHE_MAX_ENTRIES', 1024), app.config.get('PLAN_CACHE_TTL_SECONDS', 3600))
+    logging.info(f"Plan cache initialized with {plan_cache.max_entries} entries and a ttl of {plan_cache.ttl_seconds}s")
+    return plan_cache
+
+
+def get_plan_cache_stats():
+    """Returns: plan cache metrics or None if the cache is disabled"""
+    return plan_cache.get_stats() if plan_cache is not None else None
+
+
+def canonicalize_problem(problem, context=''):
+    """
+    Canonical form of a problem: objects are renamed to positional placeholders, ordered by their
+    type and their role in the initial state, and the init facts are sorted. Rooms in the same
+    abstract state (sensor types and buckets, actuator pattern, occupancy, mappings) get the same key
+    whatever their device uuids are. Objects that stay indistinguishable are ordered by name, which
+    can only turn a possible hit into a miss, a hit always means the renamed problems are equal.
+
+    Args:
+        problem: pddl Problem
+        context: Anything else the plan depends on (domain key, planner)
+
+    Returns:
+        (key, {object name: placeholder}) or (None, None) if the problem can not be canonicalized
+    """
+    object_types = {obj.name: ','.join(sorted(obj.type_tags)) for obj in problem.objects}
+    if len({name.lower() for name in object_types}) != len(object_types):
+        # plans are re-bound case insensitive
+        return None, None
+
+    facts = []
+    occurrences = {name: [] for name in object_types}
+    for fact in problem.init:
+        negated = isinstance(fact, Not)
+        predicate = fact.argument if negated else fact
+        if not isinstance(predicate, Predicate):
+            return None, None
+        arguments = tuple(term.name for term in predicate.terms)
+        for position, name in enumerate(arguments):
+            if name not in occurrences:
+                return None, None
+            occurrences[name].append((len(facts), position))
+        facts.append((negated, predicate.name, arguments))
+
+    colours = dict(object_types)
+    for _ in range(CANONICAL_REFINEMENT_ROUNDS):
+        refined = {}
+        for name, fact_positions in occurrences.items():
+            signature = sorted((facts[index][0], facts[index][1], position, tuple(colours[argument] for argument in facts[index][2]))
+                               for index, position in fact_positions)
+            refined[name] = hashlib.blake2b(repr((colours[name], signature)).encode('utf-8'), digest_size=8).hexdigest()
+        stable = len(set(refined.values())) == len(set(colours.values()))
+        colours = refined
+        if stable:
+            break
+
+    ordered = sorted(object_types, key=lambda name: (colours[name], name))
+    placeholders = {name: f"{PLACEHOLDER_PREFIX}{i}" for i, name in enumerate(ordered)}
+
+    canonical = repr((context,
+                      sorted(str(requirement) for requirement in problem.requirements),
+                      [(placeholders[name], object_types[name]) for name in ordered],
+                      sorted((negated, name, tuple(placeholders[argument] for argument in arguments))
+                             for negated, name, arguments in facts),
+                      str(problem.goal)))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest(), placeholders
+
+
+def _rename(text, names):
+    # planners may change the case of object names
+    return _object_token_pattern.sub(lambda match: names.get(match.group(0).lower(), match.group(0)), text)
+
+
+def _rebind_result(solve_result, names):
+    rebound = dict(solve_result)
+    rebound['plan'] = [_rename(action, names) for action in solve_result['plan']]
+    rebound['raw_plan'] = _rename(solve_result.get('raw_plan') or '', names)
+    return rebound
+
+
+def solve_with_plan_cache(domain_text, domain_key, problem, planner):
+    """
+    Solve the problem with pddl_service.solve_planning_problem unless a problem with the same canonical
+    form was already solved, then the cached plan is re-bound to the objects (device uuids) of this problem.
+
+    Args:
+        domain_text: Serialized domain
+        domain_key: Content hash of the domain (pddl_converter_domain.domain_cache_key)
+        problem: pddl Problem
+        planner: Name of the planner to use
+
+    Returns:
+        Dictionary like solve_planning_problem, 'plan_cache_hit' is True for cached plans
+    """
+    cache = plan_cache
+    if cache is None:
+        return pddl_service.solve_planning_problem(domain_text, str(problem), planner, False)
+
+    key, placeholders = canonicalize_problem(problem, f"{domain_key}:{planner}")
+    if key is None:
+        cache.count_uncacheable()
+        return pddl_service.solve_planning_problem(domain_text, str(problem), planner, False)
+
+    template = cache.get(key)
+    if template is not None:
+        result = _rebind_result(template, {placeholder.lower(): name for name, placeholder in placeholders.items()})
+        result['plan_cache_hit'] = True
+        return result
+
+    solve_result = pddl_service.solve_planning_problem(domain_text, str(problem), planner, False)
+    if solve_result and solve_result.get('success') and solve_result.get('plan') is not None:
+        try:
+            template = _rebind_result(solve_result, {name.lower(): placeholder for name, placeholder in placeholders.items()})
+            # planner output is not needed to re-use the plan
+            template.pop('stdout', None)
+            template.pop('stderr', None)
+            cache.put(key, template)
+        except Exception as e:
+            logging.error(f"Failed to cache plan: {str(e)}")
+    return solve_result
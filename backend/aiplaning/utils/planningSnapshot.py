@@ -0,0 +1,152 @@
+import logging
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping, Optional, Tuple
+from sqlalchemy import select
+from backend.extensions import db
+from backend.models.models import Floor, Room, Device, SensorActuatorMapping
+from backend.mqtt.utils.mappingParserUtils import build_actuator_sensor_matrices
+
+
+@dataclass(frozen=True)
+class PlanningSnapshot:
+    """
+    Immutable state of the building (or of one room) the PDDL problem is generated from.
+    Lists are tuples and dicts read-only mappings, as_input_values() returns mutable copies
+    with the keys and types of the query_input_over_db input dictionary.
+    """
+    floor_uids: Tuple[str, ...]
+    room_uids_per_floor: Mapping[str, Tuple[str, ...]]
+    room_occupied_initial_values: Mapping[str, bool]
+    sensor_room_mapping: Mapping[str, Tuple[str, ...]]
+    actuator_room_mapping: Mapping[str, Tuple[str, ...]]
+    sensor_types: Mapping[str, str]
+    actuator_increases_sensor_mapping_matrix: Mapping[str, Tuple[str, ...]]
+    actuator_decreases_sensor_mapping_matrix: Mapping[str, Tuple[str, ...]]
+    sensor_initial_values: Mapping[str, int]
+    actuator_initial_values: Mapping[str, bool]
+
+    def as_input_values(self):
+        """Returns: dict of field name -> list or dict copy of the field"""
+        values = {}
+        for name in self.__dataclass_fields__:
+            value = getattr(self, name)
+            if isinstance(value, tuple):
+                values[name] = list(value)
+            else:
+                values[name] = {key: list(item) if isinstance(item, tuple) else item for key, item in value.items()}
+        return values
+
+
+def _freeze(mapping):
+    return MappingProxyType({key: tuple(value) if isinstance(value, list) else value for key, value in mapping.items()})
+
+
+def _append(mapping, key, value):
+    if key not in mapping:
+        mapping[key] = []
+    mapping[key].append(value)
+
+
+def load_planning_snapshot(room_number: Optional[str] = None) -> PlanningSnapshot:
+    """
+    Load everything the PDDL converter reads from the database with three queries:
+    floors with their rooms, the online devices and the linked sensor actuator mappings.
+    Rows are ordered by floor, room and device ids, so the same database state always gives the
+    same snapshot and with it the same planning fingerprints and plan cache keys.
+
+    Args:
+        room_number: Only load this room, its floor and the mappings within the room (None for the building)
+
+    Returns:
+        PlanningSnapshot, empty if the room does not exist
+    """
+    from flask import current_app
+    with current_app.app_context():
+        floors = Floor.__table__.c
+        rooms = Room.__table__.c
+        devices = Device.__table__.c
+        mappings = SensorActuatorMapping.__table__.c
+
+        # 1. Floors and rooms, floors without rooms are part of the building
+        if room_number is not None:
+            topology = db.session.execute(
+                select(rooms.floor_id, rooms.id, rooms.is_occupied).where(rooms.room_number == room_number)
+                .order_by(rooms.floor_id, rooms.id)
+            ).all()
+        else:
+            topology = db.session.execute(
+                select(floors.id, rooms.id, rooms.is_occupied).select_from(
+                    Floor.__table__.outerjoin(Room.__table__, rooms.floor_id == floors.id)
+                ).order_by(floors.id, rooms.id)
+            ).all()
+
+        floor_uids = []
+        room_uids_per_floor = {}
+        room_occupied_initial_values = {}
+        for floor_id, room_id, is_occupied in topology:
+            if floor_id not in room_uids_per_floor:
+                floor_uids.append(floor_id)
+            if room_id is None:
+                continue
+            _append(room_uids_per_floor, floor_id, room_id)
+            room_occupied_initial_values[room_id] = is_occupied
+
+        if room_number is not None and not topology:
+            logging.warning(f"Room with number {room_number} not found")
+
+        # 2. Online devices, in room mode only those of the room
+        device_statement = select(devices.device_id, devices.room_id, devices.device_type, devices.ai_planing_type,
+                                  devices.last_value_simplified, devices.is_off).where(
+            devices.is_online.is_(True)
+        ).order_by(devices.room_id, devices.device_id)
+        if room_number is not None:
+            device_statement = device_statement.where(devices.room_id.in_(list(room_occupied_initial_values)))
+
+        sensor_room_mapping = {}
+        actuator_room_mapping = {}
+        sensor_types = {}
+        sensor_initial_values = {}
+        actuator_initial_values = {}
+        for device_id, room_id, device_type, ai_planing_type, last_value_simplified, is_off in \
+                db.session.execute(device_statement):
+            if device_type == 'sensor':
+                _append(sensor_room_mapping, room_id, device_id)
+                sensor_types[device_id] = ai_planing_type
+                # Use last_value_simplified if available, otherwise default to 0
+                sensor_initial_values[device_id] = last_value_simplified if last_value_simplified is not None else 0
+            elif device_type == 'actuator':
+                _append(actuator_room_mapping, room_id, device_id)
+                # invert from is_off in db and gateway to is activated in ai planner, unknown is off
+                actuator_initial_values[device_id] = not (is_off if is_off is not None else True)
+
+        # 3. Mappings with both devices linked, in room mode with both devices in the room
+        mapping_statement = select(mappings.uuid_actuator, mappings.uuid_sensor, mappings.actuator_can_increases_sensor,
+                                   mappings.actuator_can_decreases_sensor).where(
+            mappings.actuator_device_id.isnot(None), mappings.sensor_device_id.isnot(None)
+        ).order_by(mappings.uuid_actuator, mappings.uuid_sensor)
+        if room_number is not None:
+            actuator_device = Device.__table__.alias('actuator_device')
+            sensor_device = Device.__table__.alias('sensor_device')
+            mapping_statement = mapping_statement.select_from(
+                SensorActuatorMapping.__table__
+                .join(actuator_device, mappings.actuator_device_id == actuator_device.c.id)
+                .join(sensor_device, mappings.sensor_device_id == sensor_device.c.id)
+            ).where(
+                actuator_device.c.room_id.in_(list(room_occupied_initial_values)),
+                sensor_device.c.room_id == actuator_device.c.room_id
+            )
+        increases_matrix, decreases_matrix = build_actuator_sensor_matrices(db.session.execute(mapping_statement))
+
+    return PlanningSnapshot(
+        floor_uids=tuple(floor_uids),
+        room_uids_per_floor=_freeze(room_uids_per_floor),
+        room_occupied_initial_values=_freeze(room_occupied_initial_values),
+        sensor_room_mapping=_freeze(sensor_room_mapping),
+        actuator_room_mapping=_freeze(actuator_room_mapping),
+        sensor_types=_freeze(sensor_types),
+        actuator_increases_sensor_mapping_matrix=_freeze(increases_matrix),
+        actuator_decreases_sensor_mapping_matrix=_freeze(decreases_matrix),
+        sensor_initial_values=_freeze(sensor_initial_values),
+        actuator_initial_values=_freeze(actuator_initial_values),
+    )
@@ -14,6 +14,14 @@ class Config:
     # SQLAlchemy settings
     SQLALCHEMY_DATABASE_URI = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Connection pool shared by the Flask request threads, the MQTT ingest workers and the scheduler jobs.
+    # Every ingest worker and running job holds at most one connection, see GET /db/pool/stats for sizing.
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    # Seconds, below the MariaDB wait_timeout so idle connections are replaced before the server drops them
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 3600))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
     
     # MQTT settings
     MQTT_BROKER_HOST = os.environ.get('MQTT_BROKER_HOST')
@@ -21,8 +29,77 @@ class Config:
     MQTT_CLIENT_ID = os.environ.get('MQTT_CLIENT_ID')
     MQTT_TOPIC_SUBSCRIBE = os.environ.get('MQTT_TOPIC_SUBSCRIBE')
 
+    # MQTT consumers: MQTT_CONSUMERS clients in this process, MQTT_PARTITION_COUNT processes.
+    # With more than one consumer in total the floors are partitioned over the consumers.
+    # Every process keeps its own caches, deletes and config changes are broadcast on <prefix>/cache/invalidate.
+    # Only MQTT_PARTITION_INDEX 0 runs the planning, offline, cleanup, rollup and retention jobs.
+    MQTT_CONSUMERS = int(os.environ.get('MQTT_CONSUMERS', 1))
+    MQTT_PARTITION_INDEX = int(os.environ.get('MQTT_PARTITION_INDEX', 0))
+    MQTT_PARTITION_COUNT = int(os.environ.get('MQTT_PARTITION_COUNT', 1))
+    # Subscribe with MQTT v5 shared subscriptions ($share/<group>/...), empty to disable
+    MQTT_SHARED_GROUP = os.environ.get('MQTT_SHARED_GROUP', '')
+
+    # MQTT ingest queue settings, every consumer has a queue of this size with MQTT_INGEST_WORKERS workers
+    MQTT_INGEST_QUEUE_SIZE = int(os.environ.get('MQTT_INGEST_QUEUE_SIZE', 10000))
+    MQTT_INGEST_BATCH_SIZE = int(os.environ.get('MQTT_INGEST_BATCH_SIZE', 500))
+    MQTT_INGEST_BATCH_WAIT_MS = int(os.environ.get('MQTT_INGEST_BATCH_WAIT_MS', 50))
+    MQTT_INGEST_WORKERS = int(os.environ.get('MQTT_INGEST_WORKERS', 1))
+    # 'drop_oldest' or 'block' (backpressure on the paho network thread)
+    MQTT_INGEST_FULL_POLICY = os.environ.get('MQTT_INGEST_FULL_POLICY', 'drop_oldest')
+    # Ingest logging: 'summary' (per device summaries), 'per_message' or 'off', switchable over /mqtt/logging
+    MQTT_LOG_MODE = os.environ.get('MQTT_LOG_MODE', 'summary')
+    MQTT_LOG_SUMMARY_SECONDS = int(os.environ.get('MQTT_LOG_SUMMARY_SECONDS', 60))
+    # Repeated ingest warnings and errors are logged at most once per interval
+    MQTT_LOG_LIMIT_SECONDS = int(os.environ.get('MQTT_LOG_LIMIT_SECONDS', 60))
+    # Device state (last value, last seen, online) is written behind from the device cache
+    DEVICE_CACHE_FLUSH_SECONDS = int(os.environ.get('DEVICE_CACHE_FLUSH_SECONDS', 5))
+
+    # Convert sensor_data.value of existing rows to value_numeric at startup. Runs automatically
+    # after the column was added, set to true to resume an interrupted conversion. The rollups pause
+    # meanwhile and are rebuilt from the oldest converted reading.
+    SENSOR_DATA_BACKFILL = os.environ.get('SENSOR_DATA_BACKFILL', 'false').lower() == 'true'
+    SENSOR_DATA_BACKFILL_BATCH_SIZE = int(os.environ.get('SENSOR_DATA_BACKFILL_BATCH_SIZE', 10000))
+    # Sensor data rollups (1m, 1h, 1d) are updated every SENSOR_DATA_ROLLUP_SECONDS seconds,
+    # readings younger than SENSOR_DATA_ROLLUP_LAG_SECONDS are rolled up in the next run
+    SENSOR_DATA_ROLLUP_SECONDS = int(os.environ.get('SENSOR_DATA_ROLLUP_SECONDS', 60))
+    SENSOR_DATA_ROLLUP_LAG_SECONDS = int(os.environ.get('SENSOR_DATA_ROLLUP_LAG_SECONDS', 60))
+    # Retention in days per level, 0 keeps the data forever. Data is only deleted once the next
+    # coarser level contains it (raw -> 1m -> 1h -> 1d), the job runs every SENSOR_DATA_RETENTION_MINUTES.
+    SENSOR_DATA_RETENTION_DAYS = int(os.environ.get('SENSOR_DATA_RETENTION_DAYS', 0))
+    SENSOR_DATA_ROLLUP_1M_RETENTION_DAYS = int(os.environ.get('SENSOR_DATA_ROLLUP_1M_RETENTION_DAYS', 0))
+    SENSOR_DATA_ROLLUP_1H_RETENTION_DAYS = int(os.environ.get('SENSOR_DATA_ROLLUP_1H_RETENTION_DAYS', 0))
+    SENSOR_DATA_ROLLUP_1D_RETENTION_DAYS = int(os.environ.get('SENSOR_DATA_ROLLUP_1D_RETENTION_DAYS', 0))
+    SENSOR_DATA_RETENTION_MINUTES = int(os.environ.get('SENSOR_DATA_RETENTION_MINUTES', 60))
+    SENSOR_DATA_RETENTION_BATCH_SIZE = int(os.environ.get('SENSOR_DATA_RETENTION_BATCH_SIZE', 5000))
+    # Primary key of sensor_data: 'uuid' (String(36), random) or 'bigint' (BIGINT AUTO_INCREMENT, smaller
+    # indexes and append-only inserts). Switching an existing table to bigint rebuilds it once at startup.
+    SENSOR_DATA_KEY = os.environ.get('SENSOR_DATA_KEY', 'uuid')
+    # 'monthly' partitions sensor_data by month on MySQL/MariaDB, the retention then drops whole months
+    # instead of deleting rows. 'none' uses batched deletes.
+    SENSOR_DATA_PARTITIONING = os.environ.get('SENSOR_DATA_PARTITIONING', 'none')
+    # Days older than SENSOR_DATA_ARCHIVE_AFTER_DAYS are moved to Parquet files in SENSOR_DATA_ARCHIVE_DIR
+    # (needs pyarrow) before the retention runs, empty disables the archive. Archived raw data is deleted
+    # from the database, SENSOR_DATA_RETENTION_DAYS is not used then. Reads merge both.
+    SENSOR_DATA_ARCHIVE_DIR = os.environ.get('SENSOR_DATA_ARCHIVE_DIR', '')
+    SENSOR_DATA_ARCHIVE_AFTER_DAYS = int(os.environ.get('SENSOR_DATA_ARCHIVE_AFTER_DAYS', 30))
+    SENSOR_DATA_ARCHIVE_ROW_GROUP_SIZE = int(os.environ.get('SENSOR_DATA_ARCHIVE_ROW_GROUP_SIZE', 65536))
+    # Where sensor readings are stored: database (sensor_data table of the app database) or sqlite
+    # (embedded SQLite file in WAL mode at SENSOR_DATA_STORE_PATH, put it on a volume; no rollups, archive
+    # or partitioning then)
+    SENSOR_DATA_STORE = os.environ.get('SENSOR_DATA_STORE', 'database')
+    SENSOR_DATA_STORE_PATH = os.environ.get('SENSOR_DATA_STORE_PATH', 'data/sensor_data.sqlite3')
+
     # API Security
     API_KEY = os.environ.get('API_KEY')
 
     # Planner
-    PLANNER_SERVICE_URL = os.environ.get('PLANNER_SERVICE_URL')
\ No newline at end of file
+    PLANNER_SERVICE_URL = os.environ.get('PLANNER_SERVICE_URL')
+    # Solve the building as concurrent per room and cleaning route subproblems merged into one plan
+    PLANNER_DECOMPOSE_ROOMS = os.environ.get('PLANNER_DECOMPOSE_ROOMS', 'false').lower() == 'true'
+    PLANNER_MAX_PARALLEL_JOBS = int(os.environ.get('PLANNER_MAX_PARALLEL_JOBS', 4))
+    # The cron planner run only replans rooms whose input changed, older plans are replanned anyway (0 never)
+    PLANNER_MAX_PLAN_AGE_SECONDS = int(os.environ.get('PLANNER_MAX_PLAN_AGE_SECONDS', 3600))
+    # Solved plans keyed by the canonical problem, re-bound to the device uuids of rooms in the same state
+    PLAN_CACHE_ENABLED = os.environ.get('PLAN_CACHE_ENABLED', 'true').lower() == 'true'
+    PLAN_CACHE_MAX_ENTRIES = int(os.environ.get('PLAN_CACHE_MAX_ENTRIES', 1024))
+    PLAN_CACHE_TTL_SECONDS = int(os.environ.get('PLAN_CACHE_TTL_SECONDS', 3600))
@@ -1,9 +1,14 @@
 import logging
 from datetime import datetime, timedelta
 from flask import current_app
-from backend.extensions import db
+from backend.extensions import db, consumer_session
 from backend.models.models import Device
-from backend.mqtt.utils.cacheUtils import remove_device_from_cache
+from backend.mqtt.utils.cacheUtils import flush_device_cache
+from backend.mqtt.utils.cacheInvalidationUtils import broadcast_cache_invalidation, INVALIDATE_DEVICES, INVALIDATE_OFFLINE
+from backend.models.rollups import update_sensor_data_rollups
+from backend.models.retention import apply_sensor_data_retention
+from backend.models.archive import archive_sensor_data
+from backend.models.timeseries import get_timeseries_store
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from backend.aiplaning.pddl_converter_main import run_planner_with_db_data
@@ -19,6 +24,9 @@ def _mark_devices_offline():
     Runs every 30 minutes.
     """
     try:
+        # Write the cached last_seen values first, so recently seen devices are not marked offline
+        flush_device_cache(current_app._get_current_object())
+
         with current_app.app_context():
             # Calculate the threshold time (mark_devices_offline_after_hours hours ago)
             threshold_time = datetime.utcnow() - timedelta(minutes=mark_devices_offline_after_minutes)
@@ -37,6 +45,7 @@ def _mark_devices_offline():
                 
                 # Commit all changes at once
                 db.session.commit()
+                broadcast_cache_invalidation(current_app, INVALIDATE_OFFLINE, [device.device_id for device in offline_devices])
                 logging.info(f"Successfully marked {len(offline_devices)} devices as offline")
             else:
                 logging.info("No devices to mark as offline")
@@ -75,18 +84,15 @@ def _cleanup_old_devices():
                     device_ids_to_remove.append(device.device_id)
                     logging.info(f"Deleting old device {device.device_id} (last seen: {device.last_seen})")
                     
-                    # Remove from cache first
-                    try:
-                        remove_device_from_cache(device.device_id)
-                        logging.debug(f"Removed device {device.device_id} from cache")
-                    except Exception as cache_error:
-                        logging.warning(f"Failed to remove device {device.device_id} from cache: {cache_error}")
-                    
                     # Delete from database
                     db.session.delete(device)
                 
+                device_pks = [device.id for device in old_devices]
                 # Commit all deletions at once
                 db.session.commit()
+                get_timeseries_store().delete_devices(device_pks)
+                # Removes them from the device caches of all processes and forgets the mappings deleted with them
+                broadcast_cache_invalidation(current_app, INVALIDATE_DEVICES, device_ids_to_remove)
                 logging.info(f"Successfully deleted {len(old_devices)} old devices")
                 
             else:
@@ -109,45 +115,102 @@ def start_scheduler(app):
     
     scheduler = BackgroundScheduler()
     
-    # Wrapper functions that ensure app context is available
+    # Wrapper functions that ensure app context is available, every job runs with a database session of its own
     def mark_devices_offline():
-        with app.app_context():
+        with consumer_session(app, 'cron-mark-devices-offline'):
             _mark_devices_offline()
     
     def cleanup_old_devices():
-        with app.app_context():
+        with consumer_session(app, 'cron-cleanup-old-devices'):
             _cleanup_old_devices()
 
+    def flush_device_states():
+        with consumer_session(app, 'cron-flush-device-cache'):
+            flush_device_cache(app)
+
+    def update_rollups():
+        with consumer_session(app, 'cron-update-rollups'):
+            update_sensor_data_rollups(app, app.config['SENSOR_DATA_ROLLUP_LAG_SECONDS'])
+
+    def apply_retention():
+        with consumer_session(app, 'cron-retention'):
+            # Archived raw data is deleted by the retention, so archive first
+            archive_sensor_data(app)
+            apply_sensor_data_retention(app)
+
     def run_planning():
-        with app.app_context():
-            run_planner_with_db_data(True)
-    
-    # Job 1: Mark devices offline
-    scheduler.add_job(
-        func=mark_devices_offline,
-        trigger=IntervalTrigger(minutes=mark_devices_offline_after_minutes),
-        id='mark_devices_offline',
-        name=f'Mark devices offline if not seen for {mark_devices_offline_after_minutes} minutes',
-        replace_existing=True
-    )
+        with consumer_session(app, 'cron-run-planning'):
+            # The planner reads the device values from the database
+            flush_device_cache(app)
+            # Only rooms with a changed simplified value, occupancy, online status or mapping are replanned
+            run_planner_with_db_data(True, only_changed=True)
     
-    # Job 2: Cleanup old devices
+    # Every partition process (MQTT_PARTITION_COUNT > 1) runs a scheduler, but only partition 0 runs
+    # the jobs on the whole database. Every process writes the device states of its own device cache.
+    singleton_jobs = app.config['MQTT_PARTITION_INDEX'] == 0
+
+    # Job 1: Write the device states of the device cache
+    flush_seconds = app.config['DEVICE_CACHE_FLUSH_SECONDS']
     scheduler.add_job(
-        func=cleanup_old_devices,
-        trigger=IntervalTrigger(minutes=delete_after_minutes),
-        id='cleanup_old_devices',
-        name=f'Delete devices not seen for {delete_after_minutes} minutes',
+        func=flush_device_states,
+        trigger=IntervalTrigger(seconds=flush_seconds),
+        id='flush_device_cache',
+        name=f'Write cached device states every {flush_seconds} seconds',
         replace_existing=True
     )
 
-    # Job 3:
-    scheduler.add_job(
-         func=run_planning,
-         trigger=IntervalTrigger(seconds=run_planner_every_seconds),
-         id='run_planning',
-         name=f'Runs AI Plannin every {run_planner_every_seconds} seconds',
-         replace_existing=True
-    )
+    if not singleton_jobs:
+        logging.info(f"Partition {app.config['MQTT_PARTITION_INDEX']} only flushes its device cache, partition 0 runs the other jobs")
+    else:
+        # Job 2: Mark devices offline
+        scheduler.add_job(
+            func=mark_devices_offline,
+            trigger=IntervalTrigger(minutes=mark_devices_offline_after_minutes),
+            id='mark_devices_offline',
+            name=f'Mark devices offline if not seen for {mark_devices_offline_after_minutes} minutes',
+            replace_existing=True
+        )
+
+        # Job 3: Cleanup old devices
+        scheduler.add_job(
+            func=cleanup_old_devices,
+            trigger=IntervalTrigger(minutes=delete_after_minutes),
+            id='cleanup_old_devices',
+            name=f'Delete devices not seen for {delete_after_minutes} minutes',
+            replace_existing=True
+        )
+
+        # Job 4: Roll up the sensor data into the 1m, 1h and 1d rollups (only from the sensor_data table of the app database)
+        rollup_seconds = app.config['SENSOR_DATA_ROLLUP_SECONDS']
+        if get_timeseries_store().uses_app_database:
+            scheduler.add_job(
+                func=update_rollups,
+                trigger=IntervalTrigger(seconds=rollup_seconds),
+                id='update_sensor_data_rollups',
+                name=f'Roll up sensor data every {rollup_seconds} seconds',
+                replace_existing=True
+            )
+        else:
+            logging.info(f"Sensor data rollups disabled for SENSOR_DATA_STORE={get_timeseries_store().name}")
+
+        # Job 5: Archive old sensor data to Parquet, delete expired sensor data and rollups
+        retention_minutes = app.config['SENSOR_DATA_RETENTION_MINUTES']
+        scheduler.add_job(
+            func=apply_retention,
+            trigger=IntervalTrigger(minutes=retention_minutes),
+            id='apply_sensor_data_retention',
+            name=f'Delete expired sensor data every {retention_minutes} minutes',
+            replace_existing=True
+        )
+
+        # Job 6: Plan with the states in the database, the other partitions flush theirs every DEVICE_CACHE_FLUSH_SECONDS
+        scheduler.add_job(
+             func=run_planning,
+             trigger=IntervalTrigger(seconds=run_planner_every_seconds),
+             id='run_planning',
+             name=f'Runs AI Plannin every {run_planner_every_seconds} seconds',
+             replace_existing=True
+        )
     scheduler.start()
     logging.info("Device management scheduler started")
     
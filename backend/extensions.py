@@ -1,5 +1,56 @@
+import threading
+from contextlib import contextmanager
+from flask.globals import app_ctx
 from flask_sqlalchemy import SQLAlchemy
 from backend.services.pddl_service import PDDLPlannerService
 
-db = SQLAlchemy()
-pddl_service = PDDLPlannerService()
\ No newline at end of file
+# Name of the consumer (MQTT ingest worker, scheduler job) running in this thread, None for Flask requests
+_consumer = threading.local()
+
+
+def current_consumer():
+    """Name of the consumer of the current thread, None outside of consumer_session"""
+    return getattr(_consumer, 'name', None)
+
+
+def _session_scope():
+    """
+    Flask requests get one session per app context (the Flask-SQLAlchemy default).
+    Inside consumer_session the session belongs to the consumer thread, so the nested
+    app_context() blocks of the ingest and job code share one session and one connection.
+    """
+    consumer = current_consumer()
+    if consumer is not None:
+        return 'consumer', consumer, threading.get_ident()
+    return id(app_ctx._get_current_object())
+
+
+class ConsumerScopedSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy extension whose consumer sessions are removed by consumer_session, not by the app context teardown"""
+
+    def _teardown_session(self, exc):
+        if current_consumer() is None:
+            super()._teardown_session(exc)
+
+
+db = ConsumerScopedSQLAlchemy(session_options={'scopefunc': _session_scope})
+pddl_service = PDDLPlannerService()
+
+
+@contextmanager
+def consumer_session(app, name):
+    """
+    Run the block with a database session of its own for the consumer name (e.g. mqtt-ingest-0),
+    instead of the session of whatever app context happens to be pushed.
+    The session is closed and its connection returned to the pool at the end of the block.
+    """
+    previous = current_consumer()
+    _consumer.name = name
+    try:
+        with app.app_context():
+            try:
+                yield db.session
+            finally:
+                db.session.remove()
+    finally:
+        _consumer.name = previous
@@ -0,0 +1,326 @@
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import select, func
+from backend.extensions import db
+from backend.models.models import Device, Room, Floor, SensorData
+from backend.models.timeseries import STORE_DATABASE
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Everything before the date in this file is archived, the rows are deleted from the database by the retention
+WATERMARK_FILE = '_archived_until'
+PARTITION_DATE_FORMAT = '%Y-%m-%d'
+
+_archive_lock = threading.Lock()
+# (archive dir, watermark) -> pyarrow dataset, rediscovered when an archive run moved the watermark
+_dataset_cache = {}
+
+
+def archive_schema():
+    return pa.schema([
+        ('id', pa.string()),
+        ('device_id', pa.string()),
+        ('type_name', pa.string()),
+        ('room_number', pa.string()),
+        ('timestamp', pa.timestamp('us')),
+        ('value', pa.string()),
+        ('value_numeric', pa.float64()),
+        ('simplified_value', pa.int8()),
+    ])
+
+
+def _partitioning():
+    return ds.partitioning(pa.schema([('date', pa.string()), ('floor', pa.int32())]), flavor='hive')
+
+
+def is_archive_enabled(config):
+    """True if SENSOR_DATA_ARCHIVE_DIR is set, pyarrow is installed and the sensor data is in the app database"""
+    return bool(config.get('SENSOR_DATA_ARCHIVE_DIR')) and pa is not None and \
+        config.get('SENSOR_DATA_STORE', STORE_DATABASE) == STORE_DATABASE
+
+
+def get_archive_watermark(archive_dir):
+    """Exclusive end of the archived time range (midnight of a day), None if nothing was archived yet"""
+    try:
+        with open(os.path.join(archive_dir, WATERMARK_FILE)) as file:
+            return datetime.fromisoformat(file.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+def _set_archive_watermark(archive_dir, watermark):
+    path = os.path.join(archive_dir, WATERMARK_FILE)
+    temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temporary_path, 'w') as file:
+        file.write(watermark.isoformat())
+    os.replace(temporary_path, path)
+
+
+def _floor_devices():
+    """Returns: dict floor_number -> list of (device pk, device_id, type_name, room_number) sorted by device_id"""
+    devices = Device.__table__.c
+    rooms = Room.__table__.c
+    floors = Floor.__table__.c
+    rows = db.session.execute(
+        select(floors.floor_number, devices.id, devices.device_id, devices.type_name, rooms.room_number)
+        .select_from(Device.__table__.join(Room.__table__, rooms.id == devices.room_id)
+                     .join(Floor.__table__, floors.id == rooms.floor_id))
+        .order_by(floors.floor_number, devices.device_id)
+    ).all()
+    floor_devices = {}
+    for floor_number, device_pk, device_id, type_name, room_number in rows:
+        floor_devices.setdefault(floor_number, []).append((device_pk, device_id, type_name, room_number))
+    return floor_devices
+
+
+def _oldest_hot_timestamp(device_pks):
+    """Oldest sensor data timestamp, one (device_id, timestamp) index lookup per device"""
+    c = SensorData.__table__.c
+    statement = select(func.min(c.timestamp)).where(c.device_id == db.bindparam('device_pk'))
+    oldest = [db.session.execute(statement, {'device_pk': device_pk}).scalar() for device_pk in device_pks]
+    oldest = [timestamp for timestamp in oldest if timestamp is not None]
+    return min(oldest) if oldest else None
+
+
+def _write_floor_day(archive_dir, day, floor_number, devices, row_group_size, chunk_size):
+    """
+    Write the sensor data of one floor and day to date=<day>/floor=<floor>/part-0.parquet.
+    Devices are written in device_id order, every device in time order, so the row group statistics
+    of device_id and timestamp are narrow and scans can skip row groups.
+    The file is written under a temporary name and renamed when complete.
+
+    Returns:
+        int: Number of archived rows
+    """
+    c = SensorData.__table__.c
+    statement = select(c.id, c.timestamp, c.value, c.value_numeric, c.simplified_value).where(
+        c.device_id == db.bindparam('device_pk'), c.timestamp >= day, c.timestamp < day + timedelta(days=1)
+    ).order_by(c.timestamp)
+
+    schema = archive_schema()
+    directory = os.path.join(archive_dir, f"date={day.strftime(PARTITION_DATE_FORMAT)}", f"floor={floor_number}")
+    path = os.path.join(directory, 'part-0.parquet')
+    temporary_path = os.path.join(directory, f".part-0.{uuid.uuid4().hex}.tmp")
+
+    written = 0
+    writer = None
+    buffer = []
+    try:
+        with db.engine.connect() as connection:
+            for device_pk, device_id, type_name, room_number in devices:
+                result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(
+                    statement, {'device_pk': device_pk})
+                for rows in result.partitions(chunk_size):
+                    buffer.extend((str(row.id), device_id, type_name, room_number, row.timestamp, row.value,
+                                   row.value_numeric, row.simplified_value) for row in rows)
+                    if len(buffer) < row_group_size:
+                        continue
+                    if writer is None:
+                        os.makedirs(directory, exist_ok=True)
+                        writer = pq.ParquetWriter(temporary_path, schema, compression='zstd')
+                    writer.write_table(_rows_to_table(buffer, schema), row_group_size=row_group_size)
+                    written += len(buffer)
+                    buffer = []
+
+        if buffer:
+            if writer is None:
+                os.makedirs(directory, exist_ok=True)
+                writer = pq.ParquetWriter(temporary_path, schema, compression='zstd')
+            writer.write_table(_rows_to_table(buffer, schema), row_group_size=row_group_size)
+            written += len(buffer)
+        if writer is not None:
+            writer.close()
+            writer = None
+            os.replace(temporary_path, path)
+        return written
+    finally:
+        if writer is not None:
+            writer.close()
+            os.remove(temporary_path)
+
+
+def _rows_to_table(rows, schema):
+    columns = list(zip(*rows))
+    return pa.Table.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                                schema=schema)
+
+
+def archive_sensor_data(app, now=None):
+    """
+    Move whole days of sensor data older than SENSOR_DATA_ARCHIVE_AFTER_DAYS into Parquet files under
+    SENSOR_DATA_ARCHIVE_DIR, partitioned by date and floor (hive layout: date=YYYY-MM-DD/floor=N/).
+    A day is complete on disk before the watermark moves past it. The archived rows are deleted from the
+    database by the retention job, reads merge both tiers at the watermark.
+
+    Returns:
+        dict: archived day -> number of rows
+    """
+    config = app.config
+    if not is_archive_enabled(config):
+        if config.get('SENSOR_DATA_ARCHIVE_DIR'):
+            logging.warning("SENSOR_DATA_ARCHIVE_DIR is set but pyarrow is not installed, not archiving")
+        return {}
+    if not _archive_lock.acquire(blocking=False):
+        logging.info("Sensor data archive still running, skipping")
+        return {}
+
+    archive_dir = config['SENSOR_DATA_ARCHIVE_DIR']
+    try:
+        with app.app_context():
+            try:
+                os.makedirs(archive_dir, exist_ok=True)
+                floor_devices = _floor_devices()
+                cutoff = (now or datetime.utcnow()) - timedelta(days=config['SENSOR_DATA_ARCHIVE_AFTER_DAYS'])
+                end_day = datetime(cutoff.year, cutoff.month, cutoff.day)
+
+                day = get_archive_watermark(archive_dir)
+                if day is None:
+                    oldest = _oldest_hot_timestamp([device[0] for devices in floor_devices.values() for device in devices])
+                    if oldest is None:
+                        return {}
+                    day = datetime(oldest.year, oldest.month, oldest.day)
+
+                archived = {}
+                while day < end_day:
+                    rows = 0
+                    for floor_number, devices in floor_devices.items():
+                        rows += _write_floor_day(archive_dir, day, floor_number, devices,
+                                                 config['SENSOR_DATA_ARCHIVE_ROW_GROUP_SIZE'],
+                                                 config['SENSOR_DATA_RETENTION_BATCH_SIZE'])
+                    day += timedelta(days=1)
+                    _set_archive_watermark(archive_dir, day)
+                    archived[(day - timedelta(days=1)).strftime(PARTITION_DATE_FORMAT)] = rows
+
+                if archived:
+                    logging.info(f"Sensor data archive: {archived}")
+                return archived
+            except Exception as e:
+                db.session.rollback()
+                logging.error(f"Error archiving sensor data: {str(e)}")
+                return {}
+    finally:
+        _archive_lock.release()
+
+
+def _dataset(archive_dir, watermark):
+    key = (archive_dir, watermark)
+    dataset = _dataset_cache.get(key)
+    if dataset is None:
+        dataset = ds.dataset(archive_dir, format='parquet', partitioning=_partitioning())
+        _dataset_cache.clear()
+        _dataset_cache[key] = dataset
+    return dataset
+
+
+def cold_filter(device_ids=None, start=None, end=None, floor_number=None, room_number=None):
+    """
+    Dataset filter expression. The date and floor conditions prune partition directories,
+    device_id and timestamp are pushed down to the row group statistics.
+    """
+    conditions = []
+    if device_ids:
+        conditions.append(ds.field('device_id').isin(list(device_ids)))
+    if start is not None:
+        conditions.append(ds.field('date') >= start.strftime(PARTITION_DATE_FORMAT))
+        conditions.append(ds.field('timestamp') >= pa.scalar(start, type=pa.timestamp('us')))
+    if end is not None:
+        conditions.append(ds.field('date') <= end.strftime(PARTITION_DATE_FORMAT))
+        conditions.append(ds.field('timestamp') < pa.scalar(end, type=pa.timestamp('us')))
+    if floor_number is not None:
+        conditions.append(ds.field('floor') == floor_number)
+    if room_number is not None:
+        conditions.append(ds.field('room_number') == room_number)
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def get_cold_range(config, start=None):
+    """
+    Returns: (archive dir, watermark) if a range beginning at start (None: from the beginning) reaches
+    into the archive, otherwise None
+    """
+    if not is_archive_enabled(config):
+        return None
+    archive_dir = config['SENSOR_DATA_ARCHIVE_DIR']
+    watermark = get_archive_watermark(archive_dir)
+    if watermark is None or (start is not None and start >= watermark):
+        return None
+    return archive_dir, watermark
+
+
+def read_cold_rows(archive_dir, device_id, start, end, columns):
+    """
+    Archived rows of one device in [start, end), sorted by timestamp.
+    Returns: pyarrow.Table with the columns
+    """
+    watermark = get_archive_watermark(archive_dir)
+    table = _dataset(archive_dir, watermark).to_table(
+        columns=list(columns), filter=cold_filter([device_id], start, end)
+    )
+    if 'timestamp' in columns and table.num_rows:
+        table = table.sort_by('timestamp')
+    return table
+
+
+def cold_stats(archive_dir, device_id, start, end):
+    """Returns: (count, first timestamp, last timestamp) of the archived rows of one device in [start, end)"""
+    watermark = get_archive_watermark(archive_dir)
+    table = _dataset(archive_dir, watermark).to_table(
+        columns=['timestamp'], filter=cold_filter([device_id], start, end)
+    )
+    if not table.num_rows:
+        return 0, None, None
+    bounds = pa.compute.min_max(table['timestamp'])
+    return table.num_rows, bounds['min'].as_py(), bounds['max'].as_py()
+
+
+def iter_cold_batches(archive_dir, columns, batch_size, **filters):
+    """Archived rows matching the filters (see cold_filter) as record batches of at most batch_size rows"""
+    watermark = get_archive_watermark(archive_dir)
+    scanner = _dataset(archive_dir, watermark).scanner(
+        columns=list(columns), filter=cold_filter(**filters), batch_size=batch_size
+    )
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            yield batch
+
+
+def aggregate_cold_rows(table, grid_start_epoch, bucket_seconds):
+    """
+    Aggregate archived rows (timestamp, value_numeric, simplified_value, sorted by timestamp) into grid buckets.
+    Returns: list of [bucket offset, sum, min, max, count, low, mid, high] like the SQL aggregation
+    """
+    table = table.filter(pa.compute.is_valid(table['value_numeric']))
+    if not table.num_rows:
+        return []
+    seconds = table['timestamp'].to_numpy().astype('datetime64[s]').astype(np.int64) - grid_start_epoch
+    offsets = seconds - seconds % bucket_seconds
+    values = table['value_numeric'].to_numpy()
+    simplified = table['simplified_value'].to_numpy(zero_copy_only=False)
+
+    # Sorted by timestamp, so every bucket is one contiguous run
+    bucket_offsets, starts = np.unique(offsets, return_index=True)
+    counts = np.diff(np.append(starts, len(offsets)))
+    return [list(row) for row in zip(
+        bucket_offsets.tolist(),
+        np.add.reduceat(values, starts).tolist(),
+        np.minimum.reduceat(values, starts).tolist(),
+        np.maximum.reduceat(values, starts).tolist(),
+        counts.tolist(),
+        np.add.reduceat((simplified == -1).astype(np.int64), starts).tolist(),
+        np.add.reduceat((simplified == 0).astype(np.int64), starts).tolist(),
+        np.add.reduceat((simplified == 1).astype(np.int64), starts).tolist(),
+    )]
@@ -0,0 +1,327 @@
+import logging
+import math
+import threading
+from datetime import datetime
+from sqlalchemy import inspect, select, update, bindparam, text, func, Integer
+from backend.extensions import db
+from backend.models.models import SensorData
+from backend.models.rollups import suspend_rollups, resume_rollups
+
+_sensor_data_table = SensorData.__table__
+
+
+def upgrade_sensor_data_schema(app):
+    """
+    Add the value_numeric column and the (device_id, timestamp) index to an existing sensor_data table.
+    db.create_all() only creates missing tables, so older databases are upgraded here. Idempotent.
+
+    Returns:
+        bool: True if value_numeric was added and existing rows have to be backfilled
+    """
+    with app.app_context():
+        inspector = inspect(db.engine)
+        if not inspector.has_table(_sensor_data_table.name):
+            return False
+
+        column_added = False
+        columns = {column['name'] for column in inspector.get_columns(_sensor_data_table.name)}
+        if 'value_numeric' not in columns:
+            column_type = _sensor_data_table.c.value_numeric.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as connection:
+                connection.execute(text(f"ALTER TABLE {_sensor_data_table.name} ADD COLUMN value_numeric {column_type}"))
+            column_added = True
+            logging.info("Added column sensor_data.value_numeric")
+
+        indexes = {index['name'] for index in inspector.get_indexes(_sensor_data_table.name)}
+        for index in _sensor_data_table.indexes:
+            if index.name not in indexes:
+                logging.info(f"Creating index {index.name}, this can take a while on large tables")
+                index.create(bind=db.engine)
+                logging.info(f"Created index {index.name}")
+
+        upgrade_sensor_data_foreign_key(app)
+        upgrade_sensor_data_key(app)
+        return column_added
+
+
+def _is_mysql(engine):
+    return engine.dialect.name in ('mysql', 'mariadb')
+
+
+def upgrade_sensor_data_foreign_key(app):
+    """
+    Recreate the sensor_data.device_id foreign key of older MySQL/MariaDB databases with ON DELETE CASCADE,
+    the ORM no longer deletes the sensor data of a deleted device itself.
+    A missing foreign key of an unpartitioned table (e.g. left by a failed partitioning) is added again, after
+    deleting the readings of devices that no longer exist.
+    Partitioned tables have no foreign keys and SQLite cannot alter them, both are skipped. Idempotent.
+    """
+    with app.app_context():
+        if not _is_mysql(db.engine):
+            return
+        foreign_keys = [foreign_key for foreign_key in inspect(db.engine).get_foreign_keys(_sensor_data_table.name)
+                        if foreign_key['referred_table'] == 'devices']
+        if not foreign_keys:
+            with db.engine.begin() as connection:
+                if get_sensor_data_partitions(connection):
+                    return
+                orphans = connection.execute(text(
+                    f"DELETE FROM {_sensor_data_table.name} WHERE device_id NOT IN (SELECT id FROM devices)"
+                )).rowcount
+                connection.execute(text(
+                    f"ALTER TABLE {_sensor_data_table.name} "
+                    f"ADD FOREIGN KEY (device_id) REFERENCES devices (id) ON DELETE CASCADE"
+                ))
+            logging.warning(f"Restored the missing foreign key of sensor_data, deleted {orphans} orphaned readings")
+            return
+        for foreign_key in foreign_keys:
+            if (foreign_key.get('options') or {}).get('ondelete', '').upper() == 'CASCADE':
+                continue
+            with db.engine.begin() as connection:
+                connection.execute(text(
+                    f"ALTER TABLE {_sensor_data_table.name} DROP FOREIGN KEY {foreign_key['name']}, "
+                    f"ADD CONSTRAINT {foreign_key['name']} FOREIGN KEY (device_id) REFERENCES devices (id) ON DELETE CASCADE"
+                ))
+            logging.info(f"Recreated foreign key {foreign_key['name']} of sensor_data with ON DELETE CASCADE")
+
+
+def upgrade_sensor_data_key(app):
+    """
+    Switch the primary key of an existing sensor_data table from String(36) UUIDs to BIGINT AUTO_INCREMENT
+    if SENSOR_DATA_KEY is bigint. The rows get new ids, nothing references sensor_data.id.
+    MySQL/MariaDB rebuilds the table with one ALTER TABLE and keeps the (id, timestamp) key of a partitioned table,
+    SQLite copies the rows into a new table in time order. Runs at startup before the MQTT client inserts rows.
+    Switching back to UUIDs is not supported. Idempotent.
+
+    Returns:
+        bool: True if the key was changed
+    """
+    table_name = _sensor_data_table.name
+    with app.app_context():
+        inspector = inspect(db.engine)
+        if not inspector.has_table(table_name):
+            return False
+        id_type = next(column['type'] for column in inspector.get_columns(table_name) if column['name'] == 'id')
+        table_bigint = isinstance(id_type, Integer)
+        model_bigint = isinstance(_sensor_data_table.c.id.type, Integer)
+        if table_bigint == model_bigint:
+            return False
+        if table_bigint:
+            logging.error("sensor_data has BIGINT keys but SENSOR_DATA_KEY is uuid, switching back is not supported")
+            return False
+
+        logging.info("Switching the sensor_data primary key to BIGINT AUTO_INCREMENT, this rebuilds the table")
+        with db.engine.begin() as connection:
+            if _is_mysql(db.engine):
+                key = 'new_id, timestamp' if get_sensor_data_partitions(connection) else 'new_id'
+                connection.execute(text(
+                    f"ALTER TABLE {table_name} ADD COLUMN new_id BIGINT NOT NULL AUTO_INCREMENT FIRST, "
+                    f"DROP PRIMARY KEY, ADD PRIMARY KEY ({key}), DROP COLUMN id"
+                ))
+                connection.execute(text(f"ALTER TABLE {table_name} CHANGE COLUMN new_id id BIGINT NOT NULL AUTO_INCREMENT"))
+            else:
+                # Index names are global in SQLite, the new table creates them again
+                for index in inspector.get_indexes(table_name):
+                    connection.execute(text(f"DROP INDEX {index['name']}"))
+                connection.execute(text(f"ALTER TABLE {table_name} RENAME TO {table_name}_uuid"))
+                _sensor_data_table.create(bind=connection)
+                columns = ', '.join(column.name for column in _sensor_data_table.c if column.name != 'id')
+                connection.execute(text(
+                    f"INSERT INTO {table_name} ({columns}) SELECT {columns} FROM {table_name}_uuid ORDER BY timestamp"
+                ))
+                connection.execute(text(f"DROP TABLE {table_name}_uuid"))
+        logging.info("Switched the sensor_data primary key to BIGINT AUTO_INCREMENT")
+        return True
+
+
+def month_start(timestamp, months=0):
+    """First day of the month of timestamp, moved by months"""
+    month_index = timestamp.year * 12 + timestamp.month - 1 + months
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return month.strftime('p%Y%m')
+
+
+def _partition_definition(month):
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN ('{month_start(month, 1):%Y-%m-%d %H:%M:%S}')"
+
+
+def get_sensor_data_partitions(connection):
+    """
+    Monthly partitions of sensor_data (MySQL/MariaDB only).
+    Returns: list of (partition name, exclusive upper bound or None for the MAXVALUE partition) ordered by bound,
+             empty if the table is not partitioned
+    """
+    rows = connection.execute(text(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION"
+    ), {'table': _sensor_data_table.name}).all()
+
+    partitions = []
+    for name, description in rows:
+        bound = description.strip("'") if description else 'MAXVALUE'
+        partitions.append((name, None if bound == 'MAXVALUE' else datetime.fromisoformat(bound)))
+    return partitions
+
+
+def enable_sensor_data_partitioning(app, months_ahead=2):
+    """
+    Partition sensor_data by month on MySQL/MariaDB (RANGE COLUMNS on timestamp), so the retention drops
+    whole months instead of deleting rows. InnoDB does not allow foreign keys on partitioned tables and the
+    partitioning column has to be part of the primary key, so the foreign key to devices is dropped and the
+    primary key becomes (id, timestamp). Rebuilds the table once, which takes a while on large tables. Idempotent.
+
+    Returns:
+        bool: True if the table is partitioned
+    """
+    with app.app_context():
+        if not _is_mysql(db.engine):
+            logging.warning("Sensor data partitioning needs MySQL/MariaDB, using row deletes for the retention")
+            return False
+
+        with db.engine.begin() as connection:
+            if get_sensor_data_partitions(connection):
+                return True
+
+            first = connection.execute(select(func.min(_sensor_data_table.c.timestamp))).scalar() or datetime.utcnow()
+            months = []
+            month = month_start(first)
+            last_month = month_start(datetime.utcnow(), months_ahead)
+            while month <= last_month:
+                months.append(month)
+                month = month_start(month, 1)
+
+            logging.info(f"Partitioning sensor_data into {len(months)} monthly partitions, this can take a while")
+            partitions = ', '.join([_partition_definition(month) for month in months] +
+                                   ["PARTITION pmax VALUES LESS THAN (MAXVALUE)"])
+            # One statement, so a failing repartition leaves the foreign key in place (DDL commits implicitly).
+            # The partition options follow the alter specifications without a comma.
+            drop_foreign_keys = ''.join(f"DROP FOREIGN KEY {foreign_key['name']}, "
+                                        for foreign_key in inspect(connection).get_foreign_keys(_sensor_data_table.name))
+            try:
+                connection.execute(text(
+                    f"ALTER TABLE {_sensor_data_table.name} {drop_foreign_keys}DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp) "
+                    f"PARTITION BY RANGE COLUMNS(timestamp) ({partitions})"
+                ))
+            except Exception as e:
+                logging.error(f"Failed to partition sensor_data, using row deletes for the retention: {str(e)}")
+                return False
+        logging.info("Partitioned sensor_data by month")
+        return True
+
+
+def ensure_sensor_data_partitions(app, months_ahead=2):
+    """
+    Split the MAXVALUE partition, so monthly partitions exist up to months_ahead months from now.
+    pmax is empty in normal operation, so the split only changes the table definition.
+
+    Returns:
+        list: names of the created partitions
+    """
+    with app.app_context():
+        with db.engine.begin() as connection:
+            partitions = get_sensor_data_partitions(connection)
+            bounds = [bound for _, bound in partitions if bound is not None]
+            if not bounds:
+                return []
+
+            months = []
+            month = max(bounds)
+            last_month = month_start(datetime.utcnow(), months_ahead)
+            while month <= last_month:
+                months.append(month)
+                month = month_start(month, 1)
+            if not months:
+                return []
+
+            definitions = ', '.join([_partition_definition(month) for month in months] +
+                                    ["PARTITION pmax VALUES LESS THAN (MAXVALUE)"])
+            connection.execute(text(f"ALTER TABLE {_sensor_data_table.name} REORGANIZE PARTITION pmax INTO ({definitions})"))
+        created = [partition_name(month) for month in months]
+        logging.info(f"Created sensor_data partitions {', '.join(created)}")
+        return created
+
+
+def to_numeric_value(value):
+    """Convert a stored sensor value to float, None if it is not a finite number"""
+    try:
+        numeric_value = float(value)
+    except (ValueError, TypeError):
+        return None
+    return numeric_value if math.isfinite(numeric_value) else None
+
+
+def backfill_sensor_data_values(app, batch_size=10000):
+    """
+    Fill value_numeric of existing sensor data rows in batches of batch_size rows.
+    Walks the table in primary key order, every batch is its own transaction,
+    so the backfill can run next to the MQTT ingestion.
+    The rollups only aggregate value_numeric, they are suspended meanwhile and rebuilt
+    from the oldest converted reading afterwards.
+
+    Returns:
+        int: Number of updated rows
+    """
+    sensor_data = _sensor_data_table.c
+    select_first_batch = select(sensor_data.id, sensor_data.value, sensor_data.timestamp).where(
+        sensor_data.value_numeric.is_(None)
+    ).order_by(sensor_data.id).limit(batch_size)
+    # The id is a UUID string or a BIGINT (SENSOR_DATA_KEY), the first batch starts without a lower bound
+    select_next_batch = select_first_batch.where(sensor_data.id > bindparam('last_id'))
+    update_value = update(_sensor_data_table).where(sensor_data.id == bindparam('_id'))
+
+    updated = 0
+    last_id = None
+    oldest_converted = None
+    suspend_rollups()
+    try:
+        while True:
+            with app.app_context():
+                if last_id is None:
+                    rows = db.session.execute(select_first_batch).all()
+                else:
+                    rows = db.session.execute(select_next_batch, {'last_id': last_id}).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+
+                parameters = []
+                batch_oldest = None
+                for row in rows:
+                    numeric_value = to_numeric_value(row.value)
+                    if numeric_value is not None:
+                        parameters.append({'_id': row.id, 'value_numeric': numeric_value})
+                        if batch_oldest is None or row.timestamp < batch_oldest:
+                            batch_oldest = row.timestamp
+                if parameters:
+                    db.session.execute(update_value, parameters)
+                db.session.commit()
+
+            if batch_oldest is not None and (oldest_converted is None or batch_oldest < oldest_converted):
+                oldest_converted = batch_oldest
+            updated += len(parameters)
+            logging.info(f"Sensor data backfill: {updated} rows converted")
+    finally:
+        # Also after a failed batch, the committed batches are rolled up again
+        resume_rollups(app, oldest_converted)
+
+    logging.info(f"Sensor data backfill finished, {updated} rows converted")
+    return updated
+
+
+def start_sensor_data_backfill(app, batch_size=10000):
+    """Run backfill_sensor_data_values in a background thread"""
+    def run():
+        try:
+            backfill_sensor_data_values(app, batch_size)
+        except Exception as e:
+            logging.error(f"Sensor data backfill failed: {str(e)}")
+
+    # Before the thread starts, so the scheduler cannot run a rollup in between
+    suspend_rollups()
+    thread = threading.Thread(target=run, name="sensor-data-backfill", daemon=True)
+    thread.start()
+    return thread
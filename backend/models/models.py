@@ -1,11 +1,17 @@
-from sqlalchemy import String, Text, Boolean, Integer, DateTime, ForeignKey, Float, Enum, JSON
+from sqlalchemy import String, Text, Boolean, Integer, BigInteger, DateTime, ForeignKey, Float, Enum, JSON
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Optional, Union
+from backend.config import Config
 from backend.extensions import db
 import uuid
 import enum
 
+# Primary key of sensor_data, see SENSOR_DATA_KEY
+SENSOR_DATA_KEY_UUID = 'uuid'
+SENSOR_DATA_KEY_BIGINT = 'bigint'
+SENSOR_DATA_KEY_MODES = (SENSOR_DATA_KEY_UUID, SENSOR_DATA_KEY_BIGINT)
+
 class Floor(db.Model):
     __tablename__ = 'floors'
 
@@ -101,9 +107,12 @@ class Device(db.Model):
     
     # Relationship
     room: Mapped["Room"] = relationship(back_populates="devices")
+    # The database deletes the sensor data of a deleted device (ON DELETE CASCADE, or the retention
+    # drops it with its partition), the ORM does not load and delete the history row by row
     sensor_data: Mapped[List["SensorData"]] = relationship(
         back_populates="device", 
         cascade="all, delete-orphan",
+        passive_deletes=True,
         order_by="SensorData.timestamp.desc()"
     )
     device_type_config: Mapped[Optional["TypeNameConfig"]] = relationship( 
@@ -132,18 +141,65 @@ class SensorData(db.Model):
     """Store time-series data from sensors/actuators"""
     __tablename__ = 'sensor_data'
     
-    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    device_id: Mapped[str] = mapped_column(ForeignKey("devices.id"), nullable=False)
+    # uuid: random String(36), bigint: auto increment, 8 bytes and appended at the end of the clustered index.
+    # SQLite only auto increments INTEGER PRIMARY KEY, which is 64 bit as well.
+    if Config.SENSOR_DATA_KEY == SENSOR_DATA_KEY_BIGINT:
+        id: Mapped[Union[int, str]] = mapped_column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True,
+                                                    autoincrement=True)
+    else:
+        id: Mapped[Union[int, str]] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    device_id: Mapped[str] = mapped_column(ForeignKey("devices.id", ondelete="CASCADE"), nullable=False)
     value: Mapped[str] = mapped_column(Text, nullable=False)
+    # Numeric copy of value for range queries and aggregation, None if value is not numeric
+    value_numeric: Mapped[Optional[float]] = mapped_column(Float(precision=53))
     simplified_value: Mapped[int] = mapped_column(Integer)
     timestamp: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
     
     # Relationship
     device: Mapped["Device"] = relationship(back_populates="sensor_data")
     
+    # All sensor data queries filter on the device and a time range, ordered by time
+    __table_args__ = (
+        db.Index('ix_sensor_data_device_id_timestamp', 'device_id', 'timestamp'),
+    )
+    
     def __repr__(self) -> str:
         return f"SensorData(id={self.id!r}, device_id={self.device_id!r}, value={self.value!r}, timestamp={self.timestamp!r})"
 
+class SensorDataRollupMixin:
+    """
+    Columns of the sensor data rollups, one row per device and time bucket.
+    Only numeric readings are rolled up, avg is value_sum / count.
+    """
+    device_id: Mapped[str] = mapped_column(ForeignKey("devices.id", ondelete="CASCADE"), primary_key=True)
+    bucket_start: Mapped[datetime] = mapped_column(DateTime, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False)
+    value_min: Mapped[float] = mapped_column(Float(precision=53), nullable=False)
+    value_max: Mapped[float] = mapped_column(Float(precision=53), nullable=False)
+    value_sum: Mapped[float] = mapped_column(Float(precision=53), nullable=False)
+    # Value and time of the newest reading in the bucket
+    value_last: Mapped[float] = mapped_column(Float(precision=53), nullable=False)
+    last_timestamp: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    # Histogram of the simplified values (-1 low, 0 mid, 1 high)
+    low_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    mid_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    high_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(device_id={self.device_id!r}, bucket_start={self.bucket_start!r}, count={self.count!r})"
+
+class SensorDataRollupMinute(SensorDataRollupMixin, db.Model):
+    """Per minute rollup of sensor_data"""
+    __tablename__ = 'sensor_data_rollup_1m'
+
+class SensorDataRollupHour(SensorDataRollupMixin, db.Model):
+    """Per hour rollup of sensor_data_rollup_1m"""
+    __tablename__ = 'sensor_data_rollup_1h'
+
+class SensorDataRollupDay(SensorDataRollupMixin, db.Model):
+    """Per day rollup of sensor_data_rollup_1h"""
+    __tablename__ = 'sensor_data_rollup_1d'
+
 class SensorActuatorMapping(db.Model):
     """Store mappings between sensors and actuators with influence parameters"""
     __tablename__ = 'sensor_actuator_mappings'
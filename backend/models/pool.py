@@ -0,0 +1,132 @@
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from backend.extensions import current_consumer
+
+# Checkouts outside of consumer_session
+CONSUMER_FLASK = 'flask'
+
+
+def get_engine_options(config):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS from the DB_POOL_* settings.
+    SQLite (tests, local runs) keeps the pool SQLAlchemy chooses for it.
+    """
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        return options
+    options.setdefault('poolclass', InstrumentedQueuePool)
+    options.setdefault('pool_size', config['DB_POOL_SIZE'])
+    options.setdefault('max_overflow', config['DB_MAX_OVERFLOW'])
+    options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+    options.setdefault('pool_recycle', config['DB_POOL_RECYCLE'])
+    options.setdefault('pool_pre_ping', config['DB_POOL_PRE_PING'])
+    return options
+
+
+class PoolMetrics:
+    """Checkout counts, wait times and timeouts of the connection pool, per consumer"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stats = {
+                'checkouts': 0,
+                'timeouts': 0,
+                'total_wait_ms': 0.0,
+                'max_wait_ms': 0.0,
+                'max_checked_out': 0,
+            }
+            self._checked_out = 0
+            self._checked_out_by_consumer = {}
+            self._checkouts_by_consumer = {}
+
+    def record_wait(self, wait_ms, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self._stats['timeouts'] += 1
+                return
+            self._stats['total_wait_ms'] += wait_ms
+            self._stats['max_wait_ms'] = max(self._stats['max_wait_ms'], wait_ms)
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        consumer = current_consumer() or CONSUMER_FLASK
+        connection_record.info['consumer'] = consumer
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._checked_out += 1
+            self._stats['max_checked_out'] = max(self._stats['max_checked_out'], self._checked_out)
+            self._checked_out_by_consumer[consumer] = self._checked_out_by_consumer.get(consumer, 0) + 1
+            self._checkouts_by_consumer[consumer] = self._checkouts_by_consumer.get(consumer, 0) + 1
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        consumer = connection_record.info.pop('consumer', None)
+        if consumer is None:
+            return
+        with self._lock:
+            self._checked_out -= 1
+            remaining = self._checked_out_by_consumer.get(consumer, 1) - 1
+            if remaining:
+                self._checked_out_by_consumer[consumer] = remaining
+            else:
+                self._checked_out_by_consumer.pop(consumer, None)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['checked_out_by_consumer'] = dict(self._checked_out_by_consumer)
+            stats['checkouts_by_consumer'] = dict(self._checkouts_by_consumer)
+        total_wait = stats.pop('total_wait_ms')
+        stats['avg_wait_ms'] = round(total_wait / stats['checkouts'], 3) if stats['checkouts'] else 0.0
+        stats['max_wait_ms'] = round(stats['max_wait_ms'], 3)
+        return stats
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long a checkout waited for a free connection (or to open a new one)"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_metrics.record_wait(0.0, timed_out=True)
+            raise
+        pool_metrics.record_wait((time.perf_counter() - start) * 1000)
+        return connection
+
+
+def install_pool_metrics(engine):
+    """Count the checkouts and checkins of the engine's pool. Safe to call more than once."""
+    if not event.contains(engine, 'checkout', pool_metrics.on_checkout):
+        event.listen(engine, 'checkout', pool_metrics.on_checkout)
+        event.listen(engine, 'checkin', pool_metrics.on_checkin)
+
+
+def get_pool_stats(engine):
+    """
+    Returns:
+        dict: pool class, size, checked_in, checked_out, overflow (from the pool itself),
+              and the checkout/wait counters of pool_metrics
+    """
+    pool = engine.pool
+    stats = {'pool_class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'max_overflow': pool._max_overflow,
+            'timeout': pool.timeout(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+        })
+    stats.update(pool_metrics.get_stats())
+    return stats
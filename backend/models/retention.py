@@ -0,0 +1,175 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, bindparam, text
+from backend.extensions import db
+from backend.models.models import Device, SensorData
+from backend.models.timeseries import get_timeseries_store
+from backend.models.migrations import get_sensor_data_partitions, ensure_sensor_data_partitions
+from backend.models.rollups import LEVEL_MINUTE, LEVEL_HOUR, LEVEL_DAY, get_rollup_watermark
+from backend.models.archive import is_archive_enabled, get_archive_watermark
+
+PARTITIONING_NONE = 'none'
+PARTITIONING_MONTHLY = 'monthly'
+PARTITIONING_MODES = (PARTITIONING_NONE, PARTITIONING_MONTHLY)
+
+_sensor_data_table = SensorData.__table__
+_retention_lock = threading.Lock()
+
+
+def get_raw_retention_start(now=None):
+    """
+    Oldest time raw sensor data is kept for, None if it is kept forever.
+    Older ranges are only available in the rollups. Requires an app context.
+    With the Parquet archive, raw data is only moved, never dropped.
+    """
+    if is_archive_enabled(current_app.config):
+        return None
+    days = current_app.config.get('SENSOR_DATA_RETENTION_DAYS', 0)
+    if not days:
+        return None
+    return (now or datetime.utcnow()) - timedelta(days=days)
+
+
+# Retention setting of every rollup level
+ROLLUP_RETENTION_SETTINGS = {
+    LEVEL_MINUTE.name: 'SENSOR_DATA_ROLLUP_1M_RETENTION_DAYS',
+    LEVEL_HOUR.name: 'SENSOR_DATA_ROLLUP_1H_RETENTION_DAYS',
+    LEVEL_DAY.name: 'SENSOR_DATA_ROLLUP_1D_RETENTION_DAYS',
+}
+
+
+def get_rollup_retention_start(level, now=None):
+    """Oldest bucket time kept in the rollup level, None if it is kept forever. Requires an app context."""
+    days = current_app.config.get(ROLLUP_RETENTION_SETTINGS[level.name], 0)
+    if not days:
+        return None
+    return (now or datetime.utcnow()) - timedelta(days=days)
+
+
+def _cutoff(days, now, rolled_up_until):
+    """
+    Delete data older than days, but only what the next coarser level already contains.
+    Returns: cutoff time or None if nothing is deleted
+    """
+    if not days:
+        return None
+    cutoff = now - timedelta(days=days)
+    if rolled_up_until is not None:
+        return min(cutoff, rolled_up_until)
+    return None
+
+
+def _archived_cutoff(archived_until, rolled_up_until):
+    """With the Parquet archive, raw data is deleted once it is archived and in the 1m rollup"""
+    if archived_until is None or rolled_up_until is None:
+        return None
+    return min(archived_until, rolled_up_until)
+
+
+def _drop_raw_partitions(cutoff):
+    """
+    Drop the monthly sensor_data partitions that end before cutoff.
+    Returns: list of dropped partition names
+    """
+    with db.engine.begin() as connection:
+        expired = [name for name, bound in get_sensor_data_partitions(connection)
+                   if bound is not None and bound <= cutoff]
+        if expired:
+            connection.execute(text(f"ALTER TABLE {_sensor_data_table.name} DROP PARTITION {', '.join(expired)}"))
+    return expired
+
+
+def _delete_rollup_rows(level, device_pks, cutoff):
+    """Delete the rollup buckets older than cutoff, one transaction per device"""
+    c = level.table.c
+    statement = level.table.delete().where(c.device_id == bindparam('device_pk'), c.bucket_start < bindparam('cutoff'))
+    deleted = 0
+    for device_pk in device_pks:
+        deleted += db.session.execute(statement, {'device_pk': device_pk, 'cutoff': cutoff}).rowcount
+        db.session.commit()
+    return deleted
+
+
+def is_partitioned(app):
+    """True if sensor_data is partitioned by month (SENSOR_DATA_PARTITIONING=monthly on MySQL/MariaDB)"""
+    if app.config.get('SENSOR_DATA_PARTITIONING', PARTITIONING_NONE) != PARTITIONING_MONTHLY:
+        return False
+    with app.app_context():
+        if db.engine.dialect.name not in ('mysql', 'mariadb'):
+            return False
+        with db.engine.connect() as connection:
+            return bool(get_sensor_data_partitions(connection))
+
+
+def apply_sensor_data_retention(app, now=None):
+    """
+    Delete expired sensor data:
+
+    raw:        older than SENSOR_DATA_RETENTION_DAYS, once it is in the 1m rollup
+                (with SENSOR_DATA_ARCHIVE_DIR: once it is archived to Parquet and in the 1m rollup,
+                with an embedded SENSOR_DATA_STORE: without rollup)
+    1m rollup:  older than SENSOR_DATA_ROLLUP_1M_RETENTION_DAYS, once it is in the 1h rollup
+    1h rollup:  older than SENSOR_DATA_ROLLUP_1H_RETENTION_DAYS, once it is in the 1d rollup
+    1d rollup:  older than SENSOR_DATA_ROLLUP_1D_RETENTION_DAYS
+
+    0 days keeps the data forever. Partitioned raw data is removed by dropping whole months
+    (future months are created here too), otherwise with batched deletes.
+
+    Returns:
+        dict: deleted rows per level, dropped partition names under 'partitions'
+    """
+    if not _retention_lock.acquire(blocking=False):
+        logging.info("Sensor data retention still running, skipping")
+        return {}
+
+    try:
+        config = app.config
+        now = now or datetime.utcnow()
+        with app.app_context():
+            try:
+                partitioned = is_partitioned(app)
+                if partitioned:
+                    ensure_sensor_data_partitions(app)
+
+                device_pks = list(db.session.execute(select(Device.id)).scalars())
+                result = {}
+
+                store = get_timeseries_store()
+                if not store.uses_app_database:
+                    # Nothing is rolled up from an embedded store
+                    days = config['SENSOR_DATA_RETENTION_DAYS']
+                    raw_cutoff = now - timedelta(days=days) if days else None
+                elif is_archive_enabled(config):
+                    raw_cutoff = _archived_cutoff(get_archive_watermark(config['SENSOR_DATA_ARCHIVE_DIR']),
+                                                  get_rollup_watermark(LEVEL_MINUTE))
+                else:
+                    raw_cutoff = _cutoff(config['SENSOR_DATA_RETENTION_DAYS'], now, get_rollup_watermark(LEVEL_MINUTE))
+                if raw_cutoff is not None:
+                    if partitioned and store.uses_app_database:
+                        result['partitions'] = _drop_raw_partitions(raw_cutoff)
+                    else:
+                        result['raw'] = store.delete_before(device_pks, raw_cutoff,
+                                                            config['SENSOR_DATA_RETENTION_BATCH_SIZE'])
+
+                rollup_retention = (
+                    (LEVEL_MINUTE, get_rollup_watermark(LEVEL_HOUR)),
+                    (LEVEL_HOUR, get_rollup_watermark(LEVEL_DAY)),
+                    # Nothing is built from the day rollup
+                    (LEVEL_DAY, now),
+                )
+                for level, rolled_up_until in rollup_retention:
+                    cutoff = _cutoff(config[ROLLUP_RETENTION_SETTINGS[level.name]], now, rolled_up_until)
+                    if cutoff is not None:
+                        result[level.name] = _delete_rollup_rows(level, device_pks, cutoff)
+
+                if any(result.values()):
+                    logging.info(f"Sensor data retention: {result}")
+                return result
+            except Exception as e:
+                db.session.rollback()
+                logging.error(f"Error applying sensor data retention: {str(e)}")
+                return {}
+    finally:
+        _retention_lock.release()
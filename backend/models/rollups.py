@@ -0,0 +1,287 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, cast, case, and_, text, bindparam, literal_column, Integer, BigInteger
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from backend.extensions import db
+from backend.models.models import Device, SensorData, SensorDataRollupMinute, SensorDataRollupHour, SensorDataRollupDay
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class RollupLevel:
+    """One rollup granularity, built from the raw sensor data or the next finer rollup"""
+
+    def __init__(self, name, model, bucket_seconds, chunk_seconds, source=None):
+        self.name = name
+        self.table = model.__table__
+        self.bucket_seconds = bucket_seconds
+        # Range of source data rolled up per transaction
+        self.chunk_seconds = chunk_seconds
+        # Finer RollupLevel this level is built from, None for the raw sensor data
+        self.source = source
+
+
+LEVEL_MINUTE = RollupLevel('1m', SensorDataRollupMinute, 60, 3600)
+LEVEL_HOUR = RollupLevel('1h', SensorDataRollupHour, 3600, 86400, source=LEVEL_MINUTE)
+LEVEL_DAY = RollupLevel('1d', SensorDataRollupDay, 86400, 30 * 86400, source=LEVEL_HOUR)
+# Finest first, every level is built from the one before
+ROLLUP_LEVELS = (LEVEL_MINUTE, LEVEL_HOUR, LEVEL_DAY)
+
+_ROLLUP_VALUE_COLUMNS = ('count', 'value_min', 'value_max', 'value_sum', 'value_last', 'last_timestamp',
+                         'low_count', 'mid_count', 'high_count')
+# Rows per upsert statement, keeps the statements below the bind parameter limits
+_UPSERT_BATCH_SIZE = 500
+
+# level name -> exclusive end of the rolled up time range, loaded from the rollup tables on first use
+_watermarks = {}
+_rollup_lock = threading.Lock()
+# Set while the value_numeric backfill runs, rows it has not converted yet would be missing in the rollups
+_suspended = threading.Event()
+
+
+def epoch_seconds(column):
+    """SQL expression for the whole seconds since 1970-01-01 of a naive UTC DateTime column"""
+    dialect_name = db.session.get_bind().dialect.name
+    if dialect_name in ('mysql', 'mariadb'):
+        return func.timestampdiff(text('SECOND'), literal_column("'1970-01-01 00:00:00'"), column)
+    if dialect_name == 'sqlite':
+        return cast(func.strftime('%s', column), Integer)
+    return cast(func.extract('epoch', column), BigInteger)
+
+
+def to_epoch_seconds(timestamp):
+    return (timestamp - EPOCH) // timedelta(seconds=1)
+
+
+def bucket_offset(time_column, grid_start, bucket_seconds):
+    """SQL expression for the offset in seconds of the grid bucket of time_column, inlined for GROUP BY"""
+    offset = epoch_seconds(time_column) - literal_column(str(to_epoch_seconds(grid_start)))
+    return (offset - offset % literal_column(str(bucket_seconds))).label('bucket')
+
+
+def floor_timestamp(timestamp, seconds):
+    """Round timestamp down to a multiple of seconds since the epoch"""
+    epoch = to_epoch_seconds(timestamp)
+    return EPOCH + timedelta(seconds=epoch - epoch % seconds)
+
+
+def _source_columns(level):
+    """
+    Returns: (device column, time column, time columns of the aggregated row, value column of the last reading,
+             aggregate expressions in _ROLLUP_VALUE_COLUMNS order without value_last, extra filters)
+    """
+    if level.source is None:
+        c = SensorData.__table__.c
+        histogram = [func.sum(case((c.simplified_value == simplified, 1), else_=0)) for simplified in (-1, 0, 1)]
+        aggregates = [func.count(c.value_numeric), func.min(c.value_numeric), func.max(c.value_numeric),
+                      func.sum(c.value_numeric), func.max(c.timestamp)] + histogram
+        return c.device_id, c.timestamp, c.timestamp, c.value_numeric, aggregates, [c.value_numeric.isnot(None)]
+
+    c = level.source.table.c
+    aggregates = [func.sum(c.count), func.min(c.value_min), func.max(c.value_max), func.sum(c.value_sum),
+                  func.max(c.last_timestamp), func.sum(c.low_count), func.sum(c.mid_count), func.sum(c.high_count)]
+    return c.device_id, c.bucket_start, c.last_timestamp, c.value_last, aggregates, []
+
+
+def _aggregate_chunk(level, device_pks, chunk_start, chunk_end):
+    """
+    Aggregate the source rows of the devices in [chunk_start, chunk_end) into buckets of the level.
+    The device filter lets the database use the (device_id, time) indexes of the source.
+    Returns: list of rollup row dicts
+    """
+    device_column, time_column, last_time_column, value_column, aggregates, filters = _source_columns(level)
+    epoch = epoch_seconds(time_column)
+    # Inlined modulus, so the select and GROUP BY expressions are identical
+    bucket = (epoch - epoch % literal_column(str(level.bucket_seconds))).label('bucket')
+
+    grouped = select(
+        device_column.label('device_id'), bucket,
+        *[aggregate.label(f'agg_{index}') for index, aggregate in enumerate(aggregates)]
+    ).where(
+        device_column.in_(bindparam('device_pks', expanding=True)),
+        time_column >= chunk_start, time_column < chunk_end, *filters
+    ).group_by(device_column, bucket).subquery()
+
+    # The value of the newest reading of every bucket, joined over the (device_id, time) index
+    source_table = device_column.table
+    statement = select(grouped, value_column).join_from(grouped, source_table, and_(
+        device_column == grouped.c.device_id,
+        last_time_column == grouped.c.agg_4,
+        time_column >= chunk_start, time_column < chunk_end, *filters
+    ))
+
+    rows = {}
+    for row in db.session.execute(statement, {'device_pks': device_pks}):
+        # Readings with the same timestamp join more than once, any of them is the last value
+        rows[(row.device_id, row.bucket)] = {
+            'device_id': row.device_id,
+            'bucket_start': EPOCH + timedelta(seconds=int(row.bucket)),
+            'count': int(row.agg_0),
+            'value_min': float(row.agg_1),
+            'value_max': float(row.agg_2),
+            'value_sum': float(row.agg_3),
+            'value_last': float(row[-1]),
+            'last_timestamp': row.agg_4,
+            'low_count': int(row.agg_5),
+            'mid_count': int(row.agg_6),
+            'high_count': int(row.agg_7),
+        }
+    return list(rows.values())
+
+
+def _rollup_upsert_statement(level, rows):
+    """
+    INSERT ... ON DUPLICATE KEY UPDATE (MySQL/MariaDB) or INSERT ... ON CONFLICT DO UPDATE (SQLite, PostgreSQL),
+    so a bucket rolled up by two backend instances is written twice with the same values.
+    Returns: the statement or None if the database has no upsert support
+    """
+    dialect_name = db.session.get_bind().dialect.name
+    if dialect_name in ('mysql', 'mariadb'):
+        statement = mysql.insert(level.table).values(rows)
+        return statement.on_duplicate_key_update(**{column: statement.inserted[column] for column in _ROLLUP_VALUE_COLUMNS})
+
+    if dialect_name in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect_name == 'sqlite' else postgresql.insert
+        statement = insert(level.table).values(rows)
+        return statement.on_conflict_do_update(
+            index_elements=['device_id', 'bucket_start'],
+            set_={column: statement.excluded[column] for column in _ROLLUP_VALUE_COLUMNS}
+        )
+    return None
+
+
+def _write_rollup_rows(level, rows):
+    for index in range(0, len(rows), _UPSERT_BATCH_SIZE):
+        batch = rows[index:index + _UPSERT_BATCH_SIZE]
+        statement = _rollup_upsert_statement(level, batch)
+        if statement is None:
+            db.session.execute(level.table.delete().where(and_(
+                level.table.c.device_id == bindparam('_device_id'),
+                level.table.c.bucket_start == bindparam('_bucket_start')
+            )), [{'_device_id': row['device_id'], '_bucket_start': row['bucket_start']} for row in batch])
+            db.session.execute(level.table.insert(), batch)
+        else:
+            db.session.execute(statement)
+
+
+def _first_source_timestamp(level):
+    """Oldest source time, None if there is no source data"""
+    _, time_column, _, _, _, filters = _source_columns(level)
+    return db.session.execute(select(func.min(time_column)).where(*filters)).scalar()
+
+
+def get_rollup_watermark(level):
+    """
+    Exclusive end of the time range already rolled up into level, None if nothing was rolled up yet.
+    Requires an app context.
+    """
+    watermark = _watermarks.get(level.name)
+    if watermark is None:
+        newest = db.session.execute(select(func.max(level.table.c.bucket_start))).scalar()
+        if newest is not None:
+            watermark = newest + timedelta(seconds=level.bucket_seconds)
+            _watermarks[level.name] = watermark
+    return watermark
+
+
+def reset_rollup_watermarks():
+    """Forget the watermarks, e.g. after the database was wiped"""
+    _watermarks.clear()
+
+
+def suspend_rollups():
+    """Skip the rollup runs until resume_rollups, e.g. while the value_numeric backfill runs"""
+    _suspended.set()
+
+
+def resume_rollups(app, rebuild_from=None):
+    """
+    Run the rollups again. With rebuild_from the watermarks are moved back to it, so the next run
+    rolls up the buckets from there again and the upserts replace the rows rolled up before.
+
+    Args:
+        app: Flask application instance
+        rebuild_from: Oldest source time that changed, None if nothing changed
+    """
+    try:
+        if rebuild_from is None:
+            return
+        with _rollup_lock, app.app_context():
+            for level in ROLLUP_LEVELS:
+                watermark = get_rollup_watermark(level)
+                start = floor_timestamp(rebuild_from, level.bucket_seconds)
+                if watermark is not None and start < watermark:
+                    _watermarks[level.name] = start
+        logging.info(f"Sensor data rollups are rebuilt from {rebuild_from}")
+    except Exception as e:
+        logging.error(f"Error rewinding the sensor data rollups: {str(e)}")
+    finally:
+        _suspended.clear()
+
+
+def _roll_up_level(level, device_pks, source_end):
+    """
+    Roll up the closed buckets of level up to source_end, one transaction per chunk.
+    Returns: (number of written rollup rows, exclusive end of the rolled up range)
+    """
+    end = floor_timestamp(source_end, level.bucket_seconds)
+    start = get_rollup_watermark(level)
+    if start is None:
+        first = _first_source_timestamp(level)
+        if first is None:
+            return 0, None
+        start = floor_timestamp(first, level.bucket_seconds)
+
+    written = 0
+    while start < end:
+        chunk_end = min(start + timedelta(seconds=level.chunk_seconds), end)
+        rows = _aggregate_chunk(level, device_pks, start, chunk_end)
+        if rows:
+            _write_rollup_rows(level, rows)
+        db.session.commit()
+        written += len(rows)
+        start = _watermarks[level.name] = chunk_end
+
+    return written, max(start, end)
+
+
+def update_sensor_data_rollups(app, lag_seconds=60, now=None):
+    """
+    Roll up the sensor data of all closed minutes, hours and days.
+    Readings younger than lag_seconds are not rolled up yet, so late commits of the ingest workers
+    are not missed. Every level continues at its watermark, so a run only reads the new source rows.
+    Skipped while the rollups are suspended by the value_numeric backfill.
+
+    Returns:
+        dict: level name -> number of written rollup rows
+    """
+    if _suspended.is_set():
+        logging.info("Sensor data backfill running, skipping the rollup")
+        return {}
+
+    if not _rollup_lock.acquire(blocking=False):
+        logging.info("Sensor data rollup still running, skipping")
+        return {}
+
+    try:
+        with app.app_context():
+            try:
+                device_pks = list(db.session.execute(select(Device.id)).scalars())
+                if not device_pks:
+                    return {}
+                source_end = (now or datetime.utcnow()) - timedelta(seconds=lag_seconds)
+                written = {}
+                for level in ROLLUP_LEVELS:
+                    written[level.name], source_end = _roll_up_level(level, device_pks, source_end)
+                    if source_end is None:
+                        break
+                if any(written.values()):
+                    logging.info(f"Sensor data rollup: {written}")
+                return written
+            except Exception as e:
+                db.session.rollback()
+                logging.error(f"Error rolling up sensor data: {str(e)}")
+                return {}
+    finally:
+        _rollup_lock.release()
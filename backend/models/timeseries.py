@@ -0,0 +1,439 @@
+import logging
+import os
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+from sqlalchemy import select, func, case, bindparam, String
+from backend.extensions import db
+from backend.models.models import SensorData
+from backend.models.migrations import to_numeric_value
+from backend.models.rollups import EPOCH, bucket_offset, to_epoch_seconds
+
+STORE_DATABASE = 'database'
+STORE_SQLITE = 'sqlite'
+STORE_MODES = (STORE_DATABASE, STORE_SQLITE)
+
+# Row of query_range and query_latest, query_range rows of the database store are SQLAlchemy Rows with these fields
+SensorReading = namedtuple('SensorReading', ('id', 'device_pk', 'timestamp', 'value', 'value_numeric',
+                                             'simplified_value'))
+
+
+class TimeSeriesStore(ABC):
+    """
+    Storage of the sensor readings of all devices, addressed by the device primary key (devices.id).
+    Rows are written as (device_pk, value, simplified_value, timestamp) tuples and read as SensorReading
+    fields, so neither the ingest nor the queries depend on the SensorData ORM class.
+    """
+
+    name = None
+    # True if the readings are the sensor_data table of the app database, which the rollups,
+    # the Parquet archive, monthly partitioning and the export join read directly
+    uses_app_database = False
+
+    @abstractmethod
+    def write_batch(self, rows):
+        """
+        Store readings.
+
+        Args:
+            rows: Iterable of (device_pk, value, simplified_value, timestamp) tuples
+
+        Returns:
+            int: Number of stored rows
+        """
+
+    @abstractmethod
+    def query_range(self, device_pk, start=None, end=None, numeric_only=False, every=1, skip=0):
+        """
+        Readings of a device in [start, end] in time order.
+
+        Args:
+            numeric_only: Only readings with a value_numeric
+            every: Only every every-th reading
+            skip: Number of readings before the range that count towards every (continues a sampling)
+
+        Returns:
+            list: rows with the SensorReading fields
+        """
+
+    @abstractmethod
+    def query_latest(self, device_pks):
+        """
+        Returns:
+            dict: device_pk -> newest SensorReading of the device, devices without readings are left out
+        """
+
+    @abstractmethod
+    def stats(self, device_pk, start=None, end=None):
+        """Returns: (count, first timestamp, last timestamp) of the readings of a device in [start, end]"""
+
+    @abstractmethod
+    def aggregate(self, device_pk, grid_start, bucket_seconds, start=None, end=None):
+        """
+        Numeric readings of a device in [start, end] aggregated into buckets of bucket_seconds from grid_start.
+
+        Returns:
+            list: rows of (bucket offset in seconds, sum, min, max, count, low, mid, high), in no particular order
+        """
+
+    @abstractmethod
+    def iter_range(self, device_pks, start=None, end=None, chunk_size=5000):
+        """Readings of the devices in [start, end] ordered by device and time, as lists of at most chunk_size rows"""
+
+    @abstractmethod
+    def delete_before(self, device_pks, cutoff, batch_size):
+        """
+        Delete the readings of the devices older than cutoff, in transactions of at most batch_size rows.
+        Returns: int number of deleted rows
+        """
+
+    @abstractmethod
+    def delete_devices(self, device_pks):
+        """Delete all readings of the devices, called after the devices were deleted"""
+
+    @abstractmethod
+    def clear(self):
+        """Delete all readings"""
+
+
+class DatabaseTimeSeriesStore(TimeSeriesStore):
+    """
+    The sensor_data table of the app database (MariaDB in production) through the current db.session.
+    Writes join the caller's transaction, the caller commits.
+    """
+
+    name = STORE_DATABASE
+    uses_app_database = True
+
+    def __init__(self):
+        self._table = SensorData.__table__
+        self._c = self._table.c
+        # Insert statement is built once, rows are passed as executemany parameters
+        self._insert = self._table.insert()
+        # UUID keys are generated here, BIGINT keys by the database
+        self._generate_ids = isinstance(self._c.id.type, String)
+        self._columns = (self._c.id, self._c.device_id.label('device_pk'), self._c.timestamp, self._c.value,
+                         self._c.value_numeric, self._c.simplified_value)
+
+    def _range_filter(self, device_pk, start=None, end=None):
+        conditions = [self._c.device_id == device_pk]
+        if start is not None:
+            conditions.append(self._c.timestamp >= start)
+        if end is not None:
+            conditions.append(self._c.timestamp <= end)
+        return conditions
+
+    def write_batch(self, rows):
+        # A single Core executemany, skips the ORM unit of work and identity map
+        parameters = [
+            {
+                'device_id': device_pk,
+                'value': value,
+                'value_numeric': to_numeric_value(value),
+                'simplified_value': simplified_value,
+                'timestamp': timestamp,
+            }
+            for device_pk, value, simplified_value, timestamp in rows
+        ]
+        if not parameters:
+            return 0
+        if self._generate_ids:
+            for row in parameters:
+                row['id'] = str(uuid.uuid4())
+
+        db.session.execute(self._insert, parameters)
+        return len(parameters)
+
+    def query_range(self, device_pk, start=None, end=None, numeric_only=False, every=1, skip=0):
+        conditions = self._range_filter(device_pk, start, end)
+        if numeric_only:
+            conditions.append(self._c.value_numeric.isnot(None))
+        if every == 1:
+            return db.session.execute(select(*self._columns).where(*conditions).order_by(self._c.timestamp)).all()
+
+        # Sampled in SQL with ROW_NUMBER(), only the kept rows leave the database
+        numbered = select(
+            *self._columns, func.row_number().over(order_by=self._c.timestamp).label('row_number')
+        ).where(*conditions).subquery()
+        return db.session.execute(
+            select(*(numbered.c[name] for name in SensorReading._fields))
+            .where((numbered.c.row_number - 1 + skip) % every == 0)
+            .order_by(numbered.c.timestamp)
+        ).all()
+
+    def query_latest(self, device_pks):
+        # One index lookup per device on (device_id, timestamp)
+        statement = select(*self._columns).where(self._c.device_id == bindparam('device_pk')) \
+            .order_by(self._c.timestamp.desc()).limit(1)
+        latest = {}
+        for device_pk in device_pks:
+            row = db.session.execute(statement, {'device_pk': device_pk}).first()
+            if row is not None:
+                latest[device_pk] = SensorReading(*row)
+        return latest
+
+    def stats(self, device_pk, start=None, end=None):
+        row = db.session.execute(
+            select(func.count(), func.min(self._c.timestamp), func.max(self._c.timestamp))
+            .where(*self._range_filter(device_pk, start, end))
+        ).one()
+        return row[0], row[1], row[2]
+
+    def aggregate(self, device_pk, grid_start, bucket_seconds, start=None, end=None):
+        c = self._c
+        bucket = bucket_offset(c.timestamp, grid_start, bucket_seconds)
+        histogram = [func.sum(case((c.simplified_value == simplified, 1), else_=0)) for simplified in (-1, 0, 1)]
+        return db.session.execute(
+            select(bucket, func.sum(c.value_numeric), func.min(c.value_numeric), func.max(c.value_numeric),
+                   func.count(c.value_numeric), *histogram)
+            .where(*self._range_filter(device_pk, start, end), c.value_numeric.isnot(None))
+            .group_by(bucket)
+        ).all()
+
+    def iter_range(self, device_pks, start=None, end=None, chunk_size=5000):
+        conditions = [self._c.device_id.in_(device_pks)]
+        if start is not None:
+            conditions.append(self._c.timestamp >= start)
+        if end is not None:
+            conditions.append(self._c.timestamp <= end)
+        statement = select(*self._columns).where(*conditions).order_by(self._c.device_id, self._c.timestamp)
+        with db.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(statement)
+            for rows in result.partitions(chunk_size):
+                yield rows
+
+    def delete_before(self, device_pks, cutoff, batch_size):
+        # Every batch is selected over the (device_id, timestamp) index, so the deletes never scan the table
+        c = self._c
+        select_batch = select(c.id).where(
+            c.device_id == bindparam('device_pk'), c.timestamp < bindparam('cutoff')
+        ).limit(batch_size)
+        delete_batch = self._table.delete().where(c.id.in_(bindparam('ids', expanding=True)))
+
+        deleted = 0
+        for device_pk in device_pks:
+            while True:
+                ids = db.session.execute(select_batch, {'device_pk': device_pk, 'cutoff': cutoff}).scalars().all()
+                if not ids:
+                    break
+                db.session.execute(delete_batch, {'ids': ids})
+                db.session.commit()
+                deleted += len(ids)
+                if len(ids) < batch_size:
+                    break
+        return deleted
+
+    def delete_devices(self, device_pks):
+        # sensor_data.device_id is ON DELETE CASCADE, deleting the devices already deleted their readings
+        pass
+
+    def clear(self):
+        # Joins the caller's transaction like write_batch
+        return db.session.execute(self._table.delete()).rowcount
+
+
+def _to_micros(timestamp):
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+
+def _from_micros(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+
+class SQLiteTimeSeriesStore(TimeSeriesStore):
+    """
+    Embedded store in a SQLite file next to the app, for single-node deployments without a database server.
+    WAL mode lets the API read while an ingest worker writes, synchronous=NORMAL only syncs at checkpoints
+    (a power loss can lose the last commits, an app crash cannot). Timestamps are stored as integer
+    microseconds since the epoch. Every thread uses a connection of its own, every write_batch commits.
+    Rollups, the Parquet archive and partitioning only exist for the database store.
+    """
+
+    name = STORE_SQLITE
+    _SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS sensor_data (
+            id INTEGER PRIMARY KEY,
+            device_id TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            value TEXT NOT NULL,
+            value_numeric REAL,
+            simplified_value INTEGER
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_sensor_data_device_id_timestamp ON sensor_data (device_id, timestamp)",
+    )
+    _COLUMNS = 'id, device_id, timestamp, value, value_numeric, simplified_value'
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        with connection:
+            for statement in self._SCHEMA:
+                connection.execute(statement)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _reading(row):
+        return SensorReading(row[0], row[1], _from_micros(row[2]), row[3], row[4], row[5])
+
+    @staticmethod
+    def _range_filter(device_pk, start=None, end=None):
+        conditions = ['device_id = ?']
+        parameters = [device_pk]
+        if start is not None:
+            conditions.append('timestamp >= ?')
+            parameters.append(_to_micros(start))
+        if end is not None:
+            conditions.append('timestamp <= ?')
+            parameters.append(_to_micros(end))
+        return ' AND '.join(conditions), parameters
+
+    def write_batch(self, rows):
+        parameters = [
+            (device_pk, _to_micros(timestamp), str(value), to_numeric_value(value), simplified_value)
+            for device_pk, value, simplified_value, timestamp in rows
+        ]
+        if not parameters:
+            return 0
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                'INSERT INTO sensor_data (device_id, timestamp, value, value_numeric, simplified_value) '
+                'VALUES (?, ?, ?, ?, ?)', parameters
+            )
+        return len(parameters)
+
+    def query_range(self, device_pk, start=None, end=None, numeric_only=False, every=1, skip=0):
+        where, parameters = self._range_filter(device_pk, start, end)
+        if numeric_only:
+            where += ' AND value_numeric IS NOT NULL'
+        if every == 1:
+            rows = self._connection().execute(
+                f'SELECT {self._COLUMNS} FROM sensor_data WHERE {where} ORDER BY timestamp', parameters
+            )
+        else:
+            rows = self._connection().execute(
+                f'SELECT {self._COLUMNS} FROM ('
+                f'SELECT {self._COLUMNS}, ROW_NUMBER() OVER (ORDER BY timestamp) AS row_number '
+                f'FROM sensor_data WHERE {where}) '
+                'WHERE (row_number - 1 + ?) % ? = 0 ORDER BY timestamp', [*parameters, skip, every]
+            )
+        return [self._reading(row) for row in rows]
+
+    def query_latest(self, device_pks):
+        connection = self._connection()
+        latest = {}
+        for device_pk in device_pks:
+            row = connection.execute(
+                f'SELECT {self._COLUMNS} FROM sensor_data WHERE device_id = ? ORDER BY timestamp DESC LIMIT 1',
+                (device_pk,)
+            ).fetchone()
+            if row is not None:
+                latest[device_pk] = self._reading(row)
+        return latest
+
+    def stats(self, device_pk, start=None, end=None):
+        where, parameters = self._range_filter(device_pk, start, end)
+        count, first, last = self._connection().execute(
+            f'SELECT COUNT(*), MIN(timestamp), MAX(timestamp) FROM sensor_data WHERE {where}', parameters
+        ).fetchone()
+        return count, _from_micros(first) if first is not None else None, \
+            _from_micros(last) if last is not None else None
+
+    def aggregate(self, device_pk, grid_start, bucket_seconds, start=None, end=None):
+        where, parameters = self._range_filter(device_pk, start, end)
+        bucket_micros = bucket_seconds * 1000000
+        return self._connection().execute(
+            'SELECT (timestamp - ?) / ? * ? AS bucket, SUM(value_numeric), MIN(value_numeric), MAX(value_numeric), '
+            'COUNT(value_numeric), SUM(simplified_value = -1), SUM(simplified_value = 0), SUM(simplified_value = 1) '
+            f'FROM sensor_data WHERE {where} AND value_numeric IS NOT NULL GROUP BY bucket',
+            [to_epoch_seconds(grid_start) * 1000000, bucket_micros, bucket_seconds, *parameters]
+        ).fetchall()
+
+    def iter_range(self, device_pks, start=None, end=None, chunk_size=5000):
+        if not device_pks:
+            return
+        conditions = [f"device_id IN ({', '.join('?' * len(device_pks))})"]
+        parameters = list(device_pks)
+        if start is not None:
+            conditions.append('timestamp >= ?')
+            parameters.append(_to_micros(start))
+        if end is not None:
+            conditions.append('timestamp <= ?')
+            parameters.append(_to_micros(end))
+        cursor = self._connection().execute(
+            f"SELECT {self._COLUMNS} FROM sensor_data WHERE {' AND '.join(conditions)} ORDER BY device_id, timestamp",
+            parameters
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [self._reading(row) for row in rows]
+
+    def delete_before(self, device_pks, cutoff, batch_size):
+        connection = self._connection()
+        deleted = 0
+        for device_pk in device_pks:
+            while True:
+                with connection:
+                    count = connection.execute(
+                        'DELETE FROM sensor_data WHERE id IN ('
+                        'SELECT id FROM sensor_data WHERE device_id = ? AND timestamp < ? LIMIT ?)',
+                        (device_pk, _to_micros(cutoff), batch_size)
+                    ).rowcount
+                deleted += count
+                if count < batch_size:
+                    break
+        return deleted
+
+    def delete_devices(self, device_pks):
+        if not device_pks:
+            return 0
+        connection = self._connection()
+        with connection:
+            return connection.executemany('DELETE FROM sensor_data WHERE device_id = ?',
+                                          [(device_pk,) for device_pk in device_pks]).rowcount
+
+    def clear(self):
+        connection = self._connection()
+        with connection:
+            return connection.execute('DELETE FROM sensor_data').rowcount
+
+
+_database_store = DatabaseTimeSeriesStore()
+_store = None
+
+
+def init_timeseries_store(app):
+    """Select the store of SENSOR_DATA_STORE, SENSOR_DATA_STORE_PATH is the file of the sqlite store"""
+    global _store
+    mode = app.config.get('SENSOR_DATA_STORE', STORE_DATABASE)
+    if mode == STORE_SQLITE:
+        _store = SQLiteTimeSeriesStore(app.config['SENSOR_DATA_STORE_PATH'])
+        logging.info(f"Sensor data is stored in {_store.path} (SQLite, WAL)")
+    else:
+        if mode != STORE_DATABASE:
+            logging.warning(f"Unknown SENSOR_DATA_STORE {mode}, expected one of {', '.join(STORE_MODES)}, "
+                            f"using {STORE_DATABASE}")
+        _store = _database_store
+    return _store
+
+
+def get_timeseries_store():
+    """The configured TimeSeriesStore, the database store before init_timeseries_store ran"""
+    return _store or _database_store
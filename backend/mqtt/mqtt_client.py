@@ -1,46 +1,98 @@
 import logging
+import atexit
+import threading
 import paho.mqtt.client as mqtt
 from backend.mqtt.utils.parsersUtils import parse_mqtt_topic
-from backend.mqtt.utils.dbUtils import get_or_create_device, process_sensor_actuator_mapping
-from backend.mqtt.utils.cacheUtils import initialize_device_cache
+from backend.mqtt.utils.dbUtils import process_device_batch, process_sensor_actuator_mapping
+from backend.mqtt.utils.cacheUtils import initialize_device_cache, flush_device_cache
+from backend.mqtt.utils.ingestQueueUtils import IngestQueue, combine_ingest_stats
+from backend.mqtt.utils.ingestLogUtils import ingest_log
+from backend.mqtt.utils.cacheInvalidationUtils import get_invalidation_topic, handle_cache_invalidation
+from backend.extensions import consumer_session
 
 # Configuration constants
 MQTT_KEEPALIVE = 600
 # At most once: 0, At least once 1 Exactly once 2
 MQTT_QOS = 2
 MAX_PAYLOAD_SIZE = 1024 * 10  # 10KB
+# Floors allowed by floor_str_to_int_converter, used to partition the subscriptions
+MAX_FLOOR_NUMBER = 100
 
+# First consumer, also used by mqttPublish to publish
 mqtt_client = None
+# All consumer clients of this process
+consumer_clients = []
 app_instance = None
+# One ingest queue per consumer, each with MQTT_INGEST_WORKERS database workers
+ingest_queues = []
 
 def validate_mqtt_message(topic, payload):
     """
     Validate MQTT message for security and format
     """
     if not payload or len(payload) > MAX_PAYLOAD_SIZE:
-        logging.warning(f"Invalid payload size: {len(payload) if payload else 0}")
+        ingest_log.limited(logging.WARNING, ('payload_size', topic), "Invalid payload size: %d", len(payload) if payload else 0)
         return False
     
     # Check for suspicious characters in topic
     if any(char in topic for char in ['<', '>', '"', "'"]):
-        logging.warning(f"Suspicious characters in topic: {topic}")
+        ingest_log.limited(logging.WARNING, 'suspicious_topic', "Suspicious characters in topic: %s", topic)
         return False
     
     return True
 
 
-def on_connect(client, userdata, flags, rc):
-    if rc == 0:
-        logging.info("Connected to MQTT broker")
-        # Subscribe to the topic
-        subscribe_topic = app_instance.config['MQTT_TOPIC_SUBSCRIBE']
-        client.subscribe(subscribe_topic, qos=MQTT_QOS)
-        logging.info(f"Subscribed to {subscribe_topic}")
+def get_subscription_topics(config, partition_index, partition_count):
+    """
+    Return the topics a consumer subscribes to.
+
+    With more than one partition every consumer only subscribes to the floors with
+    floor_number % partition_count == partition_index, so all messages of a device
+    (and of its room) are received by the same consumer in order.
+    With MQTT_SHARED_GROUP the topics are shared subscriptions with one group per partition:
+    replicas of the same partition (e.g. during a rolling restart) share the messages,
+    different partitions never do.
+    """
+    subscribe_topic = config['MQTT_TOPIC_SUBSCRIBE']
+    if partition_count > 1:
+        prefix = subscribe_topic.split('/')[0]
+        topics = [f"{prefix}/{floor}/#" for floor in range(partition_index, MAX_FLOOR_NUMBER + 1, partition_count)]
+    else:
+        topics = [subscribe_topic]
+
+    shared_group = config['MQTT_SHARED_GROUP']
+    if shared_group:
+        group = f"{shared_group}-p{partition_index}" if partition_count > 1 else shared_group
+        topics = [f"$share/{group}/{topic}" for topic in topics]
+    return topics
+
+
+def consumes_floor(config, floor_number):
+    """
+    True if the consumers of this process receive the messages of the floor, always without partitioning.
+    With MQTT_PARTITION_COUNT > 1 the devices of other floors are only up to date in the database.
+    """
+    consumers = max(1, config['MQTT_CONSUMERS'])
+    partition_count = max(1, config['MQTT_PARTITION_COUNT']) * consumers
+    first_partition = config['MQTT_PARTITION_INDEX'] * consumers
+    return first_partition <= floor_number % partition_count < first_partition + consumers
+
+
+def on_connect(client, userdata, flags, reason_code, properties):
+    if not reason_code.is_failure:
+        logging.info(f"Consumer {userdata['partition_index']} connected to MQTT broker")
+        # Subscribe to the topics of this consumer
+        client.subscribe([(topic, MQTT_QOS) for topic in userdata['topics']])
+        logging.info(f"Subscribed to {len(userdata['topics'])} topic(s): {userdata['topics'][0]}"
+                     f"{' ...' if len(userdata['topics']) > 1 else ''}")
         logging.info(f"MQTT_QOS: {MQTT_QOS}")
     else:
-        logging.error(f"Failed to connect to MQTT broker with code: {rc}")
+        logging.error(f"Failed to connect to MQTT broker with code: {reason_code}")
         return
 
+    # The device cache is shared by all consumers of this process
+    if not userdata['primary']:
+        return
     try:
         initialize_device_cache(app_instance)
     except Exception as e:
@@ -52,6 +104,8 @@ def on_message(client, userdata, msg):
     Handle incoming MQTT messages
     Topic format: SCIoT_G02_2025/<floor_number>/<room_number>/<device-type>/<device-id>
     type: {sensor, actuator}
+    Runs in the paho network thread, so it only validates the message and hands it
+    to the ingest queue of the consumer. The database work happens in process_message_batch.
     """
     try:
         topic = msg.topic
@@ -59,36 +113,12 @@ def on_message(client, userdata, msg):
         
         # Validate message
         if not validate_mqtt_message(topic, payload):
-            logging.warning(f"Invalid MQTT message rejected: {topic}")
+            ingest_log.limited(logging.WARNING, ('rejected', topic), "Invalid MQTT message rejected: %s", topic)
             return
         
-        logging.info(f"Message received on topic {topic}")
-        
-        # Parse the topic
-        parsed = parse_mqtt_topic(topic, app_instance)
-        if not parsed:
-            # logging.warning(f"Skipping message with topic: {topic}")
-            return
+        ingest_log.message_received(topic)
         
-        if parsed[2] == "mapping":
-            logging.info(f"Parsed Topic: {parsed}")
-            floor_number, room_number, _ = parsed
-            success = process_sensor_actuator_mapping(app_instance, floor_number, room_number, payload)
-            if success:
-                logging.info(f"Successfully processed sensor-actuator mapping for floor {floor_number}, room {room_number}")
-            else:
-                logging.error(f"Failed to process sensor-actuator mapping for floor {floor_number}, room {room_number}")
-            return
-        
-        floor_number, room_number, device_type, device_id = parsed
-        
-        # Get or create device with payload data
-        device_info = get_or_create_device(app_instance, floor_number, room_number, device_type, device_id, payload)
-        
-        if device_info:
-            logging.info(f"Processed device data for {device_id} ({device_type}) in room {room_number}, floor {floor_number}")
-        else:
-            logging.error(f"Failed to process device for topic: {topic}")
+        userdata['ingest_queue'].put(topic, payload)
     
     except UnicodeDecodeError as e:
         logging.error(f"Failed to decode MQTT payload: {str(e)}")
@@ -96,10 +126,80 @@ def on_message(client, userdata, msg):
         logging.error(f"Error processing MQTT message: {str(e)}")
 
 
-def on_disconnect(client, userdata, rc):
+def process_message_batch(batch):
+    """
+    Process a batch of (topic, payload) tuples taken from the ingest queue.
+    Device messages are collected and written together, room level messages
+    (mapping, delete) are processed in order between them.
+    Runs in an ingest worker thread with the database session of that worker.
+    """
+    with consumer_session(app_instance, threading.current_thread().name):
+        _process_message_batch(batch)
+
+
+def _process_message_batch(batch):
+    device_messages = []
+    for topic, payload in batch:
+        try:
+            # Room level topics (mapping, delete) must see all device messages received before them
+            if topic.count('/') == 4:
+                _flush_device_messages(device_messages)
+                device_messages = []
+
+            if topic == get_invalidation_topic(app_instance.config):
+                _flush_device_messages(device_messages)
+                device_messages = []
+                handle_cache_invalidation(app_instance, payload)
+                continue
+
+            # Parse the topic
+            parsed = parse_mqtt_topic(topic, app_instance)
+            if not parsed:
+                # logging.warning(f"Skipping message with topic: {topic}")
+                continue
+            
+            if parsed[2] == "mapping":
+                logging.info(f"Parsed Topic: {parsed}")
+                floor_number, room_number, _ = parsed
+                success = process_sensor_actuator_mapping(app_instance, floor_number, room_number, payload)
+                if success:
+                    logging.info(f"Successfully processed sensor-actuator mapping for floor {floor_number}, room {room_number}")
+                else:
+                    logging.error(f"Failed to process sensor-actuator mapping for floor {floor_number}, room {room_number}")
+                continue
+            
+            floor_number, room_number, device_type, device_id = parsed
+            device_messages.append((floor_number, room_number, device_type, device_id, payload))
+
+        except Exception as e:
+            ingest_log.limited(logging.ERROR, ('message_failed', topic), "Error processing MQTT message on topic %s: %s", topic, e)
+
+    _flush_device_messages(device_messages)
+    ingest_log.maybe_emit_summary()
+
+
+def _flush_device_messages(device_messages):
+    if not device_messages:
+        return
+    processed = process_device_batch(app_instance, device_messages)
+    if processed == len(device_messages):
+        logging.debug("Processed device data for %d messages", processed)
+    else:
+        ingest_log.limited(logging.ERROR, 'device_batch_failed', "Failed to process %d of %d device messages",
+                           len(device_messages) - processed, len(device_messages))
+
+
+def get_ingest_stats():
+    """Return the ingest queue metrics of all consumers or None if no queue is running"""
+    if not ingest_queues:
+        return None
+    return combine_ingest_stats([queue.get_stats() for queue in ingest_queues])
+
+
+def on_disconnect(client, userdata, disconnect_flags, reason_code, properties):
     """Handle MQTT disconnection"""
-    if rc != 0:
-        logging.warning(f"Unexpected MQTT disconnection (code: {rc})")
+    if reason_code != 0:
+        logging.warning(f"Unexpected MQTT disconnection of consumer {userdata['partition_index']} (code: {reason_code})")
     else:
         logging.info("MQTT client disconnected")
 
@@ -113,37 +213,105 @@ def start_mqtt_client(app):
     global mqtt_client, app_instance
     app_instance = app
     
-    # Create a new MQTT client instance
-    mqtt_client = mqtt.Client()
+    ingest_log.configure(
+        mode=app.config['MQTT_LOG_MODE'],
+        summary_interval=app.config['MQTT_LOG_SUMMARY_SECONDS'],
+        limit_interval=app.config['MQTT_LOG_LIMIT_SECONDS'],
+    )
     
-    # Set up the callbacks
-    mqtt_client.on_connect = on_connect
-    mqtt_client.on_message = on_message
-    mqtt_client.on_disconnect = on_disconnect
-    mqtt_client.on_log = on_log
+    atexit.register(stop_mqtt_client)
+    
+    # Partitions are numbered over all processes, every process runs MQTT_CONSUMERS of them
+    consumers = max(1, app.config['MQTT_CONSUMERS'])
+    partition_count = max(1, app.config['MQTT_PARTITION_COUNT']) * consumers
+    first_partition = app.config['MQTT_PARTITION_INDEX'] * consumers
+    
+    # Every consumer gets a queue and workers of its own, so the database writes scale with the consumers.
+    # Started before any message can arrive.
+    for consumer_index in range(consumers):
+        ingest_queue = IngestQueue(
+            process_message_batch,
+            max_size=app.config['MQTT_INGEST_QUEUE_SIZE'],
+            max_batch_size=app.config['MQTT_INGEST_BATCH_SIZE'],
+            max_batch_wait=app.config['MQTT_INGEST_BATCH_WAIT_MS'] / 1000,
+            workers=app.config['MQTT_INGEST_WORKERS'],
+            full_policy=app.config['MQTT_INGEST_FULL_POLICY'],
+            name=f"mqtt-ingest-c{first_partition + consumer_index}" if consumers > 1 else 'mqtt-ingest',
+        )
+        ingest_queue.start()
+        ingest_queues.append(ingest_queue)
     
-    # Connect to the broker
     host = app.config['MQTT_BROKER_HOST']
     port = app.config['MQTT_BROKER_PORT']
     
-    try:
-        mqtt_client.connect(host, port, MQTT_KEEPALIVE)
-        # Start the loop in a background thread
-        mqtt_client.loop_start()
-        logging.info(f"MQTT client started and connecting to {host}:{port}")
-        return mqtt_client
-    except Exception as e:
-        logging.error(f"Failed to connect to MQTT broker: {str(e)}")
-        return None
+    for consumer_index in range(consumers):
+        partition_index = first_partition + consumer_index
+        client = _create_consumer_client(app, partition_index, partition_count, ingest_queues[consumer_index],
+                                         primary=consumer_index == 0)
+        
+        # Connect to the broker
+        try:
+            client.connect(host, port, MQTT_KEEPALIVE)
+            # Start the loop in a background thread
+            client.loop_start()
+            consumer_clients.append(client)
+            logging.info(f"MQTT consumer {partition_index + 1}/{partition_count} started and connecting to {host}:{port}")
+        except Exception as e:
+            logging.error(f"Failed to connect MQTT consumer {partition_index} to MQTT broker: {str(e)}")
+            if consumer_index == 0:
+                return None
+    
+    mqtt_client = consumer_clients[0]
+    return mqtt_client
+
+
+def _create_consumer_client(app, partition_index, partition_count, ingest_queue, primary):
+    """Create a MQTT client for one partition, MQTT v5 is used for shared subscriptions"""
+    topics = get_subscription_topics(app.config, partition_index, partition_count)
+    if primary:
+        # The caches are per process, every process receives all cache invalidations (no shared group)
+        topics.append(get_invalidation_topic(app.config))
+    client_id = app.config['MQTT_CLIENT_ID']
+    if client_id and partition_count > 1:
+        client_id = f"{client_id}-{partition_index}"
+    protocol = mqtt.MQTTv5 if app.config['MQTT_SHARED_GROUP'] else mqtt.MQTTv311
+    
+    # Create a new MQTT client instance
+    client = mqtt.Client(
+        callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+        client_id=client_id or '',
+        protocol=protocol,
+        userdata={
+            'partition_index': partition_index,
+            'topics': topics,
+            'primary': primary,
+            'ingest_queue': ingest_queue,
+        },
+    )
+    
+    # Set up the callbacks
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.on_disconnect = on_disconnect
+    client.on_log = on_log
+    return client
 
 
 def stop_mqtt_client():
-    """Gracefully stop the MQTT client"""
+    """Gracefully stop the MQTT client, drain the ingest queue and write the cached device states"""
     global mqtt_client
-    if mqtt_client:
+    for client in consumer_clients:
         try:
-            mqtt_client.loop_stop()
-            mqtt_client.disconnect()
+            client.loop_stop()
+            client.disconnect()
             logging.info("MQTT client stopped")
         except Exception as e:
-            logging.error(f"Error stopping MQTT client: {str(e)}")
\ No newline at end of file
+            logging.error(f"Error stopping MQTT client: {str(e)}")
+    consumer_clients.clear()
+    mqtt_client = None
+    for ingest_queue in ingest_queues:
+        ingest_queue.stop()
+    ingest_queues.clear()
+    if app_instance:
+        flush_device_cache(app_instance)
+    ingest_log.emit_summary()
\ No newline at end of file
@@ -0,0 +1,125 @@
+import json
+import uuid
+import logging
+from backend.mqtt.utils.cacheUtils import device_cache, invalidate_room_cache, remove_device_from_cache, flush_device_cache
+from backend.mqtt.utils.typeNameConfigUtils import type_name_thresholds
+from backend.mqtt.utils.mappingParserUtils import clear_mapping_fingerprints
+from backend.models.rollups import reset_rollup_watermarks
+
+# Scopes of a cache invalidation
+# The listed devices were deleted
+INVALIDATE_DEVICES = 'devices'
+# The listed devices were marked offline
+INVALIDATE_OFFLINE = 'offline'
+# Type name configs were changed
+INVALIDATE_TYPE_NAMES = 'type_names'
+# All devices and mappings were deleted (delete topic)
+INVALIDATE_ALL_DEVICES = 'all_devices'
+# The database was wiped (/cleardb)
+INVALIDATE_DATABASE = 'database'
+
+# Larger device lists are sent without ids and invalidate the whole device cache,
+# the message has to stay below MAX_PAYLOAD_SIZE of the receiving consumers
+MAX_INVALIDATION_DEVICE_IDS = 150
+
+# Identifies the invalidations of this process, they are already applied when they come back
+_origin = uuid.uuid4().hex
+
+
+def get_invalidation_topic(config):
+    """Topic of the cache invalidations, subscribed by every process without a shared group"""
+    return f"{config['MQTT_TOPIC_SUBSCRIBE'].split('/')[0]}/cache/invalidate"
+
+
+def invalidate_local_caches(app_instance, scope, device_ids=None):
+    """
+    Drop the cached state of this process that a change of the database made stale.
+
+    Args:
+        app_instance: Flask application instance
+        scope: One of the INVALIDATE_* scopes
+        device_ids: Devices of the devices and offline scopes, None if there were too many to list them
+    """
+    if scope in (INVALIDATE_DEVICES, INVALIDATE_OFFLINE) and device_ids is None:
+        # Pending states are written first, the devices are reloaded with their next message
+        flush_device_cache(app_instance)
+        device_cache.clear()
+        if scope == INVALIDATE_DEVICES:
+            clear_mapping_fingerprints()
+    elif scope == INVALIDATE_DEVICES:
+        for device_id in device_ids:
+            if device_id in device_cache:
+                remove_device_from_cache(device_id)
+        # The mappings of the devices were deleted with them, the next mapping re-send must store them again
+        clear_mapping_fingerprints()
+    elif scope == INVALIDATE_OFFLINE:
+        device_cache.mark_offline(device_ids)
+    elif scope == INVALIDATE_TYPE_NAMES:
+        with app_instance.app_context():
+            type_name_thresholds.refresh()
+    elif scope in (INVALIDATE_ALL_DEVICES, INVALIDATE_DATABASE):
+        invalidate_room_cache()
+        device_cache.clear()
+        clear_mapping_fingerprints()
+        if scope == INVALIDATE_DATABASE:
+            type_name_thresholds.clear()
+            reset_rollup_watermarks()
+    else:
+        logging.warning(f"Unknown cache invalidation scope: {scope}")
+
+
+def broadcast_cache_invalidation(app_instance, scope, device_ids=None):
+    """
+    Invalidate the caches of this process and publish the invalidation to the invalidation topic.
+    With MQTT_PARTITION_COUNT > 1 (or replicas of a partition) every process caches its own
+    devices, rooms, type name thresholds and mapping fingerprints, the other processes apply
+    the invalidation in their ingest workers.
+
+    Args:
+        app_instance: Flask application instance
+        scope: One of the INVALIDATE_* scopes
+        device_ids: Devices of the devices and offline scopes
+
+    Returns:
+        bool: True if the invalidation was published
+    """
+    if device_ids is not None:
+        device_ids = list(device_ids)
+    invalidate_local_caches(app_instance, scope, device_ids)
+
+    published_ids = device_ids if device_ids is None or len(device_ids) <= MAX_INVALIDATION_DEVICE_IDS else None
+    topic = get_invalidation_topic(app_instance.config)
+    try:
+        mqtt_client = getattr(app_instance, 'mqtt_client', None)
+        if not mqtt_client or not mqtt_client.is_connected():
+            if app_instance.config['MQTT_PARTITION_COUNT'] > 1 or app_instance.config['MQTT_SHARED_GROUP']:
+                logging.error(f"MQTT client is not connected, other processes keep their {scope} caches")
+            return False
+
+        payload = json.dumps({'origin': _origin, 'scope': scope, 'device_ids': published_ids})
+        result = mqtt_client.publish(topic, payload, qos=2)
+        if result.rc != 0:
+            logging.error(f"Failed to publish cache invalidation to {topic}, return code: {result.rc}")
+            return False
+        logging.info(f"Cache invalidation {scope} published to {topic}")
+        return True
+    except Exception as e:
+        logging.error(f"Error publishing cache invalidation {scope}: {str(e)}")
+        return False
+
+
+def handle_cache_invalidation(app_instance, payload):
+    """
+    Apply a cache invalidation received on the invalidation topic, invalidations of this process are skipped.
+    Returns: True if the caches were invalidated
+    """
+    try:
+        message = json.loads(payload)
+        if message.get('origin') == _origin:
+            return False
+        invalidate_local_caches(app_instance, message['scope'], message.get('device_ids'))
+        logging.info(f"Cache invalidation {message['scope']} applied")
+        return True
+    except Exception as e:
+        logging.error(f"Error applying cache invalidation: {str(e)}")
+        return False
@@ -1,34 +1,352 @@
 import logging
+import threading
+import time
+from sqlalchemy import bindparam
+from backend.extensions import db
 from backend.models import models
+from backend.mqtt.utils.typeNameConfigUtils import type_name_thresholds
 
-device_cache = {}
+# Device columns that change with every message and are written behind by flush()
+DEVICE_STATE_FIELDS = ('last_value', 'last_value_simplified', 'is_off', 'last_seen', 'is_online')
+# Device columns that only change when the gateway reconfigures a device, written through
+DEVICE_METADATA_FIELDS = ('name', 'type_name', 'unit', 'ai_planing_type', 'min_value', 'max_value', 'datatype',
+                          'read_interval', 'notify_interval', 'notify_change_precision',
+                          'initial_value', 'off_value', 'impact_step_size')
+# Fields of the room state snapshot, the fields of the room device list
+ROOM_STATE_FIELDS = ('id', 'device_id', 'name', 'device_type', 'type_name', 'description', 'min_value', 'max_value',
+                     'is_online', 'last_seen', 'read_interval', 'created_at', 'last_value', 'last_value_simplified',
+                     'initial_value', 'off_value', 'is_off', 'unit', 'ai_planing_type', 'impact_step_size')
+
+
+def device_to_cache_entry(device):
+    """Build a device cache entry from a models.Device object"""
+    entry = {
+        'id': device.id,
+        'device_id': device.device_id,
+        'room_id': device.room_id,
+        'device_type': device.device_type,
+        'description': device.description,
+        'created_at': device.created_at,
+    }
+    for field in DEVICE_METADATA_FIELDS + DEVICE_STATE_FIELDS:
+        entry[field] = getattr(device, field)
+    return entry
+
+
+def device_entry_to_dict(entry):
+    """JSON dict of a cache entry with the ROOM_STATE_FIELDS, formatted like the room device list"""
+    device = {field: entry.get(field) for field in ROOM_STATE_FIELDS}
+    # Ingest keeps the numeric reading, the database column is a string
+    if device['last_value'] is not None:
+        device['last_value'] = str(device['last_value'])
+    for field in ('last_seen', 'created_at'):
+        if device[field] is not None:
+            device[field] = device[field].isoformat()
+    return device
+
+
+class DeviceStateCache:
+    """
+    Thread-safe cache of the full device row, keyed by the gateway device_id.
+
+    It is shared by the MQTT ingest workers, Flask request threads and APScheduler jobs.
+    State fields (last value, simplified value, is_off, last_seen, is_online) are only
+    updated in memory and marked dirty; flush() writes all dirty entries to the database
+    in one executemany UPDATE. Reads return copies, so callers never see a half updated entry.
+
+    Every change of an entry gets the next version number, so the state of a room can be
+    polled with an ETag (room_snapshot) or as the changes since a version (room_changes).
+    Versions start at the current time in microseconds and stay increasing over restarts.
+
+    Writers that modify a copy outside the lock (the ingest) read it with get_versioned and store
+    it with put_if_unchanged, so a device removed or changed in between is not overwritten or resurrected.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._dirty = set()
+        self._stats = {'flushes': 0, 'flushed_rows': 0, 'failed_flushes': 0, 'last_flush_ms': 0.0, 'stale_puts': 0}
+        # True once initialize_device_cache loaded all devices
+        self.loaded = False
+        self._version = time.time_ns() // 1000
+        # Changes before the horizon (process start, last clear) are unknown
+        self._horizon = self._version
+        self._entry_versions = {}
+        # room_id -> device_ids, room_id -> version of the newest change in the room
+        self._room_devices = {}
+        self._room_versions = {}
+        # room_id -> {device_id: version} of devices removed from the room
+        self._removed = {}
+
+    def __contains__(self, device_id):
+        with self._lock:
+            return device_id in self._entries
+
+    def __getitem__(self, device_id):
+        with self._lock:
+            return dict(self._entries[device_id])
+
+    def __setitem__(self, device_id, entry):
+        self.put(device_id, entry)
+
+    def __delitem__(self, device_id):
+        with self._lock:
+            entry = self._entries.pop(device_id)
+            self._dirty.discard(device_id)
+            self._entry_versions.pop(device_id, None)
+            self._version += 1
+            self._remove_from_room(device_id, entry.get('room_id'))
+
+    def _remove_from_room(self, device_id, room_id):
+        """Record the removal of a device from a room with the current version. Requires the lock."""
+        devices = self._room_devices.get(room_id)
+        if devices is not None:
+            devices.discard(device_id)
+        self._removed.setdefault(room_id, {})[device_id] = self._version
+        self._room_versions[room_id] = self._version
+
+    def _set_entry(self, device_id, entry):
+        """Store entry, a new version is only assigned if it differs from the cached one. Requires the lock."""
+        previous = self._entries.get(device_id)
+        self._entries[device_id] = entry
+        if previous == entry:
+            return
+        self._version += 1
+        room_id = entry.get('room_id')
+        previous_room_id = previous.get('room_id') if previous is not None else room_id
+        if previous_room_id != room_id:
+            self._remove_from_room(device_id, previous_room_id)
+        self._entry_versions[device_id] = self._version
+        self._room_devices.setdefault(room_id, set()).add(device_id)
+        self._room_versions[room_id] = self._version
+        self._removed.get(room_id, {}).pop(device_id, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, device_id, default=None):
+        with self._lock:
+            entry = self._entries.get(device_id)
+            return dict(entry) if entry is not None else default
+
+    def get_versioned(self, device_id):
+        """
+        Returns:
+            tuple: (version of the entry, copy of the entry) or (None, None) if the device is not cached
+        """
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is None:
+                return None, None
+            return self._entry_versions.get(device_id), dict(entry)
+
+    def put(self, device_id, entry, dirty=False):
+        """Store a full entry. With dirty=True its state fields are written by the next flush."""
+        with self._lock:
+            self._set_entry(device_id, dict(entry))
+            if dirty:
+                self._dirty.add(device_id)
+
+    def put_if_unchanged(self, device_id, entry, version, dirty=False):
+        """
+        Store an entry read with get_versioned, unless the device was removed (delete, clear)
+        or changed (update, mark_offline, another put) since then.
+        A skipped entry is not resurrected and does not overwrite the newer change, its state
+        is taken over again with the next message of the device.
+
+        Returns:
+            bool: True if the entry was stored
+        """
+        with self._lock:
+            current = self._entries.get(device_id)
+            if current is None or self._entry_versions.get(device_id) != version:
+                self._stats['stale_puts'] += 1
+                return False
+            self._set_entry(device_id, {**current, **entry})
+            if dirty:
+                self._dirty.add(device_id)
+            return True
+
+    def update(self, device_id, **fields):
+        """Update fields that are already persisted in the database"""
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is None:
+                return False
+            self._set_entry(device_id, {**entry, **fields})
+            return True
+
+    def update_state(self, device_id, **fields):
+        """Update state fields in memory only, they are written by the next flush"""
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is None:
+                return False
+            self._set_entry(device_id, {**entry, **fields})
+            self._dirty.add(device_id)
+            return True
+
+    def mark_offline(self, device_ids):
+        """Set is_online to False for devices that were marked offline in the database"""
+        with self._lock:
+            for device_id in device_ids:
+                entry = self._entries.get(device_id)
+                if entry is not None:
+                    self._set_entry(device_id, {**entry, 'is_online': False})
+
+    def clear(self):
+        """Drop all entries, the cache counts as not loaded until initialize_device_cache runs again"""
+        with self._lock:
+            self.loaded = False
+            self._entries.clear()
+            self._dirty.clear()
+            self._entry_versions.clear()
+            self._room_devices.clear()
+            self._room_versions.clear()
+            self._removed.clear()
+            self._version += 1
+            self._horizon = self._version
+
+    def replace_room(self, room_id, entries):
+        """
+        Replace the entries of a room with entries loaded from the database, devices missing from entries
+        are removed. Unchanged entries keep their version, dirty entries are kept.
+        """
+        with self._lock:
+            device_ids = set()
+            for entry in entries:
+                device_ids.add(entry['device_id'])
+                if entry['device_id'] not in self._dirty:
+                    self._set_entry(entry['device_id'], dict(entry))
+            for device_id in list(self._room_devices.get(room_id, ())):
+                if device_id not in device_ids and device_id not in self._dirty:
+                    del self[device_id]
+
+    def room_version(self, room_id):
+        """Version of the newest change of the devices in the room"""
+        with self._lock:
+            return self._room_versions.get(room_id, self._horizon)
+
+    def room_snapshot(self, room_id):
+        """
+        Returns:
+            tuple: (room version, copies of the entries of all devices in the room)
+        """
+        with self._lock:
+            return self._room_versions.get(room_id, self._horizon), \
+                [dict(self._entries[device_id]) for device_id in self._room_devices.get(room_id, ())]
+
+    def room_changes(self, room_id, since):
+        """
+        Devices of the room changed or removed after version since.
+
+        Returns:
+            tuple: (room version, copies of the changed entries, removed device_ids),
+                   None if since is not a version of this cache (older than the horizon or in the future),
+                   the caller needs the full room_snapshot then
+        """
+        with self._lock:
+            if since < self._horizon or since > self._version:
+                return None
+            changed = [dict(self._entries[device_id]) for device_id in self._room_devices.get(room_id, ())
+                       if self._entry_versions[device_id] > since]
+            removed = [device_id for device_id, version in self._removed.get(room_id, {}).items() if version > since]
+            return self._room_versions.get(room_id, self._horizon), changed, removed
+
+    def dirty_count(self):
+        with self._lock:
+            return len(self._dirty)
+
+    def flush(self, app_instance):
+        """
+        Write the state fields of all dirty entries to the database in one transaction.
+        Entries stay dirty if the write fails.
+        Returns: number of written devices
+        """
+        with self._lock:
+            dirty_ids = list(self._dirty)
+            self._dirty.clear()
+            rows = []
+            for device_id in dirty_ids:
+                entry = self._entries.get(device_id)
+                if entry is None:
+                    continue
+                row = {field: entry[field] for field in DEVICE_STATE_FIELDS}
+                row['_id'] = entry['id']
+                rows.append(row)
+
+        if not rows:
+            return 0
+
+        start = time.perf_counter()
+        try:
+            with app_instance.app_context():
+                db.session.execute(_device_state_update, rows)
+                db.session.commit()
+        except Exception as e:
+            with self._lock:
+                self._dirty.update(device_id for device_id in dirty_ids if device_id in self._entries)
+                self._stats['failed_flushes'] += 1
+            logging.error(f"Failed to flush {len(rows)} device states: {str(e)}")
+            return 0
+
+        with self._lock:
+            self._stats['flushes'] += 1
+            self._stats['flushed_rows'] += len(rows)
+            self._stats['last_flush_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        logging.debug(f"Flushed {len(rows)} device states")
+        return len(rows)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['dirty'] = len(self._dirty)
+        return stats
+
+
+_devices_table = models.Device.__table__
+# SET columns are taken from the parameter keys, the primary key is bound as _id
+_device_state_update = _devices_table.update().where(_devices_table.c.id == bindparam('_id'))
+
+device_cache = DeviceStateCache()
 
 def initialize_device_cache(app_instance):
     """Initialize the device cache with existing devices from database"""
-    global device_cache
     try:
+        # Reloading must not overwrite states that were not written yet, e.g. on a reconnect
+        device_cache.flush(app_instance)
         with app_instance.app_context():
             devices = models.Device.query.all()
             for device in devices:
-                device_cache[device.device_id] = {
-                    'id': device.id,
-                    'room_id': device.room_id,
-                    'device_type': device.device_type,
-                    'type_name': device.type_name,
-                    'name': device.name,
-                    'is_online': device.is_online
-                }
+                device_cache[device.device_id] = device_to_cache_entry(device)
+            device_cache.loaded = True
             logging.info(f"Device cache initialized with {len(device_cache)} devices")
+            _warm_room_cache()
+            type_name_thresholds.refresh()
     except Exception as e:
         logging.error(f"Failed to initialize device cache: {str(e)}")
 
 
+def refresh_room_from_database(app_instance, room_id):
+    """Reload the devices of a room from the database into the device cache, for rooms ingested by another process"""
+    with app_instance.app_context():
+        devices = models.Device.query.filter_by(room_id=room_id).all()
+        device_cache.replace_room(room_id, [device_to_cache_entry(device) for device in devices])
+
+
+def flush_device_cache(app_instance):
+    """Write dirty device states to the database"""
+    return device_cache.flush(app_instance)
+
+
 def remove_device_from_cache(device_id):
     """
     Remove a device from the cache
     """
 
-    global device_cache
     try:
         if device_id in device_cache:
             del device_cache[device_id]
@@ -38,4 +356,70 @@ def remove_device_from_cache(device_id):
         return False
     except Exception as e:
         logging.error(f"Failed to remove device {device_id} from cache: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+
+# (floor_number, room_number) -> {'room_id': ..., 'floor_id': ...}
+room_cache = {}
+room_cache_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+_room_cache_lock = threading.Lock()
+
+def _warm_room_cache():
+    """Load all floor/room pairs into the room cache. Requires an app context."""
+    rows = db.session.query(models.Floor.floor_number, models.Room.room_number, models.Room.id, models.Room.floor_id).join(
+        models.Room, models.Room.floor_id == models.Floor.id
+    ).all()
+    with _room_cache_lock:
+        room_cache.clear()
+        for floor_number, room_number, room_id, floor_id in rows:
+            room_cache[(floor_number, room_number)] = {'room_id': room_id, 'floor_id': floor_id}
+    logging.info(f"Room cache initialized with {len(rows)} rooms")
+
+
+def get_cached_room_id(app_instance, floor_number, room_number):
+    """
+    Resolve (floor_number, room_number) to the room id, querying the database only on a cache miss.
+    Misses are not cached, so rooms created later are found without invalidation.
+    Returns: room id or None if the room does not exist on that floor
+    """
+    key = (floor_number, room_number)
+    with _room_cache_lock:
+        entry = room_cache.get(key)
+        if entry is not None:
+            room_cache_stats['hits'] += 1
+            return entry['room_id']
+        room_cache_stats['misses'] += 1
+
+    with app_instance.app_context():
+        row = db.session.query(models.Room.id, models.Room.floor_id).join(
+            models.Floor, models.Room.floor_id == models.Floor.id
+        ).filter(
+            models.Floor.floor_number == floor_number,
+            models.Room.room_number == room_number
+        ).first()
+
+    if row is None:
+        return None
+
+    room_id, floor_id = row
+    with _room_cache_lock:
+        room_cache[key] = {'room_id': room_id, 'floor_id': floor_id}
+    return room_id
+
+
+def invalidate_room_cache():
+    """Clear the room cache, e.g. after floors or rooms were created or deleted"""
+    with _room_cache_lock:
+        room_cache.clear()
+        room_cache_stats['invalidations'] += 1
+    logging.info("Room cache invalidated")
+
+
+def get_room_cache_stats():
+    """Return size and hit/miss counters of the room cache"""
+    with _room_cache_lock:
+        stats = dict(room_cache_stats)
+        stats['size'] = len(room_cache)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+    return stats
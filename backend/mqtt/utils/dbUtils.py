@@ -1,12 +1,20 @@
 import logging
+import math
 import backend.models.models as models
 from backend.extensions import db
-from backend.mqtt.utils.cacheUtils import device_cache
-from backend.mqtt.utils.parsersUtils import parse_device_payload, validate_device_data
-from backend.mqtt.utils.mappingParserUtils import parse_mapping_payload, create_or_update_sensor_actuator_mappings, link_mappings_to_devices
+from backend.mqtt.utils.cacheUtils import device_cache, get_cached_room_id, device_to_cache_entry, DEVICE_METADATA_FIELDS
+from backend.mqtt.utils.parsersUtils import device_payload_decoder
+from backend.mqtt.utils.mappingParserUtils import parse_mapping_payload, create_or_update_sensor_actuator_mappings, link_mappings_to_devices, \
+    mapping_payload_fingerprint, is_mapping_unchanged, remember_mapping_fingerprint
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime
-from backend.mqtt.utils.typeNameConfigUtils import get_simple_default_middle_values
+from backend.mqtt.utils.typeNameConfigUtils import get_simple_default_middle_values, type_name_thresholds
+from backend.mqtt.utils.sensorDataUtils import build_sensor_data_row, commit_with_sensor_data
+from backend.mqtt.utils.ingestLogUtils import ingest_log
+
+_devices_table = models.Device.__table__
+# Payload fields that change with every message, all other payload fields are static metadata
+_PAYLOAD_STATE_FIELDS = ('last_value', 'is_off')
 
 def get_or_create_device(app_instance, floor_number, room_number, sensor_type, device_id, payload=None):
     """
@@ -16,29 +24,22 @@ def get_or_create_device(app_instance, floor_number, room_number, sensor_type, d
     """
     
     try:
-        # First, get the room object that we'll need for both cached and new devices
-        with app_instance.app_context():
-            floor = models.Floor.query.filter_by(floor_number=floor_number).first()
-            if not floor:
-                logging.error(f"Floor {floor_number} does not exist")
-                return None
-            
-            # Check if room exists
-            room = models.Room.query.filter_by(room_number=room_number, floor_id=floor.id).first()
-            if not room:
-                logging.error(f"Room {room_number} on floor {floor_number} does not exist")
-                return None
+        # First, resolve the room that we'll need for both cached and new devices
+        room_id = get_cached_room_id(app_instance, floor_number, room_number)
+        if not room_id:
+            ingest_log.limited(logging.ERROR, ('missing_room', floor_number, room_number),
+                               "Room %s on floor %s does not exist", room_number, floor_number)
+            return None
         
         # Check if device already exists in cache
         if device_id in device_cache:
-            logging.debug(f"Device {device_id} found in cache")
             # Process payload and update device status in a single transaction
-            success = _process_device_payload_and_status(app_instance, device_id, sensor_type, payload, room)
-            if success:
-                return device_cache[device_id]
-            else:
-                logging.warning(f"Failed to process payload for cached device {device_id}")
-                return device_cache[device_id]  # Return device info even if payload processing failed
+            success = _process_device_payload_and_status(app_instance, device_id, sensor_type, payload, room_id)
+            if not success:
+                ingest_log.limited(logging.WARNING, ('cached_device_failed', device_id),
+                                   "Failed to process payload for cached device %s", device_id)
+            # Return device info even if payload processing failed
+            return device_cache.get(device_id)
         
         # Device not in cache, check database and create if needed
         with app_instance.app_context():
@@ -47,10 +48,10 @@ def get_or_create_device(app_instance, floor_number, room_number, sensor_type, d
             
             if existing_device:
                 # Device exists in DB but not in cache
-                return _handle_existing_device(app_instance, existing_device, sensor_type, room, payload)
+                return _handle_existing_device(app_instance, existing_device, sensor_type, room_id, payload)
             else:
                 # Create new device
-                return _create_new_device(app_instance, device_id, sensor_type, room, floor_number, room_number, payload)
+                return _create_new_device(app_instance, device_id, sensor_type, room_id, floor_number, room_number, payload)
     
     except Exception as e:
         logging.error(f"Error creating/getting device {device_id} (Floor: {floor_number}, Room: {room_number}): {str(e)}")
@@ -60,25 +61,20 @@ def get_or_create_device(app_instance, floor_number, room_number, sensor_type, d
             pass
         return None
 
-def _handle_existing_device(app_instance, existing_device, sensor_type, room, payload):
+def _handle_existing_device(app_instance, existing_device, sensor_type, room_id, payload):
     """Handle existing device found in database but not in cache"""
     try:
-        device_info = {
-            'id': existing_device.id,
-            'room_id': existing_device.room_id,
-            'device_type': existing_device.device_type,
-            'type_name': existing_device.type_name,
-            'name': existing_device.name,
-            'is_online': True
-        }
+        # Process payload and update device status in a single transaction
+        success = _process_device_payload_and_status(app_instance, existing_device.device_id, sensor_type, payload, room_id,
+                                                   device_obj=existing_device)
+        
+        # The payload was applied to existing_device, which belongs to the session of the caller's app context
+        device_info = device_to_cache_entry(existing_device)
+        db.session.commit()
         
         # Add to cache
         device_cache[existing_device.device_id] = device_info
         
-        # Process payload and update device status in a single transaction
-        success = _process_device_payload_and_status(app_instance, existing_device.device_id, sensor_type, payload, room,
-                                                   device_obj=existing_device)
-        
         # Link any pending mappings for this device
         try:
             linked_count = link_mappings_to_devices(app_instance)
@@ -92,14 +88,14 @@ def _handle_existing_device(app_instance, existing_device, sensor_type, room, pa
         else:
             logging.warning(f"Device {existing_device.device_id} added to cache but payload processing failed")
         
-        return device_info
+        return device_cache.get(existing_device.device_id)
         
     except Exception as e:
         logging.error(f"Error handling existing device {existing_device.device_id}: {str(e)}")
         db.session.rollback()
         return None
 
-def _create_new_device(app_instance, device_id, sensor_type, room, floor_number, room_number, payload):
+def _create_new_device(app_instance, device_id, sensor_type, room_id, floor_number, room_number, payload):
     """Create a new device with proper race condition handling"""
     try:
         device_name = f"{sensor_type.title()} - {room_number}"
@@ -109,19 +105,20 @@ def _create_new_device(app_instance, device_id, sensor_type, room, floor_number,
             device_type=sensor_type,
             description=f"{sensor_type} sensor in room {room_number} on floor {floor_number}",
             is_online=True,
-            room_id=room.id,
+            room_id=room_id,
             last_seen=datetime.utcnow()
         )
         
         # Parse and validate payload data if provided
         parsed_payload = None
         if payload:
-            parsed_payload = parse_device_payload(payload, sensor_type)
-            if parsed_payload and validate_device_data(parsed_payload, sensor_type):
+            parsed_payload = device_payload_decoder.decode(device_id, payload, sensor_type)
+            if parsed_payload:
                 # Update device with parsed payload data
                 _update_device_from_payload(new_device, parsed_payload)
             else:
-                logging.warning(f"Invalid payload for new device {device_id}, creating device without payload data")
+                ingest_log.limited(logging.WARNING, ('invalid_payload', device_id),
+                                   "Invalid payload for new device %s, creating device without payload data", device_id)
         
         # Add device to session
         db.session.add(new_device)
@@ -129,43 +126,28 @@ def _create_new_device(app_instance, device_id, sensor_type, room, floor_number,
         # Try to commit the new device
         try:
             db.session.flush()  # Get the device ID without committing
-            device_info = {
-                'id': new_device.id,
-                'room_id': new_device.room_id,
-                'device_type': new_device.device_type,
-                'type_name': new_device.type_name,
-                'name': new_device.name,
-                'is_online': True
-            }
             
             # Create sensor data record if we have valid payload and it's a sensor
-            sensor_data_created = False
-            if parsed_payload and sensor_type == 'sensor' and parsed_payload['last_value'] is not None:
+            sensor_data_rows = []
+            if parsed_payload and sensor_type == 'sensor' and parsed_payload.get('last_value') is not None:
                 try:
-                    latest_value = float(parsed_payload['last_value'])
                     create_device_type_config(app_instance, new_device.device_type, new_device.type_name, 
                                                       new_device.max_value, new_device.min_value, new_device.unit)
-                    simplified_value = get_simplified_value(latest_value, new_device.device_type, new_device.type_name)
+                    latest_value, simplified_value = _record_sensor_reading(new_device.id, new_device.device_type, new_device.type_name,
+                                                                            parsed_payload, room_id, sensor_data_rows)
                     new_device.last_value = latest_value  # Update latest value in device object
                     new_device.last_value_simplified = simplified_value  # Update simplified value in device object
-                    sensor_data = models.SensorData(
-                        device_id=new_device.id,
-                        value=latest_value,
-                        simplified_value=simplified_value,
-                        timestamp=datetime.utcnow()
-                    )
-                    # Handle RFID sensor behavior
-                    _handle_rfid_sensor(room, parsed_payload, latest_value)
-
-                    db.session.add(room)
-                    db.session.add(sensor_data)
-                    sensor_data_created = True
-                    logging.debug(f"Sensor data record created for new device {device_id}")
                 except Exception as sd_error:
+                    sensor_data_rows = []
                     logging.warning(f"Failed to create sensor data for device {device_id}: {sd_error}")
             
-            # Commit everything at once
-            db.session.commit()
+            # Build the cache entry before the commit expires the object
+            device_info = device_to_cache_entry(new_device)
+            
+            # Commit everything at once, the readings are only stored for a committed device
+            sensor_data_created = bool(commit_with_sensor_data(sensor_data_rows))
+            if sensor_data_created:
+                logging.debug(f"Sensor data record created for new device {device_id}")
             
             # Add to cache only after successful commit
             device_cache[device_id] = device_info
@@ -183,19 +165,22 @@ def _create_new_device(app_instance, device_id, sensor_type, room, floor_number,
                 log_msg += " with sensor data"
             logging.info(log_msg)
             
-            return device_info
+            return device_cache.get(device_id)
             
         except IntegrityError as ie:
             # Handle race condition - device was created by another process
             db.session.rollback()
-            logging.info(f"Device {device_id} was created by another process, fetching from database")
+            ingest_log.limited(logging.INFO, ('integrity_error', device_id),
+                               "Device %s was created by another process, fetching from database", device_id)
             
             # Fetch the device that was created by another process
             existing_device = models.Device.query.filter_by(device_id=device_id).first()
             if existing_device:
-                return _handle_existing_device(app_instance, existing_device, sensor_type, room, payload)
+                return _handle_existing_device(app_instance, existing_device, sensor_type, room_id, payload)
             else:
-                logging.error(f"Failed to retrieve device {device_id} after integrity error")
+                ingest_log.device_event(device_id, 'failures')
+                ingest_log.limited(logging.ERROR, ('integrity_error_missing', device_id),
+                                   "Failed to retrieve device %s after integrity error", device_id)
                 return None
                 
     except Exception as e:
@@ -203,143 +188,306 @@ def _create_new_device(app_instance, device_id, sensor_type, room, floor_number,
         db.session.rollback()
         return None
 
-def _process_device_payload_and_status(app_instance, device_id, sensor_type, payload, room, device_obj=None,):
+def _process_device_payload_and_status(app_instance, device_id, sensor_type, payload, room_id, device_obj=None,):
     """
     Process device payload and update device status in a single transaction.
+    Cached devices are updated over the device cache without loading the device row.
     Returns True if successful, False otherwise.
     """
     try:
         with app_instance.app_context():
-            # Get device object if not provided
+            sensor_data_rows = []
+            
             if device_obj is None:
-                device_obj = models.Device.query.filter_by(device_id=device_id).first()
-                if not device_obj:
-                    logging.error(f"Device {device_id} not found in database")
+                version, entry = device_cache.get_versioned(device_id)
+                if entry is None:
+                    logging.error(f"Device {device_id} not found in cache")
                     return False
-            
-            # Update device status and last_seen
-            device_obj.is_online = True
-            device_obj.last_seen = datetime.utcnow()
-            
-            # Process payload if provided
-            sensor_data_created = False
-            actuator_data_updated = False
-            
-            if payload:
-                parsed_payload = parse_device_payload(payload, sensor_type)
-                if parsed_payload and validate_device_data(parsed_payload, sensor_type):
-                    # Update device with payload data
-                    _update_device_from_payload(device_obj, parsed_payload)
-                    
-                    # Create sensor data record if it's a sensor with a value
-                    if sensor_type == 'sensor' and parsed_payload['last_value'] is not None:
-                        try:
-                            latest_value = float(parsed_payload['last_value'])
-                            simplified_value = get_simplified_value(latest_value, device_obj.device_type, device_obj.type_name)
-                            device_obj.last_value = latest_value  # Update latest value in device object
-                            device_obj.last_value_simplified = simplified_value  # Update simplified value in device object
-                            sensor_data = models.SensorData(
-                                device_id=device_obj.id,
-                                value=latest_value,
-                                simplified_value=simplified_value,
-                                timestamp=datetime.utcnow()
-                            )
-                            _handle_rfid_sensor(room, parsed_payload, latest_value)
-                            
-                            db.session.add(room)
-                            db.session.add(sensor_data)
-                            sensor_data_created = True
-                            logging.debug(f"Sensor data record created for device {device_id}")
-                        except Exception as sd_error:
-                            logging.warning(f"Failed to create sensor data for device {device_id}: {sd_error}")
-                    
-                    # Handle actuator data updates
-                    elif sensor_type == 'actuator':
-                        actuator_data_updated = True
-                        logging.debug(f"Actuator data updated for device {device_id}")
-                        
-                else:
-                    logging.warning(f"Invalid payload for device {device_id}")
+                readings = []
+                event = _apply_cached_device_payload(entry, sensor_type, payload, room_id, readings)
+                _record_sensor_readings(readings, sensor_data_rows)
+            else:
+                event = _apply_device_payload(device_obj, sensor_type, payload, room_id, sensor_data_rows)
             
             # Commit all changes at once
-            db.session.commit()
-            
-            # Update cache
-            if device_id in device_cache:
-                device_cache[device_id]['is_online'] = True
-                # Update cache with new device data if we have parsed payload
-                if payload:
-                    parsed_payload = parse_device_payload(payload, sensor_type)
-                    if parsed_payload:
-                        device_cache[device_id]['type_name'] = parsed_payload.get('type_name', device_cache[device_id].get('type_name'))
+            commit_with_sensor_data(sensor_data_rows)
             
-            log_msg = f"Device {device_id} status updated"
-            if sensor_data_created:
-                log_msg += " with new sensor data"
-            elif actuator_data_updated:
-                log_msg += " with actuator data"
-            logging.debug(log_msg)
+            if device_obj is None:
+                device_cache.put_if_unchanged(device_id, entry, version, dirty=True)
+            ingest_log.device_event(device_id, *event)
             
             return True
             
     except Exception as e:
-        logging.error(f"Error processing payload and status for device {device_id}: {str(e)}")
+        ingest_log.device_event(device_id, 'failures')
+        ingest_log.limited(logging.ERROR, ('device_failed', device_id),
+                           "Error processing payload and status for device %s: %s", device_id, e)
         try:
             db.session.rollback()
         except:
             pass
         return False
 
+def _apply_device_payload(device_obj, sensor_type, payload, room_id, sensor_data_rows):
+    """
+    Apply a device payload to the device object in the current session without committing.
+    Sensor readings are appended to sensor_data_rows, the caller writes them with commit_with_sensor_data.
+    Returns: (event, value) for ingest_log.device_event, recorded by the caller after the commit
+    """
+    device_id = device_obj.device_id
+
+    # Update device status and last_seen
+    device_obj.is_online = True
+    device_obj.last_seen = datetime.utcnow()
+    
+    # Process payload if provided
+    event, value = 'updates', None
+    
+    if payload:
+        parsed_payload = device_payload_decoder.decode(device_id, payload, sensor_type)
+        if parsed_payload:
+            # Update device with payload data
+            _update_device_from_payload(device_obj, parsed_payload)
+            
+            # Create sensor data record if it's a sensor with a value
+            if sensor_type == 'sensor' and parsed_payload.get('last_value') is not None:
+                try:
+                    latest_value, simplified_value = _record_sensor_reading(device_obj.id, device_obj.device_type, device_obj.type_name,
+                                                                            parsed_payload, room_id, sensor_data_rows)
+                    device_obj.last_value = latest_value  # Update latest value in device object
+                    device_obj.last_value_simplified = simplified_value  # Update simplified value in device object
+                    event, value = 'readings', latest_value
+                except Exception as sd_error:
+                    event = 'failures'
+                    ingest_log.limited(logging.WARNING, ('sensor_data_failed', device_id),
+                                       "Failed to create sensor data for device %s: %s", device_id, sd_error)
+            
+            # Handle actuator data updates
+            elif sensor_type == 'actuator':
+                event, value = 'actuator_updates', parsed_payload.get('last_value')
+                
+        else:
+            event = 'invalid'
+            ingest_log.limited(logging.WARNING, ('invalid_payload', device_id), "Invalid payload for device %s", device_id)
+
+    return event, value
+
+def _apply_cached_device_payload(entry, sensor_type, payload, room_id, readings):
+    """
+    Apply a device payload to a device cache entry without loading the device row.
+    State fields are only changed in the entry, the caller stores it with dirty=True after
+    the commit. Changed metadata fields are written through with an UPDATE in the current session.
+    Sensor readings are appended to readings, the caller records them with _record_sensor_readings.
+    Returns: [event, value] for ingest_log.device_event, recorded by the caller after the commit
+    """
+    device_id = entry['device_id']
+
+    # Update device status and last_seen
+    entry['is_online'] = True
+    entry['last_seen'] = datetime.utcnow()
+
+    # Changed to failures by _record_sensor_readings if the reading cannot be simplified
+    event = ['updates', None]
+
+    if payload:
+        parsed_payload = device_payload_decoder.decode(device_id, payload, sensor_type)
+        if parsed_payload:
+            fingerprint = device_payload_decoder.get_metadata_fingerprint(device_id)
+            if fingerprint is not None and entry.get('metadata_fingerprint') == fingerprint:
+                # Unchanged re-send of the gateway, only the state fields are taken over
+                for field in _PAYLOAD_STATE_FIELDS:
+                    if field in parsed_payload:
+                        entry[field] = parsed_payload[field]
+            else:
+                fields = _payload_device_fields(parsed_payload)
+                changed_metadata = {field: value for field, value in fields.items()
+                                    if field in DEVICE_METADATA_FIELDS and entry.get(field) != value}
+                if changed_metadata:
+                    db.session.execute(_devices_table.update().where(_devices_table.c.id == entry['id']).values(**changed_metadata))
+                    logging.info("Device %s metadata updated: %s", device_id, sorted(changed_metadata))
+                entry.update(fields)
+                entry['metadata_fingerprint'] = fingerprint
+
+            # Queue the sensor reading if it's a sensor with a value
+            if sensor_type == 'sensor' and parsed_payload.get('last_value') is not None:
+                try:
+                    latest_value = float(parsed_payload['last_value'])
+                    event[:] = ['readings', latest_value]
+                    readings.append((entry, parsed_payload, room_id, latest_value, event))
+                except Exception as sd_error:
+                    event[0] = 'failures'
+                    ingest_log.limited(logging.WARNING, ('sensor_data_failed', device_id),
+                                       "Failed to create sensor data for device %s: %s", device_id, sd_error)
+
+            # Handle actuator data updates
+            elif sensor_type == 'actuator':
+                event[:] = ['actuator_updates', parsed_payload.get('last_value')]
+
+        else:
+            event[0] = 'invalid'
+            ingest_log.limited(logging.WARNING, ('invalid_payload', device_id), "Invalid payload for device %s", device_id)
+
+    return event
+
+def _record_sensor_readings(readings, sensor_data_rows):
+    """
+    Simplify the queued readings of cached devices in one vectorized pass with type_name_thresholds,
+    update their cache entries, append their sensor data rows and handle RFID occupancy.
+
+    Args:
+        readings: List of (entry, parsed_payload, room_id, latest_value, event) from _apply_cached_device_payload
+        sensor_data_rows: Rows written by the caller with commit_with_sensor_data
+    """
+    if not readings:
+        return
+
+    type_ids = [get_type_name_type_id(entry['device_type'], entry['type_name']) for entry, *_ in readings]
+    simplified, valid = type_name_thresholds.simplify_values([reading[3] for reading in readings], type_ids)
+
+    for (entry, parsed_payload, room_id, latest_value, event), simplified_value, is_valid in zip(
+            readings, simplified.tolist(), valid.tolist()):
+        device_id = entry['device_id']
+        if not is_valid:
+            event[0] = 'failures'
+            ingest_log.limited(logging.WARNING, ('sensor_data_failed', device_id),
+                               "Failed to create sensor data for device %s: value %s out of range or %s/%s not configured",
+                               device_id, latest_value, entry['device_type'], entry['type_name'])
+            continue
+        try:
+            sensor_data_rows.append(build_sensor_data_row(entry['id'], latest_value, simplified_value))
+            _handle_rfid_sensor(room_id, parsed_payload, latest_value)
+            entry['last_value'] = latest_value
+            entry['last_value_simplified'] = simplified_value
+        except Exception as sd_error:
+            event[0] = 'failures'
+            ingest_log.limited(logging.WARNING, ('sensor_data_failed', device_id),
+                               "Failed to create sensor data for device %s: %s", device_id, sd_error)
+
+def _record_sensor_reading(device_pk, device_type, type_name, parsed_payload, room_id, sensor_data_rows):
+    """
+    Simplify a sensor reading, append its sensor data row and handle RFID occupancy.
+    Returns: (latest_value, simplified_value)
+    """
+    latest_value = float(parsed_payload['last_value'])
+    simplified_value = get_simplified_value(latest_value, device_type, type_name)
+    sensor_data_rows.append(build_sensor_data_row(device_pk, latest_value, simplified_value))
+    _handle_rfid_sensor(room_id, parsed_payload, latest_value)
+    return latest_value, simplified_value
+
+def process_device_batch(app_instance, messages):
+    """
+    Process a batch of device messages from the ingest queue.
+    Messages of cached devices are written in one transaction per run of consecutive cached messages.
+    Messages of devices that are not cached yet go over get_or_create_device, so the order of
+    messages per device is kept.
+
+    Args:
+        app_instance: Flask application instance
+        messages: List of (floor_number, room_number, device_type, device_id, payload) tuples
+
+    Returns:
+        int: Number of successfully processed messages
+    """
+    processed = 0
+    pending = []
+    for message in messages:
+        if message[3] in device_cache:
+            pending.append(message)
+            continue
+
+        processed += _write_cached_device_batch(app_instance, pending)
+        pending = []
+        if get_or_create_device(app_instance, *message):
+            processed += 1
+
+    processed += _write_cached_device_batch(app_instance, pending)
+    return processed
+
+def _write_cached_device_batch(app_instance, messages):
+    """
+    Write the messages of already cached devices in a single transaction.
+    Device rows are not loaded, their state goes to the device cache and is written by its flush.
+    If the transaction fails the messages are retried one by one, so a single bad
+    message does not drop the whole batch.
+    Returns: number of successfully processed messages
+    """
+    if not messages:
+        return 0
+
+    try:
+        with app_instance.app_context():
+            # Private copies of the cache entries with their versions, stored back only after the commit
+            entries = {}
+            versions = {}
+            events = []
+            readings = []
+            sensor_data_rows = []
+
+            for floor_number, room_number, sensor_type, device_id, payload in messages:
+                room_id = get_cached_room_id(app_instance, floor_number, room_number)
+                if not room_id:
+                    ingest_log.limited(logging.ERROR, ('missing_room', floor_number, room_number),
+                                       "Room %s on floor %s does not exist", room_number, floor_number)
+                    continue
+
+                if device_id not in entries:
+                    versions[device_id], entries[device_id] = device_cache.get_versioned(device_id)
+                entry = entries[device_id]
+                if entry is None:
+                    logging.error(f"Device {device_id} not found in cache")
+                    continue
+
+                events.append((device_id, _apply_cached_device_payload(entry, sensor_type, payload, room_id, readings)))
+
+            # The readings of the batch are simplified together, one INSERT for all of them and one commit
+            _record_sensor_readings(readings, sensor_data_rows)
+            commit_with_sensor_data(sensor_data_rows)
+
+            for device_id, entry in entries.items():
+                if entry is not None:
+                    device_cache.put_if_unchanged(device_id, entry, versions[device_id], dirty=True)
+            for device_id, event in events:
+                ingest_log.device_event(device_id, *event)
+
+            return len(events)
+
+    except Exception as e:
+        logging.error(f"Error writing batch of {len(messages)} device messages, retrying one by one: {str(e)}")
+        try:
+            with app_instance.app_context():
+                db.session.rollback()
+        except:
+            pass
+
+    processed = 0
+    for message in messages:
+        if get_or_create_device(app_instance, *message):
+            processed += 1
+    return processed
+
+def _payload_device_fields(parsed_payload):
+    """Return the device columns a parsed payload sets, empty values do not overwrite existing data"""
+    fields = {}
+
+    # Fields that are only set if they are not empty
+    for field in ('name', 'type_name', 'unit', 'ai_planing_type', 'datatype', 'notify_interval',
+                  'initial_value', 'off_value', 'impact_step_size'):
+        if parsed_payload.get(field):
+            fields[field] = parsed_payload[field]
+
+    # Fields that are set if they are present, also for 0 or False
+    for field in ('min_value', 'max_value', 'read_interval', 'notify_change_precision', 'is_off', 'last_value'):
+        if parsed_payload.get(field) is not None:
+            fields[field] = parsed_payload[field]
+
+    return fields
+
 def _update_device_from_payload(device_obj, parsed_payload):
     """Update device object with parsed payload data"""
     try:
         # Update device fields with payload data
-        if parsed_payload.get('name'):
-            device_obj.name = parsed_payload['name']
-        
-        if parsed_payload.get('type_name'):
-            device_obj.type_name = parsed_payload['type_name']
-        
-        if parsed_payload.get('unit'):
-            device_obj.unit = parsed_payload['unit']
-
-        if parsed_payload.get('ai_planing_type'):
-            device_obj.ai_planing_type = parsed_payload['ai_planing_type']
-        
-        if parsed_payload.get('min_value') is not None:
-            device_obj.min_value = parsed_payload['min_value']
-            
-        if parsed_payload.get('max_value') is not None:
-            device_obj.max_value = parsed_payload['max_value']
-            
-        if parsed_payload.get('datatype'):
-            device_obj.datatype = parsed_payload['datatype']
-            
-        # Update sensor-specific fields
-        if parsed_payload.get('read_interval') is not None:
-            device_obj.read_interval = parsed_payload['read_interval']
-            
-        if parsed_payload.get('notify_interval'):
-            device_obj.notify_interval = parsed_payload['notify_interval']
-            
-        if parsed_payload.get('notify_change_precision') is not None:
-            device_obj.notify_change_precision = parsed_payload['notify_change_precision']
-            
-        # Update actuator-specific fields
-        if parsed_payload.get('initial_value'):
-            device_obj.initial_value = parsed_payload['initial_value']
-            
-        if parsed_payload.get('off_value'):
-            device_obj.off_value = parsed_payload['off_value']
-            
-        if parsed_payload.get('is_off') is not None:
-            device_obj.is_off = parsed_payload['is_off']
-        
-        if parsed_payload.get('impact_step_size'):
-            device_obj.impact_step_size = parsed_payload['impact_step_size']
-
-        if parsed_payload.get('last_value') is not None:
-            device_obj.last_value = parsed_payload['last_value']
+        for field, value in _payload_device_fields(parsed_payload).items():
+            setattr(device_obj, field, value)
         
     except Exception as e:
         logging.error(f"Error updating device {device_obj.device_id} from payload: {str(e)}")
@@ -358,8 +506,7 @@ def update_device_status(app_instance, device_id, is_online=True):
                 db.session.commit()
                 
                 # Update cache
-                if device_id in device_cache:
-                    device_cache[device_id]['is_online'] = is_online
+                device_cache.update(device_id, is_online=is_online)
                     
                 logging.debug(f"Device {device_id} status updated to {'online' if is_online else 'offline'}")
                 return True
@@ -419,6 +566,7 @@ def create_device_type_config(app_instance, device_type, type_name, max_value, m
             # Save to database
             db.session.add(new_device_type_config)
             db.session.commit()
+            type_name_thresholds.set(device_type, type_name, min_value, max_value, lower_mid_limit, upper_mid_limit)
             logging.info(f"Device type config for {device_type} created successfully")
             
             return new_device_type_config
@@ -428,9 +576,28 @@ def create_device_type_config(app_instance, device_type, type_name, max_value, m
         db.session.rollback()
         raise
 
+def get_type_name_type_id(device_type, type_name):
+    """
+    Type id of (device_type, type_name) in type_name_thresholds, the config is loaded from the database
+    on first use. Keys without a config are remembered as missing, so they are not queried per reading.
+    Returns: the type id or -1 if there is no config
+    """
+    type_id = type_name_thresholds.type_id(device_type, type_name)
+    if type_id != -1 or type_name_thresholds.is_missing(device_type, type_name):
+        return type_id
+
+    device_type_config = models.TypeNameConfig.query.filter_by(device_type=device_type, type_name=type_name).first()
+    if not device_type_config:
+        type_name_thresholds.set_missing(device_type, type_name)
+        return -1
+    return type_name_thresholds.set(device_type, type_name, device_type_config.min_value, device_type_config.max_value,
+                                    device_type_config.lower_mid_limit, device_type_config.upper_mid_limit)
+
 def get_simplified_value(value: float, device_type: str, type_name: str) -> str:
     """
     Get simplified value from device type configuration.
+    The limits come from the in-process type_name_thresholds table, the database is
+    only queried the first time a (device_type, type_name) pair is seen (see get_type_name_type_id).
     Args:
         value (float): The value to simplify.
         device_type (str): The type of the device.
@@ -439,20 +606,25 @@ def get_simplified_value(value: float, device_type: str, type_name: str) -> str:
     """      
     try:
         value = float(value) 
-        device_type_config = models.TypeNameConfig.query.filter_by(device_type=device_type, type_name=type_name).first()
-        if not device_type_config:
-            logging.error(f"Device type config for {device_type} and {type_name} not found")
+        if get_type_name_type_id(device_type, type_name) == -1:
+            ingest_log.limited(logging.ERROR, ('missing_type_name', device_type, type_name),
+                               "Device type config for %s and %s not found", device_type, type_name)
+            raise
+        limits = type_name_thresholds.get(device_type, type_name)
+        min_value, max_value, lower_mid_limit, upper_mid_limit = limits
+        if math.isnan(lower_mid_limit) or math.isnan(upper_mid_limit):
+            logging.error(f"Mid limits for {device_type} and {type_name} not configured")
             raise
         
-        # Check if value is within the configured range
-        if value < device_type_config.min_value or value > device_type_config.max_value:
+        # Check if value is within the configured range (NaN marks a missing limit)
+        if not (min_value <= value <= max_value):
             logging.error(f"Value {value} out of range for device type {device_type}")
             raise
         
         # Simplify value based on mid limits
-        if value < device_type_config.lower_mid_limit:
+        if value < lower_mid_limit:
             return -1 # Maps to LOW
-        elif value > device_type_config.upper_mid_limit:
+        elif value > upper_mid_limit:
             return 1 # Maps to HIGH
         else:
             return 0 # Maps to MID 
@@ -460,12 +632,13 @@ def get_simplified_value(value: float, device_type: str, type_name: str) -> str:
         logging.error(f"Error simplifying value {value} for device type {device_type}: {str(e)}")
         raise
 
-def _handle_rfid_sensor(room, parsed_payload, latest_value):
+def _handle_rfid_sensor(room_id, parsed_payload, latest_value):
     """
     Handle RFID sensor behavior for room occupancy tracking.
+    The room row is only loaded for RFID sensors.
     
     Args:
-        room: Room object from database
+        room_id: Id of the room the sensor is in
         parsed_payload: Parsed MQTT payload containing sensor data
         latest_value: Latest RFID value read from sensor
     
@@ -481,6 +654,11 @@ def _handle_rfid_sensor(room, parsed_payload, latest_value):
     except (ValueError, TypeError):
         logging.warning(f"Invalid RFID value received: {latest_value}")
         return False
+
+    room = db.session.get(models.Room, room_id)
+    if not room:
+        logging.warning(f"Room {room_id} for RFID sensor not found")
+        return False
     
     # Initialize RFID access ID if not set
     if room.rfid_access_id is None and rfid_value is not None and rfid_value > 0.0:
@@ -519,6 +697,12 @@ def process_sensor_actuator_mapping(app_instance, floor_number, room_number, pay
         bool: True if successful, False otherwise
     """
     try:
+        # The gateway re-sends the mapping every cycle, unchanged payloads are not parsed or written again
+        fingerprint = mapping_payload_fingerprint(payload) if payload else None
+        if fingerprint and is_mapping_unchanged(floor_number, room_number, fingerprint):
+            logging.debug("Sensor-actuator mapping for floor %s, room %s unchanged, skipping", floor_number, room_number)
+            return True
+        
         logging.info(f"Processing sensor-actuator mapping for floor {floor_number}, room {room_number}")
         
         # Parse the mapping payload
@@ -531,6 +715,7 @@ def process_sensor_actuator_mapping(app_instance, floor_number, room_number, pay
         success = create_or_update_sensor_actuator_mappings(app_instance, parsed_mappings)
         
         if success:
+            remember_mapping_fingerprint(floor_number, room_number, fingerprint)
             logging.info(f"Successfully processed {len(parsed_mappings)} sensor-actuator mappings")
         else:
             logging.warning("Some errors occurred while processing mappings")
@@ -0,0 +1,165 @@
+import logging
+import threading
+import time
+
+LOG_MODE_SUMMARY = 'summary'
+LOG_MODE_PER_MESSAGE = 'per_message'
+LOG_MODE_OFF = 'off'
+LOG_MODES = (LOG_MODE_SUMMARY, LOG_MODE_PER_MESSAGE, LOG_MODE_OFF)
+
+# Per device event counters
+DEVICE_EVENTS = ('readings', 'actuator_updates', 'updates', 'invalid', 'failures')
+
+class IngestLog:
+    """
+    Sampled, rate-limited logging for the MQTT ingest path.
+
+    summary:     events are only counted, every summary_interval seconds one line with the
+                 totals and one line per active device are logged
+    per_message: every message and device event is logged at INFO
+    off:         no ingest info logging, rate-limited warnings and errors are still logged
+
+    All messages use %-style arguments, so they are only formatted when they are emitted.
+    """
+
+    def __init__(self, mode=LOG_MODE_SUMMARY, summary_interval=60.0, limit_interval=60.0):
+        self._lock = threading.Lock()
+        self.mode = LOG_MODE_SUMMARY
+        self.summary_interval = 60.0
+        self.limit_interval = 60.0
+        self.configure(mode, summary_interval, limit_interval)
+
+        self._messages = 0
+        self._devices = {}
+        self._last_summary = time.monotonic()
+        # key -> [last emitted (monotonic), suppressed count, (level, msg, args) of the last suppressed message]
+        self._limited = {}
+        self._last_expiry = time.monotonic()
+
+    def configure(self, mode=None, summary_interval=None, limit_interval=None):
+        """
+        Change the logging settings at runtime.
+        Raises: ValueError for an unknown mode or a non positive interval
+        Returns: dict: current settings
+        """
+        if mode is not None and mode not in LOG_MODES:
+            raise ValueError(f"Unknown MQTT log mode: {mode}, expected one of {', '.join(LOG_MODES)}")
+        for interval in (summary_interval, limit_interval):
+            if interval is not None and float(interval) <= 0:
+                raise ValueError(f"Log interval must be positive, got {interval}")
+
+        with self._lock:
+            if mode is not None:
+                self.mode = mode
+            if summary_interval is not None:
+                self.summary_interval = float(summary_interval)
+            if limit_interval is not None:
+                self.limit_interval = float(limit_interval)
+        return self.get_settings()
+
+    def get_settings(self):
+        return {
+            'mode': self.mode,
+            'modes': list(LOG_MODES),
+            'summary_interval_seconds': self.summary_interval,
+            'limit_interval_seconds': self.limit_interval,
+        }
+
+    def message_received(self, topic):
+        if self.mode == LOG_MODE_PER_MESSAGE:
+            logging.info("Message received on topic %s", topic)
+        with self._lock:
+            self._messages += 1
+
+    def device_event(self, device_id, event, value=None):
+        """Count a device event (one of DEVICE_EVENTS), value is the last value shown in the summary"""
+        if self.mode == LOG_MODE_PER_MESSAGE:
+            logging.info("Device %s: %s (value: %s)", device_id, event, value)
+        with self._lock:
+            counters = self._devices.get(device_id)
+            if counters is None:
+                counters = self._devices[device_id] = dict.fromkeys(DEVICE_EVENTS, 0)
+                counters['last_value'] = None
+            counters[event] += 1
+            if value is not None:
+                counters['last_value'] = value
+
+    def limited(self, level, key, msg, *args):
+        """
+        Log msg at most once per limit interval for the same key.
+        The number of suppressed repeats is appended to the next emitted message.
+        Keys (e.g. with topics) are dropped after their limit interval, so they do not pile up.
+        """
+        now = time.monotonic()
+        with self._lock:
+            expired = self._expire_limited(now)
+            state = self._limited.get(key)
+            if state is not None and now - state[0] < self.limit_interval:
+                state[1] += 1
+                state[2] = (level, msg, args)
+                suppressed = None
+            else:
+                suppressed = state[1] if state is not None else 0
+                self._limited[key] = [now, 0, None]
+
+        for (expired_level, expired_msg, expired_args), count in expired:
+            logging.log(expired_level, expired_msg + " (last of %d suppressed messages)", *expired_args, count)
+        if suppressed is None:
+            return
+        if suppressed:
+            logging.log(level, msg + " (%d similar messages suppressed)", *args, suppressed)
+        else:
+            logging.log(level, msg, *args)
+
+    def _expire_limited(self, now):
+        """
+        Drop the limited keys whose interval is over, at most once per limit interval. Requires the lock.
+        Returns: list of ((level, msg, args), suppressed count) of dropped keys with suppressed repeats
+        """
+        if now - self._last_expiry < self.limit_interval:
+            return []
+        self._last_expiry = now
+
+        expired = []
+        for key, state in list(self._limited.items()):
+            if now - state[0] >= self.limit_interval:
+                del self._limited[key]
+                if state[1]:
+                    expired.append((state[2], state[1]))
+        return expired
+
+    def maybe_emit_summary(self):
+        """Emit the summary if the summary interval is over, called by the ingest workers after every batch"""
+        if self.mode != LOG_MODE_SUMMARY:
+            return
+        if time.monotonic() - self._last_summary >= self.summary_interval:
+            self.emit_summary()
+
+    def emit_summary(self):
+        """Log the counters since the last summary and reset them"""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._last_summary
+            messages, devices = self._messages, self._devices
+            self._messages, self._devices = 0, {}
+            self._last_summary = now
+
+        if not messages and not devices:
+            return
+
+        totals = dict.fromkeys(DEVICE_EVENTS, 0)
+        for counters in devices.values():
+            for event in DEVICE_EVENTS:
+                totals[event] += counters[event]
+
+        logging.info("MQTT ingest summary interval=%.0fs messages=%d devices=%d readings=%d actuator_updates=%d "
+                     "updates=%d invalid=%d failures=%d", elapsed, messages, len(devices), totals['readings'],
+                     totals['actuator_updates'], totals['updates'], totals['invalid'], totals['failures'])
+        for device_id in sorted(devices):
+            counters = devices[device_id]
+            logging.info("MQTT device summary device=%s readings=%d actuator_updates=%d updates=%d invalid=%d "
+                         "failures=%d last_value=%s", device_id, counters['readings'], counters['actuator_updates'],
+                         counters['updates'], counters['invalid'], counters['failures'], counters['last_value'])
+
+
+ingest_log = IngestLog()
@@ -0,0 +1,209 @@
+import logging
+import threading
+import time
+import zlib
+from collections import deque
+
+FULL_POLICY_DROP_OLDEST = 'drop_oldest'
+FULL_POLICY_BLOCK = 'block'
+
+class IngestQueue:
+    """
+    Bounded in-memory queue between the paho network thread and the database.
+
+    on_message only enqueues (topic, payload) tuples. Worker threads drain the queue
+    in time/size bounded batches and hand every batch to handle_batch, so the
+    database sees one transaction per batch instead of one per message.
+    Messages are sharded by topic over the workers, so all messages of one device
+    are processed in order by the same worker.
+    """
+
+    def __init__(self, handle_batch, max_size=10000, max_batch_size=500, max_batch_wait=0.05,
+                 workers=1, full_policy=FULL_POLICY_DROP_OLDEST, block_timeout=1.0, name='mqtt-ingest'):
+        if full_policy not in (FULL_POLICY_DROP_OLDEST, FULL_POLICY_BLOCK):
+            raise ValueError(f"Unknown ingest queue full policy: {full_policy}")
+
+        self.handle_batch = handle_batch
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.max_size_per_shard = max(1, int(max_size) // self.workers)
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_batch_wait = max(0.0, float(max_batch_wait))
+        self.full_policy = full_policy
+        self.block_timeout = block_timeout
+
+        self._shards = [deque() for _ in range(self.workers)]
+        self._conditions = [threading.Condition() for _ in range(self.workers)]
+        self._threads = []
+        self._running = False
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'processed': 0,
+            'dropped': 0,
+            'rejected': 0,
+            'failed_batches': 0,
+            'batches': 0,
+            'last_batch_size': 0,
+            'max_batch_size_seen': 0,
+            'last_commit_latency_ms': 0.0,
+            'max_commit_latency_ms': 0.0,
+            'total_commit_latency_ms': 0.0,
+        }
+
+    def start(self):
+        """Start the worker threads"""
+        if self._running:
+            return
+        self._running = True
+        for shard_index in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, args=(shard_index,),
+                                      name=f"{self.name}-{shard_index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info(f"MQTT ingest queue {self.name} started with {self.workers} worker(s), "
+                     f"batch size {self.max_batch_size}, batch wait {self.max_batch_wait * 1000:.0f} ms")
+
+    def stop(self, timeout=5.0):
+        """Stop the worker threads after the queued messages have been processed"""
+        self._running = False
+        for condition in self._conditions:
+            with condition:
+                condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        logging.info("MQTT ingest queue stopped")
+
+    def put(self, topic, payload):
+        """
+        Enqueue a message. Never raises.
+        Returns: True if the message was queued, False if it was rejected
+        """
+        shard_index = zlib.crc32(topic.encode('utf-8')) % self.workers
+        shard = self._shards[shard_index]
+        condition = self._conditions[shard_index]
+        dropped = 0
+
+        with condition:
+            if len(shard) >= self.max_size_per_shard:
+                if self.full_policy == FULL_POLICY_BLOCK:
+                    # Backpressure: blocking the paho thread stops it from reading the socket
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(shard) >= self.max_size_per_shard and self._running:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        condition.wait(remaining)
+                    if len(shard) >= self.max_size_per_shard:
+                        self._add_stats(rejected=1)
+                        logging.warning(f"MQTT ingest queue full, message on {topic} rejected")
+                        return False
+                else:
+                    shard.popleft()
+                    dropped = 1
+            shard.append((topic, payload))
+            condition.notify()
+
+        self._add_stats(enqueued=1, dropped=dropped)
+        if dropped:
+            logging.warning("MQTT ingest queue full, dropped oldest message")
+        return True
+
+    def depth(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def get_stats(self):
+        """Return queue depth, batch size and commit latency counters"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        total_latency = stats.pop('total_commit_latency_ms')
+        stats['avg_batch_size'] = round(stats['processed'] / stats['batches'], 2) if stats['batches'] else 0.0
+        stats['avg_commit_latency_ms'] = round(total_latency / stats['batches'], 3) if stats['batches'] else 0.0
+        stats['queue_depth'] = self.depth()
+        stats['queue_depth_per_worker'] = [len(shard) for shard in self._shards]
+        stats['max_size'] = self.max_size_per_shard * self.workers
+        stats['workers'] = self.workers
+        stats['full_policy'] = self.full_policy
+        return stats
+
+    def _add_stats(self, **increments):
+        with self._stats_lock:
+            for key, value in increments.items():
+                self._stats[key] += value
+
+    def _take_batch(self, shard_index):
+        """Block until at least one message is available, then collect until the batch is full or the wait is over"""
+        shard = self._shards[shard_index]
+        condition = self._conditions[shard_index]
+        batch = []
+
+        with condition:
+            while not shard and self._running:
+                condition.wait(0.5)
+            if not shard:
+                return batch
+
+            deadline = time.monotonic() + self.max_batch_wait
+            while len(batch) < self.max_batch_size:
+                if shard:
+                    batch.append(shard.popleft())
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._running:
+                    break
+                condition.wait(remaining)
+            # Wake up producers waiting on backpressure
+            condition.notify_all()
+
+        return batch
+
+    def _worker_loop(self, shard_index):
+        shard = self._shards[shard_index]
+        while self._running or shard:
+            batch = self._take_batch(shard_index)
+            if not batch:
+                continue
+
+            start = time.perf_counter()
+            try:
+                self.handle_batch(batch)
+                failed = 0
+            except Exception as e:
+                logging.error(f"Error processing MQTT ingest batch of {len(batch)} messages: {str(e)}")
+                failed = 1
+            latency_ms = (time.perf_counter() - start) * 1000
+
+            with self._stats_lock:
+                self._stats['batches'] += 1
+                self._stats['processed'] += len(batch)
+                self._stats['failed_batches'] += failed
+                self._stats['last_batch_size'] = len(batch)
+                self._stats['max_batch_size_seen'] = max(self._stats['max_batch_size_seen'], len(batch))
+                self._stats['last_commit_latency_ms'] = round(latency_ms, 3)
+                self._stats['max_commit_latency_ms'] = max(self._stats['max_commit_latency_ms'], round(latency_ms, 3))
+                self._stats['total_commit_latency_ms'] += latency_ms
+
+
+def combine_ingest_stats(stats_list):
+    """
+    Combine the get_stats of several ingest queues (one per consumer) into one dict with the same keys,
+    counters are summed, maxima and averages taken over all queues.
+    Returns: combined stats, with the stats of every queue under 'queues'
+    """
+    if len(stats_list) == 1:
+        return stats_list[0]
+    combined = {key: sum(stats[key] for stats in stats_list)
+                for key in ('enqueued', 'processed', 'dropped', 'rejected', 'failed_batches', 'batches',
+                            'queue_depth', 'max_size', 'workers')}
+    for key in ('max_batch_size_seen', 'max_commit_latency_ms', 'last_batch_size', 'last_commit_latency_ms'):
+        combined[key] = max(stats[key] for stats in stats_list)
+    batches = combined['batches']
+    combined['avg_batch_size'] = round(combined['processed'] / batches, 2) if batches else 0.0
+    combined['avg_commit_latency_ms'] = round(sum(stats['avg_commit_latency_ms'] * stats['batches']
+                                                  for stats in stats_list) / batches, 3) if batches else 0.0
+    combined['queue_depth_per_worker'] = [depth for stats in stats_list for depth in stats['queue_depth_per_worker']]
+    combined['full_policy'] = stats_list[0]['full_policy']
+    combined['queues'] = stats_list
+    return combined
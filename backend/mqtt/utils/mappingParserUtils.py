@@ -1,11 +1,43 @@
 import logging
 import json
+import hashlib
+import threading
+import uuid
 from typing import Dict, List, Tuple
+from sqlalchemy import update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 import backend.models.models as models
 from backend.extensions import db
 
+# (floor_number, room_number) -> fingerprint of the last successfully stored mapping payload
+mapping_fingerprints = {}
+_mapping_fingerprints_lock = threading.Lock()
+
+def mapping_payload_fingerprint(payload):
+    """Hash of a raw mapping payload"""
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def is_mapping_unchanged(floor_number, room_number, fingerprint):
+    """True if the room's mapping payload was already stored with this fingerprint"""
+    with _mapping_fingerprints_lock:
+        return mapping_fingerprints.get((floor_number, room_number)) == fingerprint
+
+
+def remember_mapping_fingerprint(floor_number, room_number, fingerprint):
+    with _mapping_fingerprints_lock:
+        mapping_fingerprints[(floor_number, room_number)] = fingerprint
+
+
+def clear_mapping_fingerprints():
+    """Forget all mapping fingerprints, e.g. after the mappings were deleted"""
+    with _mapping_fingerprints_lock:
+        mapping_fingerprints.clear()
+
 # Todo: correct error logging for non existing devices
 def parse_mapping_payload(payload):
     """
@@ -97,9 +129,51 @@ def parse_mapping_payload(payload):
         return None
 
 
+_mappings_table = models.SensorActuatorMapping.__table__
+_devices_table = models.Device.__table__
+# Columns taken over from the payload when a mapping already exists
+_MAPPING_UPDATE_COLUMNS = ('impact_factor', 'actuator_can_increases_sensor', 'actuator_can_decreases_sensor',
+                           'only_physical', 'active_influences')
+
+def _mapping_upsert_statement(mappings):
+    """
+    Build a single INSERT ... ON DUPLICATE KEY UPDATE (MySQL/MariaDB) or INSERT ... ON CONFLICT DO UPDATE
+    (SQLite, PostgreSQL) for all mappings. Requires an app context.
+    Returns: the statement or None if the database has no upsert support
+    """
+    dialect_name = db.session.get_bind().dialect.name
+    now = datetime.utcnow()
+
+    # The unique key is (uuid_actuator, uuid_sensor), a later duplicate in the payload wins like before
+    rows = {}
+    for mapping in mappings:
+        row = {column: mapping[column] for column in _MAPPING_UPDATE_COLUMNS}
+        row.update(id=str(uuid.uuid4()), uuid_actuator=mapping['uuid_actuator'], uuid_sensor=mapping['uuid_sensor'],
+                   created_at=now, updated_at=None)
+        rows[(mapping['uuid_actuator'], mapping['uuid_sensor'])] = row
+    rows = list(rows.values())
+
+    if dialect_name in ('mysql', 'mariadb'):
+        statement = mysql.insert(_mappings_table).values(rows)
+        updates = {column: statement.inserted[column] for column in _MAPPING_UPDATE_COLUMNS}
+        updates['updated_at'] = now
+        return statement.on_duplicate_key_update(**updates)
+
+    if dialect_name in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect_name == 'sqlite' else postgresql.insert
+        statement = insert(_mappings_table).values(rows)
+        updates = {column: statement.excluded[column] for column in _MAPPING_UPDATE_COLUMNS}
+        updates['updated_at'] = now
+        return statement.on_conflict_do_update(index_elements=['uuid_actuator', 'uuid_sensor'], set_=updates)
+
+    return None
+
+
 def create_or_update_sensor_actuator_mappings(app, mappings):
     """
-    Create or update sensor-actuator mappings in the database with proper race condition handling.
+    Create or update sensor-actuator mappings in the database.
+    All mappings are written with one upsert statement, databases without upsert support
+    fall back to one transaction per mapping.
     
     Args:
         app: Flask application instance
@@ -108,6 +182,33 @@ def create_or_update_sensor_actuator_mappings(app, mappings):
     Returns:
         bool: True if successful, False otherwise
     """
+    try:
+        with app.app_context():
+            statement = _mapping_upsert_statement(mappings)
+            if statement is None:
+                return _create_or_update_mappings_one_by_one(app, mappings)
+
+            db.session.execute(statement)
+            db.session.commit()
+
+            # Try to link any mappings that now have corresponding devices
+            linked_count = link_mappings_to_devices(app)
+
+            logging.info(f"Mapping operation completed: {len(mappings)} upserted, {linked_count} links to devices")
+
+            return True
+
+    except Exception as e:
+        logging.error(f"Error creating/updating sensor-actuator mappings: {str(e)}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+        return False
+
+
+def _create_or_update_mappings_one_by_one(app, mappings):
+    """Create or update the mappings with one transaction per mapping and race condition handling"""
     try:
         with app.app_context():
             created_count = 0
@@ -253,49 +354,33 @@ def _update_mapping_from_data(existing_mapping, mapping):
 def link_mappings_to_devices(app) -> int:
     """
     Link existing mappings to devices that have been created.
+    Runs one UPDATE joined with devices for the actuator side and one for the sensor side.
     
     Args:
         app: Flask application instance
         
     Returns:
-        int: Number of mappings successfully linked
+        int: Number of device links that were set
     """
     try:
         with app.app_context():
-            # Get all mappings that don't have device links yet
-            unlinked_mappings = models.SensorActuatorMapping.query.filter(
-                (models.SensorActuatorMapping.actuator_device_id.is_(None)) |
-                (models.SensorActuatorMapping.sensor_device_id.is_(None))
-            ).all()
-            
             linked_count = 0
+            now = datetime.utcnow()
             
-            for mapping in unlinked_mappings:
-                updated = False
-                
-                # Try to link actuator device
-                if mapping.actuator_device_id is None:
-                    actuator_device = models.Device.query.filter_by(device_id=mapping.uuid_actuator).first()
-                    if actuator_device:
-                        mapping.actuator_device_id = actuator_device.id
-                        updated = True
-                        logging.debug(f"Linked actuator {mapping.uuid_actuator} to mapping")
-                
-                # Try to link sensor device
-                if mapping.sensor_device_id is None:
-                    sensor_device = models.Device.query.filter_by(device_id=mapping.uuid_sensor).first()
-                    if sensor_device:
-                        mapping.sensor_device_id = sensor_device.id
-                        updated = True
-                        logging.debug(f"Linked sensor {mapping.uuid_sensor} to mapping")
-                
-                if updated:
-                    mapping.updated_at = datetime.utcnow()
-                    linked_count += 1
+            for device_id_column, uuid_column in ((_mappings_table.c.actuator_device_id, _mappings_table.c.uuid_actuator),
+                                                  (_mappings_table.c.sensor_device_id, _mappings_table.c.uuid_sensor)):
+                # MySQL/MariaDB render this as a multi-table UPDATE, SQLite/PostgreSQL as UPDATE ... FROM
+                statement = update(_mappings_table).where(
+                    device_id_column.is_(None),
+                    uuid_column == _devices_table.c.device_id
+                ).values({device_id_column: _devices_table.c.id, _mappings_table.c.updated_at: now})
+                linked_count += db.session.execute(statement).rowcount
             
             if linked_count > 0:
                 db.session.commit()
-                logging.info(f"Successfully linked {linked_count} mappings to devices")
+                logging.info(f"Successfully linked {linked_count} mapping ends to devices")
+            else:
+                db.session.rollback()
             
             return linked_count
             
@@ -366,22 +451,37 @@ def _get_matrices(room_number=None):
             models.SensorActuatorMapping.sensor_device_id.isnot(None)
         ).all()
     
+    return build_actuator_sensor_matrices(
+        (mapping.uuid_actuator, mapping.uuid_sensor, mapping.actuator_can_increases_sensor,
+         mapping.actuator_can_decreases_sensor)
+        for mapping in mappings
+    )
+
+
+def build_actuator_sensor_matrices(rows) -> Tuple[Dict[str, List[str]], Dict[str, List[str]]]:
+    """
+    Build the actuator-sensor mapping matrices from mapping rows.
+
+    Args:
+        rows: Iterable of (uuid_actuator, uuid_sensor, actuator_can_increases_sensor, actuator_can_decreases_sensor)
+
+    Returns:
+        - actuator_increases_sensor_mapping_matrix: {'a1': ['s1', 's2'], 'a2': ['s2']}
+        - actuator_decreases_sensor_mapping_matrix: {'a1': ['s1']}
+    """
     increases_matrix = {}
     decreases_matrix = {}
     
-    for mapping in mappings:
-        actuator_uuid = mapping.uuid_actuator
-        sensor_uuid = mapping.uuid_sensor
-        
+    for actuator_uuid, sensor_uuid, can_increase, can_decrease in rows:
         # Build increases matrix
-        if mapping.actuator_can_increases_sensor:
+        if can_increase:
             if actuator_uuid not in increases_matrix:
                 increases_matrix[actuator_uuid] = []
             if sensor_uuid not in increases_matrix[actuator_uuid]:
                 increases_matrix[actuator_uuid].append(sensor_uuid)
         
         # Build decreases matrix
-        if mapping.actuator_can_decreases_sensor:
+        if can_decrease:
             if actuator_uuid not in decreases_matrix:
                 decreases_matrix[actuator_uuid] = []
             if sensor_uuid not in decreases_matrix[actuator_uuid]:
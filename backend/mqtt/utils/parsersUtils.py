@@ -1,7 +1,29 @@
 import logging
 import json
+import hashlib
+import threading
 from backend.extensions import db
-from backend.models.models import Device, SensorActuatorMapping, SensorData
+from backend.models.models import Device, SensorActuatorMapping
+from backend.models.timeseries import get_timeseries_store
+from backend.mqtt.utils.cacheInvalidationUtils import broadcast_cache_invalidation, INVALIDATE_ALL_DEVICES
+from backend.mqtt.utils.ingestLogUtils import ingest_log
+
+# orjson or msgspec decode device payloads faster if installed, json is the fallback
+try:
+    import orjson
+    json_loads = orjson.loads
+    JSON_DECODE_ERRORS = (orjson.JSONDecodeError,)
+    JSON_BACKEND = 'orjson'
+except ImportError:
+    try:
+        import msgspec
+        json_loads = msgspec.json.decode
+        JSON_DECODE_ERRORS = (msgspec.DecodeError,)
+        JSON_BACKEND = 'msgspec'
+    except ImportError:
+        json_loads = json.loads
+        JSON_DECODE_ERRORS = (json.JSONDecodeError,)
+        JSON_BACKEND = 'json'
 
 def parse_mqtt_topic(topic, app_instance):
     """
@@ -32,13 +54,16 @@ def parse_mqtt_topic(topic, app_instance):
                     logging.info(f"Deleted {mapping_count} sensor actuator mappings")
                     
                     # 2. Delete sensor data (should cascade from devices, but explicit deletion is safer)
-                    sensor_data_count = db.session.query(SensorData).delete()
+                    sensor_data_count = get_timeseries_store().clear()
                     logging.info(f"Deleted {sensor_data_count} sensor data records")
 
                     deleted_count = db.session.query(Device).delete()
                     db.session.commit()
                     logging.info(f"Successfully deleted {deleted_count} devices from database")
 
+                # Only the consumer of the floor receives the delete, the other processes invalidate over the broker
+                broadcast_cache_invalidation(app_instance, INVALIDATE_ALL_DEVICES)
+
                 return None
             except Exception as e:
                 with app_instance.app_context():
@@ -46,10 +71,10 @@ def parse_mqtt_topic(topic, app_instance):
                 logging.error(f"Error deleting devices from database: {str(e)}")
                 return None
         if len(parts) == 6 and parts[0] == expected_prefix and parts[5] == "UPDATE":
-            logging.info(f"Detected message publish for request to gateway, skipping message")
+            ingest_log.limited(logging.INFO, 'gateway_request', "Detected message publish for request to gateway, skipping message")
             return None
         if len(parts) != 6 or parts[0] != expected_prefix and parts[5] != "all":
-            logging.warning(f"Invalid topic format: {topic}")
+            ingest_log.limited(logging.WARNING, ('invalid_topic', topic), "Invalid topic format: %s", topic)
             return None
         
         _, floor_str, room_number, device_type, device_id, _ = parts
@@ -141,6 +166,77 @@ def safe_float_conversion_for_sensor_data(value):
     except (ValueError, TypeError):
         return None
 
+def _keep(value):
+    return value
+
+def _to_str(value):
+    return str(value) if value is not None else None
+
+def _to_int(value):
+    return int(value) if value is not None else None
+
+def _to_bool(value):
+    return bool(value) if value is not None else None
+
+# Field specs per device type: (parsed key, payload key, converter)
+# Converters return None for missing values, None values are not added to the parsed data
+_COMMON_FIELD_SPEC = (
+    ('name', 'name', _keep),
+    ('type_name', 'type_name', _keep),
+    ('connector', 'connector', _keep),
+    ('connector_type', 'connector_type', _to_str),
+    ('min_value', 'min', safe_float_conversion),
+    ('max_value', 'max', safe_float_conversion),
+    ('datatype', 'datatype', _keep),
+    ('unit', 'unit', _keep),
+    ('ai_planing_type', 'ai_planing_type', safe_str_conversion),
+)
+
+# Static device metadata, only changes when the gateway reconfigures a device
+PAYLOAD_FIELD_SPECS = {
+    'sensor': _COMMON_FIELD_SPEC + (
+        ('read_interval', 'read_interval', _to_int),
+        ('notify_interval', 'notify_interval', _to_str),
+        ('notify_change_precision', 'notify_change_precision', safe_float_conversion),
+    ),
+    'actuator': _COMMON_FIELD_SPEC + (
+        ('initial_value', 'initial_value', safe_str_conversion),
+        ('off_value', 'off_value', safe_str_conversion),
+        ('impact_step_size', 'impact_step_size', safe_float_conversion),
+    ),
+}
+
+# Device state, changes with every message
+PAYLOAD_STATE_FIELD_SPECS = {
+    'sensor': (
+        ('last_value', 'last_value', safe_str_conversion),
+    ),
+    'actuator': (
+        ('last_value', 'last_value', safe_str_conversion),
+        ('is_off', 'is_off', _to_bool),
+    ),
+}
+_DEFAULT_STATE_FIELD_SPEC = PAYLOAD_STATE_FIELD_SPECS['sensor']
+
+def _decode_fields(data, field_spec, parsed_data):
+    for key, payload_key, converter in field_spec:
+        value = converter(data.get(payload_key))
+        if value is not None:
+            parsed_data[key] = value
+
+def _load_payload_object(payload):
+    """Decode the JSON payload, returns the JSON object or None"""
+    try:
+        data = json_loads(payload)
+    except JSON_DECODE_ERRORS as e:
+        ingest_log.limited(logging.ERROR, 'invalid_json', "Invalid JSON payload: %s", e)
+        return None
+
+    if not isinstance(data, dict):
+        ingest_log.limited(logging.ERROR, 'payload_not_object', "Payload is not a JSON object")
+        return None
+    return data
+
 def parse_device_payload(payload, device_type):
     """
     Parse device payload JSON and extract relevant fields for sensors or actuators
@@ -190,55 +286,111 @@ def parse_device_payload(payload, device_type):
         if not payload:
             return None
             
-        # Parse JSON payload
-        try:
-            data = json.loads(payload)
-        except json.JSONDecodeError as e:
-            logging.error(f"Invalid JSON payload: {str(e)}")
+        data = _load_payload_object(payload)
+        if data is None:
             return None
         
-        if not isinstance(data, dict):
-            logging.error("Payload is not a JSON object")
-            return None
-        
-        # Extract common fields
-        parsed_data = {
-            'name': data.get('name'),
-            'type_name': data.get('type_name'),
-            'connector': data.get('connector'),
-            'connector_type': str(data.get('connector_type')) if data.get('connector_type') is not None else None,
-            'min_value': safe_float_conversion(data.get('min')),
-            'max_value': safe_float_conversion(data.get('max')),
-            'datatype': data.get('datatype'),
-            'unit': data.get('unit'),
-            'ai_planing_type': safe_str_conversion(data.get('ai_planing_type')),
-            'last_value': safe_str_conversion(data.get('last_value')),
-        }
-        
-        # Extract device-specific fields
-        if device_type == 'sensor':
-            parsed_data.update({
-                'read_interval': int(data.get('read_interval')) if data.get('read_interval') is not None else None,
-                'notify_interval': str(data.get('notify_interval')) if data.get('notify_interval') is not None else None,
-                'notify_change_precision': safe_float_conversion(data.get('notify_change_precision')),
-            })
-        elif device_type == 'actuator':
-            parsed_data.update({
-                'initial_value': safe_str_conversion(data.get('initial_value')),
-                'off_value': safe_str_conversion(data.get('off_value')),
-                'is_off': bool(data.get('is_off')) if data.get('is_off') is not None else None,
-                'impact_step_size': safe_float_conversion(data.get('impact_step_size')),
-            })
-        
-        # Remove None values to avoid overwriting existing data with None
-        parsed_data = {k: v for k, v in parsed_data.items() if v is not None}
-        
-        logging.debug(f"Successfully parsed {device_type} payload with {len(parsed_data)} fields")
+        # None values are skipped to avoid overwriting existing data with None
+        parsed_data = {}
+        _decode_fields(data, PAYLOAD_FIELD_SPECS.get(device_type, _COMMON_FIELD_SPEC), parsed_data)
+        _decode_fields(data, PAYLOAD_STATE_FIELD_SPECS.get(device_type, _DEFAULT_STATE_FIELD_SPEC), parsed_data)
         return parsed_data
         
     except Exception as e:
         logging.error(f"Error parsing device payload: {str(e)}")
         return None
+
+
+class DevicePayloadDecoder:
+    """
+    Parses and validates device payloads, remembering the static metadata per device.
+
+    Gateways send the full device description with every reading. If everything except
+    the state fields (last_value, is_off) is equal to the last valid payload of the device,
+    the cached parsed metadata is reused and only the state fields are converted.
+    Validation only depends on the metadata, so it is skipped as well.
+    """
+
+    def __init__(self):
+        # device_id -> (device_type, raw metadata of the payload, parsed metadata, metadata fingerprint)
+        self._known = {}
+        self._stats_lock = threading.Lock()
+        self._stats = {'fast_path': 0, 'full_parse': 0, 'invalid': 0}
+
+    def decode(self, device_id, payload, device_type):
+        """
+        Parse and validate a device payload.
+        Returns: dict: Parsed device data or None if the payload is missing, unparsable or invalid
+        """
+        if not payload:
+            return None
+
+        try:
+            data = _load_payload_object(payload)
+            if data is None:
+                self._add_stats('invalid')
+                return None
+
+            state_spec = PAYLOAD_STATE_FIELD_SPECS.get(device_type, _DEFAULT_STATE_FIELD_SPEC)
+            state = {payload_key: data.pop(payload_key, None) for _, payload_key, _ in state_spec}
+
+            known = self._known.get(device_id)
+            if known is not None and known[0] == device_type and known[1] == data:
+                parsed_data = dict(known[2])
+                _decode_fields(state, state_spec, parsed_data)
+                self._add_stats('fast_path')
+                return parsed_data
+
+            metadata = {}
+            _decode_fields(data, PAYLOAD_FIELD_SPECS.get(device_type, _COMMON_FIELD_SPEC), metadata)
+            parsed_data = dict(metadata)
+            _decode_fields(state, state_spec, parsed_data)
+
+            if not validate_device_data(parsed_data, device_type):
+                self._known.pop(device_id, None)
+                self._add_stats('invalid')
+                return None
+
+            self._known[device_id] = (device_type, data, metadata, metadata_fingerprint(metadata))
+            self._add_stats('full_parse')
+            return parsed_data
+
+        except Exception as e:
+            logging.error(f"Error parsing device payload of {device_id}: {str(e)}")
+            self._add_stats('invalid')
+            return None
+
+    def get_metadata_fingerprint(self, device_id):
+        """Fingerprint of the static metadata of the last valid payload of the device, None if unknown"""
+        known = self._known.get(device_id)
+        return known[3] if known is not None else None
+
+    def forget(self, device_id):
+        self._known.pop(device_id, None)
+
+    def clear(self):
+        self._known.clear()
+
+    def _add_stats(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        decoded = stats['fast_path'] + stats['full_parse']
+        stats['fast_path_rate'] = round(stats['fast_path'] / decoded, 4) if decoded else 0.0
+        stats['known_devices'] = len(self._known)
+        stats['json_backend'] = JSON_BACKEND
+        return stats
+
+
+def metadata_fingerprint(metadata):
+    """Hash of parsed device metadata, independent of the key order of the payload"""
+    return hashlib.blake2b(repr(sorted(metadata.items())).encode('utf-8'), digest_size=16).hexdigest()
+
+
+device_payload_decoder = DevicePayloadDecoder()
     
 def validate_device_data(data, device_type):
     """
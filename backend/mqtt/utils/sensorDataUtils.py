@@ -0,0 +1,66 @@
+import logging
+from datetime import datetime
+from backend.extensions import db
+from backend.models.timeseries import get_timeseries_store
+
+def build_sensor_data_row(device_pk, value, simplified_value, timestamp=None):
+    """
+    Build a sensor data row tuple for bulk_insert_sensor_data.
+
+    Args:
+        device_pk: Primary key of the device (devices.id, not the gateway device_id)
+        value: Sensor reading
+        simplified_value: -1, 0 or 1
+        timestamp: Time of the reading, defaults to now
+
+    Returns:
+        tuple: (device_pk, value, simplified_value, timestamp)
+    """
+    return (device_pk, value, simplified_value, timestamp or datetime.utcnow())
+
+
+def bulk_insert_sensor_data(rows):
+    """
+    Write sensor data rows to the TimeSeriesStore of SENSOR_DATA_STORE in one batch.
+    The database store joins the current session transaction (the caller is responsible for the commit),
+    the embedded store commits the rows itself. Writers of device state use commit_with_sensor_data.
+
+    Args:
+        rows: Iterable of (device_pk, value, simplified_value, timestamp) tuples
+
+    Returns:
+        int: Number of inserted rows
+    """
+    count = get_timeseries_store().write_batch(rows)
+    if count:
+        logging.debug(f"Bulk inserted {count} sensor data rows")
+    return count
+
+
+def commit_with_sensor_data(rows):
+    """
+    Commit the session together with sensor data rows.
+    The database store writes the rows in the session transaction, so both commit or roll back together.
+    The embedded store commits on a connection of its own, its rows are only written after the session
+    commit succeeded. A failed session commit, retried by the caller, or a device insert rolled back after
+    an IntegrityError then never leaves readings behind. A failed write after the commit is logged and
+    the readings are dropped, the committed device state is not processed again.
+
+    Args:
+        rows: List of (device_pk, value, simplified_value, timestamp) tuples
+
+    Returns:
+        int: Number of inserted rows
+    """
+    store = get_timeseries_store()
+    if store.uses_app_database:
+        count = bulk_insert_sensor_data(rows)
+        db.session.commit()
+        return count
+
+    db.session.commit()
+    try:
+        return bulk_insert_sensor_data(rows)
+    except Exception as e:
+        logging.error(f"Failed to write {len(rows)} sensor data rows to the {store.name} store: {str(e)}")
+        return 0
@@ -1,4 +1,8 @@
 import logging
+import threading
+import numpy as np
+from backend.extensions import db
+from backend.models import models
 
 def get_simple_default_middle_values(max_value: float, min_value: float) -> tuple[float, float]:
     """
@@ -21,4 +25,155 @@ def get_simple_default_middle_values(max_value: float, min_value: float) -> tupl
     upper_mid_limit = max_value - (max_value - min_value) / 3
     
     return lower_mid_limit, upper_mid_limit
- 
\ No newline at end of file
+ 
+
+class TypeNameThresholds:
+    """
+    In-process table of TypeNameConfig limits keyed by (device_type, type_name).
+
+    Every key gets a stable integer type id, so batches of readings can be simplified
+    with simplify_values on NumPy arrays without any database lookup. Ids stay valid
+    across refreshes, new keys are appended. Keys without a TypeNameConfig are remembered
+    as missing until they are set or the table is refreshed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._type_ids = {}
+        # Indexed by type id, NaN for unknown limits
+        self._min_values = np.empty(0)
+        self._max_values = np.empty(0)
+        self._lower_mid_limits = np.empty(0)
+        self._upper_mid_limits = np.empty(0)
+        self._missing = set()
+        self.loaded = False
+
+    def refresh(self):
+        """Reload all limits from the database. Requires an app context."""
+        configs = db.session.query(
+            models.TypeNameConfig.device_type,
+            models.TypeNameConfig.type_name,
+            models.TypeNameConfig.min_value,
+            models.TypeNameConfig.max_value,
+            models.TypeNameConfig.lower_mid_limit,
+            models.TypeNameConfig.upper_mid_limit,
+        ).all()
+        with self._lock:
+            for config in configs:
+                self._set(*config)
+            self._missing.clear()
+            self.loaded = True
+        logging.info(f"Type name thresholds loaded for {len(configs)} type name configs")
+
+    def clear(self):
+        with self._lock:
+            self._type_ids = {}
+            self._min_values = np.empty(0)
+            self._max_values = np.empty(0)
+            self._lower_mid_limits = np.empty(0)
+            self._upper_mid_limits = np.empty(0)
+            self._missing = set()
+            self.loaded = False
+
+    def set(self, device_type, type_name, min_value, max_value, lower_mid_limit, upper_mid_limit):
+        """Add or update the limits of one type name config"""
+        with self._lock:
+            return self._set(device_type, type_name, min_value, max_value, lower_mid_limit, upper_mid_limit)
+
+    def _set(self, device_type, type_name, min_value, max_value, lower_mid_limit, upper_mid_limit):
+        key = (device_type, type_name)
+        self._missing.discard(key)
+        type_id = self._type_ids.get(key)
+        if type_id is None:
+            type_id = len(self._type_ids)
+            self._type_ids[key] = type_id
+            # Arrays are replaced, never resized in place, so readers can keep using a snapshot
+            self._min_values = np.append(self._min_values, np.nan)
+            self._max_values = np.append(self._max_values, np.nan)
+            self._lower_mid_limits = np.append(self._lower_mid_limits, np.nan)
+            self._upper_mid_limits = np.append(self._upper_mid_limits, np.nan)
+        else:
+            self._min_values = self._min_values.copy()
+            self._max_values = self._max_values.copy()
+            self._lower_mid_limits = self._lower_mid_limits.copy()
+            self._upper_mid_limits = self._upper_mid_limits.copy()
+
+        self._min_values[type_id] = _to_float(min_value)
+        self._max_values[type_id] = _to_float(max_value)
+        self._lower_mid_limits[type_id] = _to_float(lower_mid_limit)
+        self._upper_mid_limits[type_id] = _to_float(upper_mid_limit)
+        return type_id
+
+    def set_missing(self, device_type, type_name):
+        """Remember that (device_type, type_name) has no TypeNameConfig"""
+        with self._lock:
+            if (device_type, type_name) not in self._type_ids:
+                self._missing.add((device_type, type_name))
+
+    def is_missing(self, device_type, type_name):
+        """True if (device_type, type_name) was looked up in the database without a result"""
+        with self._lock:
+            return (device_type, type_name) in self._missing
+
+    def type_id(self, device_type, type_name):
+        """Return the type id of (device_type, type_name) or -1 if it is unknown"""
+        with self._lock:
+            return self._type_ids.get((device_type, type_name), -1)
+
+    def get(self, device_type, type_name):
+        """
+        Returns: (min_value, max_value, lower_mid_limit, upper_mid_limit) or None if unknown
+        """
+        with self._lock:
+            type_id = self._type_ids.get((device_type, type_name))
+            if type_id is None:
+                return None
+            return (self._min_values[type_id], self._max_values[type_id],
+                    self._lower_mid_limits[type_id], self._upper_mid_limits[type_id])
+
+    def simplify_values(self, values, type_ids):
+        """
+        Map readings to their simplified value in one vectorized pass.
+
+        Args:
+            values: Array like of float readings
+            type_ids: Array like of type ids (see type_id), same length as values
+
+        Returns:
+            tuple: (simplified values as int8 array with -1 LOW, 0 MID, 1 HIGH,
+                    bool array that is False for unknown types, missing limits and out of range values)
+        """
+        values = np.asarray(values, dtype=float)
+        type_ids = np.asarray(type_ids, dtype=np.intp)
+        with self._lock:
+            min_values = self._min_values
+            max_values = self._max_values
+            lower_mid_limits = self._lower_mid_limits
+            upper_mid_limits = self._upper_mid_limits
+
+        simplified = np.zeros(values.shape, dtype=np.int8)
+        if len(min_values) == 0:
+            return simplified, np.zeros(values.shape, dtype=bool)
+
+        known = (type_ids >= 0) & (type_ids < len(min_values))
+        safe_ids = np.where(known, type_ids, 0)
+        lower = lower_mid_limits[safe_ids]
+        upper = upper_mid_limits[safe_ids]
+
+        # Comparisons with NaN are False, so missing limits and NaN readings end up invalid
+        with np.errstate(invalid='ignore'):
+            valid = (known
+                     & (values >= min_values[safe_ids])
+                     & (values <= max_values[safe_ids])
+                     & ~np.isnan(lower) & ~np.isnan(upper))
+            simplified[values < lower] = -1
+            simplified[values > upper] = 1
+        simplified[~valid] = 0
+        return simplified, valid
+
+
+def _to_float(value):
+    return np.nan if value is None else float(value)
+
+
+type_name_thresholds = TypeNameThresholds()
@@ -1,11 +1,22 @@
-from flask import Blueprint, jsonify, request
-from backend.aiplaning.utils.dbUtils import get_sensor_types
+from flask import Blueprint, jsonify, request, Response, stream_with_context, current_app
+from backend.aiplaning.utils.planningSnapshot import load_planning_snapshot
 from backend.extensions import db
 from backend.models import models
 from sqlalchemy.exc import IntegrityError
 from backend.routes.auth.simple_auth import require_api_key
 from backend.mqtt.utils.mqttPublish import request_actuator_update, request_current_sensor_value, request_sensor_update
 from backend.mqtt.utils.mappingParserUtils import get_actuator_sensor_matrices, get_mapping_impact_factors
+from backend.mqtt.mqtt_client import get_ingest_stats, consumes_floor
+from backend.mqtt.utils.cacheUtils import invalidate_room_cache, get_room_cache_stats, device_cache, \
+    get_cached_room_id, initialize_device_cache, device_entry_to_dict, refresh_room_from_database
+from backend.mqtt.utils.cacheInvalidationUtils import broadcast_cache_invalidation, INVALIDATE_DEVICES, INVALIDATE_OFFLINE, \
+    INVALIDATE_TYPE_NAMES, INVALIDATE_DATABASE
+from backend.mqtt.utils.parsersUtils import device_payload_decoder
+from backend.mqtt.utils.ingestLogUtils import ingest_log
+from backend.routes.utils.sensorDataQueryUtils import parse_downsample_options, query_sensor_series
+from backend.routes.utils.exportUtils import parse_export_filters, stream_export, EXPORT_MIMETYPES, EXPORT_ARROW
+from backend.models.pool import get_pool_stats
+from backend.models.timeseries import get_timeseries_store
 from datetime import datetime, timedelta
 from sqlalchemy import and_
 import logging
@@ -16,6 +27,72 @@ api = Blueprint('api', __name__)
 def health_check():
     return {'status': 'healthy'}, 200
 
+@api.route('/mqtt/stats', methods=['GET'])
+@require_api_key
+def mqtt_stats():
+    """Get MQTT ingest metrics (queue depth, batch size, commit latency)"""
+    try:
+        ingest_stats = get_ingest_stats()
+        if ingest_stats is None:
+            return jsonify({'error': 'MQTT ingest queue is not running'}), 503
+
+        return jsonify({
+            'ingest': ingest_stats,
+            'room_cache': get_room_cache_stats(),
+            'device_cache': device_cache.get_stats(),
+            'payload_decoder': device_payload_decoder.get_stats()
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/db/pool/stats', methods=['GET'])
+@require_api_key
+def db_pool_stats():
+    """Get the connection pool metrics (checked out, overflow, checkout wait time, checkouts per consumer)"""
+    try:
+        return jsonify(get_pool_stats(db.engine)), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/mqtt/logging', methods=['GET'])
+@require_api_key
+def get_mqtt_logging():
+    """Get the MQTT ingest logging settings"""
+    return jsonify(ingest_log.get_settings()), 200
+
+@api.route('/mqtt/logging', methods=['POST'])
+@require_api_key
+def set_mqtt_logging():
+    """
+    Change the MQTT ingest logging at runtime.
+
+    Expected JSON format (all fields optional):
+    {
+        "mode": "summary",  // summary, per_message or off
+        "summary_interval_seconds": 60,
+        "limit_interval_seconds": 60
+    }
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'Invalid JSON data'}), 400
+
+        settings = ingest_log.configure(
+            mode=data.get('mode'),
+            summary_interval=data.get('summary_interval_seconds'),
+            limit_interval=data.get('limit_interval_seconds'),
+        )
+        logging.info(f"MQTT ingest logging changed to {settings['mode']}")
+
+        return jsonify(settings), 200
+
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Create floor with rooms (optional)
 @api.route('/floors/create', methods=['POST'])
 @require_api_key
@@ -70,6 +147,7 @@ def create_floor_with_rooms():
 
         db.session.add(floor)
         db.session.commit()
+        invalidate_room_cache()
 
         return jsonify({
             'message': 'Floor created successfully',
@@ -142,6 +220,7 @@ def create_rooms_for_floor(floor_number):
             })
 
         db.session.commit()
+        invalidate_room_cache()
 
         return jsonify({
             'message': f'{len(created_rooms)} rooms created successfully for floor {floor_number}',
@@ -438,6 +517,60 @@ def list_devices_in_room(floor_number, room_number):
    except Exception as e:
        return jsonify({'error': str(e)}), 500
 
+@api.route('/floors/<int:floor_number>/rooms/<string:room_number>/state', methods=['GET'])
+@require_api_key
+def get_room_state(floor_number, room_number):
+    """
+    Current state of all devices in a room from the in-memory device cache, without database queries
+    Path: /floors/{floor_number}/rooms/{room_number}/state
+    Query: since (optional) - version of an earlier response, only devices changed after it are returned
+
+    The ETag is the room version: with If-None-Match the response is 304 Not Modified while nothing
+    in the room changed. Without since, or if since is unknown (e.g. after a restart), the response
+    has full true and all devices.
+    With MQTT_PARTITION_COUNT > 1 the rooms of floors consumed by another process are reloaded from the
+    database on every request, their states lag behind by up to DEVICE_CACHE_FLUSH_SECONDS.
+    Returns: floor_number, room_number, version, full, devices (list like the room device list),
+             removed (device_ids removed from the room since the version)
+    """
+    try:
+        since = request.args.get('since', type=int)
+        app_instance = current_app._get_current_object()
+        room_id = get_cached_room_id(app_instance, floor_number, room_number)
+        if room_id is None:
+            return jsonify({'error': f'Room {room_number} does not exist on floor {floor_number}'}), 404
+        # Normally loaded when the MQTT client connects
+        if not device_cache.loaded:
+            initialize_device_cache(app_instance)
+        # Only the consumer of the floor updates its cache, the other processes write their states to the database
+        if not consumes_floor(app_instance.config, floor_number):
+            refresh_room_from_database(app_instance, room_id)
+
+        etag = f'"{device_cache.room_version(room_id)}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=304, headers={'ETag': etag})
+
+        changes = device_cache.room_changes(room_id, since) if since is not None else None
+        if changes is None:
+            version, entries = device_cache.room_snapshot(room_id)
+            removed = []
+        else:
+            version, entries, removed = changes
+
+        response = jsonify({
+            'floor_number': floor_number,
+            'room_number': room_number,
+            'version': version,
+            'full': changes is None,
+            'devices': [device_entry_to_dict(entry) for entry in entries],
+            'removed': removed
+        })
+        response.headers['ETag'] = f'"{version}"'
+        return response, 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @api.route('/floors/<int:floor_number>/rooms/<string:room_number>/devices/<string:device_id>', methods=['GET'])
 @require_api_key
 def get_device_details(floor_number, room_number, device_id):
@@ -661,6 +794,7 @@ def set_type_name_configs():
         config.lower_mid_limit = lower_mid_limit
         config.upper_mid_limit = upper_mid_limit
         db.session.commit()
+        broadcast_cache_invalidation(current_app, INVALIDATE_TYPE_NAMES)
 
         return jsonify({'message': 'Config updated successfully'}), 200
 
@@ -689,7 +823,7 @@ def get_mapping_matrices():
 @api.route('/query/test', methods=['GET'])
 def list_floor_uids():
     try:
-        floor_ids = get_sensor_types()
+        floor_ids = dict(load_planning_snapshot().sensor_types)
         import logging
         logging.info(f"Info: {floor_ids}")
         return jsonify(floor_ids), 200
@@ -711,6 +845,7 @@ def set_device_offline(device_id):
 
         device.is_online = False
         db.session.commit()
+        broadcast_cache_invalidation(current_app, INVALIDATE_OFFLINE, [device_id])
 
         return jsonify({
             'message': f'Device {device_id} set to offline successfully',
@@ -734,8 +869,11 @@ def delete_device(device_id):
         if not device:
             return jsonify({'error': f'Device {device_id} does not exist'}), 404
 
+        device_pk = device.id
         db.session.delete(device)
         db.session.commit()
+        get_timeseries_store().delete_devices([device_pk])
+        broadcast_cache_invalidation(current_app, INVALIDATE_DEVICES, [device_id])
 
         return jsonify({
             'message': f'Device {device_id} deleted successfully',
@@ -778,6 +916,8 @@ def bulk_set_devices_offline():
             updated_count += 1
 
         db.session.commit()
+        if devices:
+            broadcast_cache_invalidation(current_app, INVALIDATE_OFFLINE, [device.device_id for device in devices])
 
         return jsonify({
             'message': f'{updated_count} devices set to offline',
@@ -813,11 +953,15 @@ def bulk_delete_devices():
 
         deleted_count = len(devices)
         device_ids = [device.device_id for device in devices]
+        device_pks = [device.id for device in devices]
 
         for device in devices:
             db.session.delete(device)
 
         db.session.commit()
+        get_timeseries_store().delete_devices(device_pks)
+        if device_ids:
+            broadcast_cache_invalidation(current_app, INVALIDATE_DEVICES, device_ids)
 
         return jsonify({
             'message': f'{deleted_count} devices deleted',
@@ -835,11 +979,14 @@ def bulk_delete_devices():
 @require_api_key
 def get_device_sensor_data(device_id):
     """
-    Get sensor data for a device with interval sampling
+    Get sensor data for a device, downsampled in the database
     Expected JSON format:
     {
-        "interval": 6
+        "mode": "interval",   // interval (default), avg, minmax or lttb
+        "interval": 6,        // interval mode: every nth datapoint
+        "points": 300         // avg, minmax and lttb: target number of points
     }
+    avg, minmax and lttb read the coarsest sensor data rollup (1m, 1h, 1d) that is fine enough, see "source"
     If interval is 6 and there are 60 datapoints, returns every 6th datapoint (10 total)
     """
     try:
@@ -850,38 +997,27 @@ def get_device_sensor_data(device_id):
         if device.device_type != 'sensor':
             return jsonify({'error': f'Device {device_id} is not a sensor'}), 400
 
-        data = request.get_json()
-        interval = data.get('interval', 1) if data else 1
-
-        if interval < 1:
-            return jsonify({'error': 'interval must be at least 1'}), 400
-
-        # Get all sensor data for this device
-        all_sensor_data = models.SensorData.query.filter_by(
-            device_id=device.id
-        ).order_by(models.SensorData.timestamp.asc()).all()
+        try:
+            mode, points, interval = parse_downsample_options(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        # Apply interval sampling - take every nth datapoint
-        sampled_data = all_sensor_data[::interval]
-
-        result = []
-        for data_point in sampled_data:
-            result.append({
-                'id': data_point.id,
-                'value': data_point.value,
-                'simplified_value': data_point.simplified_value,
-                'timestamp': data_point.timestamp.isoformat()
-            })
+        series = query_sensor_series(device.id, mode, points=points, interval=interval,
+                                     device_id=device.device_id)
 
         return jsonify({
             'device_id': device_id,
             'device_name': device.name,
             'type_name': device.type_name,
             'unit': device.unit,
-            'total_datapoints_available': len(all_sensor_data),
+            'total_datapoints_available': series['total'],
+            'mode': mode,
             'sampling_interval': interval,
-            'sampled_datapoints': len(result),
-            'sensor_data': result
+            'points': points,
+            'source': series['source'],
+            'bucket_seconds': series['bucket_seconds'],
+            'sampled_datapoints': len(series['sensor_data']),
+            'sensor_data': series['sensor_data']
         }), 200
 
     except Exception as e:
@@ -891,11 +1027,13 @@ def get_device_sensor_data(device_id):
 @require_api_key
 def get_recent_sensor_data(device_id):
     """
-    Get sensor data from the last n minutes with interval sampling
+    Get sensor data from the last n minutes, downsampled in the database
     Expected JSON format:
     {
         "minutes": 30,
-        "interval": 6
+        "mode": "lttb",       // interval (default), avg, minmax or lttb
+        "interval": 6,        // interval mode: every nth datapoint
+        "points": 300         // avg, minmax and lttb: target number of points
     }
     """
     try:
@@ -906,34 +1044,18 @@ def get_recent_sensor_data(device_id):
         if device.device_type != 'sensor':
             return jsonify({'error': f'Device {device_id} is not a sensor'}), 400
 
-        data = request.get_json()
+        data = request.get_json(silent=True)
         minutes = data.get('minutes', 60) if data else 60
-        interval = data.get('interval', 1) if data else 1
+        try:
+            mode, points, interval = parse_downsample_options(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        if interval < 1:
-            return jsonify({'error': 'interval must be at least 1'}), 400
+        end_time = datetime.utcnow()
+        cutoff_time = end_time - timedelta(minutes=minutes)
 
-        cutoff_time = datetime.utcnow() - timedelta(minutes=minutes)
-        logging.info(cutoff_time)
-
-        sensor_data = models.SensorData.query.filter(
-            and_(
-                models.SensorData.device_id == device.id,
-                models.SensorData.timestamp >= cutoff_time
-            )
-        ).order_by(models.SensorData.timestamp.asc()).all()
-
-        # Apply interval sampling
-        sampled_data = sensor_data[::interval]  # Take every nth value
-
-        result = []
-        for data in sampled_data:
-            result.append({
-                'id': data.id,
-                'value': data.value,
-                'simplified_value': data.simplified_value,
-                'timestamp': data.timestamp.isoformat()
-            })
+        series = query_sensor_series(device.id, mode, points=points, interval=interval,
+                                     start=cutoff_time, end=end_time, device_id=device.device_id)
 
         return jsonify({
             'device_id': device_id,
@@ -941,16 +1063,43 @@ def get_recent_sensor_data(device_id):
             'type_name': device.type_name,
             'unit': device.unit,
             'minutes_range': minutes,
+            'mode': mode,
             'sampling_interval': interval,
-            'total_datapoints_in_range': len(sensor_data),
-            'sampled_datapoints': len(result),
-            'sensor_data': result
+            'points': points,
+            'source': series['source'],
+            'bucket_seconds': series['bucket_seconds'],
+            'total_datapoints_in_range': series['total'],
+            'sampled_datapoints': len(series['sensor_data']),
+            'sensor_data': series['sensor_data']
         }), 200
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@api.route('/sensor_data/export', methods=['GET'])
+@require_api_key
+def export_sensor_data():
+    """
+    Stream sensor data as NDJSON, CSV or Arrow IPC, with constant memory use for any export size
+    Query parameters (all optional):
+        format=ndjson|csv|arrow, device_id=<id> (repeatable), floor=<floor_number>, room=<room_number>,
+        start=<ISO 8601>, end=<ISO 8601>, chunk_size=<rows per chunk, default 5000>
+    Rows are ordered by device and time.
+    """
+    try:
+        filters = parse_export_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    extension = 'arrows' if filters['format'] == EXPORT_ARROW else filters['format']
+    return Response(
+        stream_with_context(stream_export(filters)),
+        mimetype=EXPORT_MIMETYPES[filters['format']],
+        headers={'Content-Disposition': f'attachment; filename=sensor_data.{extension}'}
+    )
+
+
 @api.route('/cleardb', methods=['DELETE'])
 @require_api_key
 def clear_database():
@@ -959,6 +1108,10 @@ def clear_database():
         db.session.remove()        # close any pending sessions
         db.drop_all()
         db.create_all()
+        broadcast_cache_invalidation(current_app, INVALIDATE_DATABASE)
+        # drop_all only covers the app database
+        if not get_timeseries_store().uses_app_database:
+            get_timeseries_store().clear()
 
         return jsonify({'message': 'Database wiped successfully'}), 200
     except Exception as exc:
@@ -4,6 +4,9 @@ from flask import current_app, jsonify, request, Blueprint
 import time
 from backend.models import models
 from backend.aiplaning.pddl_converter_main import run_planner_with_db_data
+from backend.aiplaning.pddl_converter_domain import get_domain_cache_stats
+from backend.aiplaning.utils.dirtyRoomUtils import get_room_plan_stats
+from backend.aiplaning.utils.planCacheUtils import get_plan_cache_stats
 
 pddl_api = Blueprint('pddl_api', __name__)
 
@@ -51,6 +54,18 @@ def list_solvers():
     else:
         return jsonify({"error": "No solvers available"}), 503
 
+@pddl_api.route('/api/planning/cache/stats', methods=['GET'])
+def planning_cache_stats():
+    """Get the plan cache (hit rate, evictions), domain cache and replanned/reused room metrics"""
+    try:
+        return jsonify({
+            'plan_cache': get_plan_cache_stats(),
+            'domain_cache': get_domain_cache_stats(),
+            'room_plans': get_room_plan_stats()
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @pddl_api.route('/api/planning/test', methods=['POST'])
 def planning_test():
     request_data = request.get_json()
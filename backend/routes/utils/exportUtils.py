@@ -0,0 +1,222 @@
+import csv
+import io
+import itertools
+import json
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select
+from backend.extensions import db
+from backend.models.models import SensorData, Device, Room, Floor
+from backend.models.archive import get_cold_range, iter_cold_batches
+from backend.models.timeseries import get_timeseries_store
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+EXPORT_NDJSON = 'ndjson'
+EXPORT_CSV = 'csv'
+EXPORT_ARROW = 'arrow'
+EXPORT_FORMATS = (EXPORT_NDJSON, EXPORT_CSV, EXPORT_ARROW)
+EXPORT_MIMETYPES = {
+    EXPORT_NDJSON: 'application/x-ndjson',
+    EXPORT_CSV: 'text/csv',
+    EXPORT_ARROW: 'application/vnd.apache.arrow.stream',
+}
+
+DEFAULT_CHUNK_SIZE = 5000
+MAX_CHUNK_SIZE = 100000
+
+EXPORT_COLUMNS = ('device_id', 'type_name', 'floor_number', 'room_number', 'timestamp',
+                  'value', 'value_numeric', 'simplified_value')
+
+
+def parse_export_filters(args):
+    """
+    Read the export options from the query string:
+    format, device_id (repeatable), floor, room, start, end (ISO 8601) and chunk_size.
+    Raises: ValueError for invalid values
+    Returns: dict
+    """
+    export_format = args.get('format', EXPORT_NDJSON)
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown format: {export_format}, expected one of {', '.join(EXPORT_FORMATS)}")
+    if export_format == EXPORT_ARROW and pa is None:
+        raise ValueError("Arrow export needs pyarrow, install it or use ndjson or csv")
+
+    filters = {'format': export_format, 'device_ids': args.getlist('device_id')}
+    try:
+        filters['floor_number'] = int(args['floor']) if args.get('floor') else None
+        filters['start'] = datetime.fromisoformat(args['start']) if args.get('start') else None
+        filters['end'] = datetime.fromisoformat(args['end']) if args.get('end') else None
+        chunk_size = int(args.get('chunk_size', DEFAULT_CHUNK_SIZE))
+    except ValueError as e:
+        raise ValueError(f"Invalid export filter: {str(e)}")
+    if not 1 <= chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError(f"chunk_size must be between 1 and {MAX_CHUNK_SIZE}")
+    filters['chunk_size'] = chunk_size
+    filters['room_number'] = args.get('room') or None
+    return filters
+
+
+def build_export_statement(filters, start=None):
+    """
+    Select of EXPORT_COLUMNS for the filters, ordered by device and time to read along the (device_id, timestamp) index.
+    start overrides the start filter.
+    """
+    sensor_data = SensorData.__table__.c
+    devices = Device.__table__.c
+    rooms = Room.__table__.c
+    floors = Floor.__table__.c
+
+    statement = select(
+        devices.device_id, devices.type_name, floors.floor_number, rooms.room_number, sensor_data.timestamp,
+        sensor_data.value, sensor_data.value_numeric, sensor_data.simplified_value
+    ).select_from(
+        SensorData.__table__
+        .join(Device.__table__, devices.id == sensor_data.device_id)
+        .join(Room.__table__, rooms.id == devices.room_id)
+        .join(Floor.__table__, floors.id == rooms.floor_id)
+    )
+
+    if filters['device_ids']:
+        statement = statement.where(devices.device_id.in_(filters['device_ids']))
+    if filters['floor_number'] is not None:
+        statement = statement.where(floors.floor_number == filters['floor_number'])
+    if filters['room_number'] is not None:
+        statement = statement.where(rooms.room_number == filters['room_number'])
+    start = start or filters['start']
+    if start is not None:
+        statement = statement.where(sensor_data.timestamp >= start)
+    if filters['end'] is not None:
+        statement = statement.where(sensor_data.timestamp <= filters['end'])
+    return statement.order_by(sensor_data.device_id, sensor_data.timestamp)
+
+
+def iter_export_chunks(statement, chunk_size):
+    """
+    Run the statement with a server-side cursor and yield lists of at most chunk_size rows.
+    Only one chunk is held in memory at a time. Requires an app context for the whole iteration.
+    """
+    with db.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(statement)
+        for rows in result.partitions(chunk_size):
+            yield rows
+
+
+def iter_store_chunks(filters, store):
+    """
+    Rows of EXPORT_COLUMNS for the filters from an embedded TimeSeriesStore, which cannot be joined
+    with the devices: the matching devices are selected from the database, their readings from the store.
+    """
+    devices = Device.__table__.c
+    rooms = Room.__table__.c
+    floors = Floor.__table__.c
+    statement = select(devices.id, devices.device_id, devices.type_name, floors.floor_number, rooms.room_number) \
+        .select_from(Device.__table__
+                     .join(Room.__table__, rooms.id == devices.room_id)
+                     .join(Floor.__table__, floors.id == rooms.floor_id))
+    if filters['device_ids']:
+        statement = statement.where(devices.device_id.in_(filters['device_ids']))
+    if filters['floor_number'] is not None:
+        statement = statement.where(floors.floor_number == filters['floor_number'])
+    if filters['room_number'] is not None:
+        statement = statement.where(rooms.room_number == filters['room_number'])
+    # Device primary key -> (device_id, type_name, floor_number, room_number)
+    device_columns = {row[0]: tuple(row[1:]) for row in db.session.execute(statement)}
+
+    for rows in store.iter_range(list(device_columns), filters['start'], filters['end'], filters['chunk_size']):
+        yield [(*device_columns[row.device_pk], row.timestamp, row.value, row.value_numeric, row.simplified_value)
+               for row in rows]
+
+
+def iter_archive_chunks(filters, archive_dir, watermark):
+    """Archived rows before watermark matching the filters, as lists of rows of EXPORT_COLUMNS"""
+    end = watermark if filters['end'] is None else min(filters['end'] + timedelta(microseconds=1), watermark)
+    columns = ['floor' if column == 'floor_number' else column for column in EXPORT_COLUMNS]
+    for batch in iter_cold_batches(archive_dir, columns, filters['chunk_size'], device_ids=filters['device_ids'],
+                                   start=filters['start'], end=end, floor_number=filters['floor_number'],
+                                   room_number=filters['room_number']):
+        yield list(zip(*(batch.column(index).to_pylist() for index in range(len(columns)))))
+
+
+def _encode_ndjson(rows):
+    lines = []
+    for row in rows:
+        record = dict(zip(EXPORT_COLUMNS, row))
+        record['timestamp'] = record['timestamp'].isoformat()
+        lines.append(json.dumps(record, separators=(',', ':')))
+    lines.append('')
+    return '\n'.join(lines).encode('utf-8')
+
+
+def _encode_csv(rows, header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows((*row[:4], row[4].isoformat(), *row[5:]) for row in rows)
+    return buffer.getvalue().encode('utf-8')
+
+
+def _arrow_schema():
+    return pa.schema([
+        ('device_id', pa.string()),
+        ('type_name', pa.string()),
+        ('floor_number', pa.int32()),
+        ('room_number', pa.string()),
+        ('timestamp', pa.timestamp('us')),
+        ('value', pa.string()),
+        ('value_numeric', pa.float64()),
+        ('simplified_value', pa.int8()),
+    ])
+
+
+def _arrow_batch(rows, schema):
+    columns = list(zip(*rows))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+    )
+
+
+def stream_export(filters):
+    """
+    Generator of the encoded export, one piece per chunk of rows.
+    NDJSON and CSV chunks are independent lines, Arrow is one IPC stream with one record batch per chunk.
+    With the Parquet archive, the archived rows come first, then the database rows after the archive watermark.
+    """
+    store = get_timeseries_store()
+    archive = get_cold_range(current_app.config, filters['start'])
+    if not store.uses_app_database:
+        chunks = iter_store_chunks(filters, store)
+    elif archive is None:
+        chunks = iter_export_chunks(build_export_statement(filters), filters['chunk_size'])
+    else:
+        archive_dir, watermark = archive
+        chunks = itertools.chain(
+            iter_archive_chunks(filters, archive_dir, watermark),
+            iter_export_chunks(build_export_statement(filters, watermark), filters['chunk_size'])
+        )
+
+    if filters['format'] == EXPORT_NDJSON:
+        for rows in chunks:
+            yield _encode_ndjson(rows)
+        return
+
+    if filters['format'] == EXPORT_CSV:
+        yield _encode_csv([], header=True)
+        for rows in chunks:
+            yield _encode_csv(rows)
+        return
+
+    schema = _arrow_schema()
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for rows in chunks:
+            writer.write_batch(_arrow_batch(rows, schema))
+            # Hand out what the writer produced and reuse the buffer
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    yield sink.getvalue()
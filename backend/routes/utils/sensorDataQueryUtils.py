@@ -0,0 +1,354 @@
+import math
+from datetime import datetime, timedelta
+import numpy as np
+from flask import current_app
+from sqlalchemy import select, func
+from backend.extensions import db
+from backend.models.rollups import ROLLUP_LEVELS, bucket_offset, to_epoch_seconds, floor_timestamp, get_rollup_watermark
+from backend.models.retention import get_raw_retention_start, get_rollup_retention_start
+from backend.models.archive import get_cold_range, cold_stats, read_cold_rows, aggregate_cold_rows
+from backend.models.timeseries import get_timeseries_store
+
+DOWNSAMPLE_INTERVAL = 'interval'
+DOWNSAMPLE_AVG = 'avg'
+DOWNSAMPLE_MINMAX = 'minmax'
+DOWNSAMPLE_LTTB = 'lttb'
+DOWNSAMPLE_MODES = (DOWNSAMPLE_INTERVAL, DOWNSAMPLE_AVG, DOWNSAMPLE_MINMAX, DOWNSAMPLE_LTTB)
+SOURCE_RAW = 'raw'
+
+DEFAULT_POINTS = 300
+MAX_POINTS = 5000
+# Long ranges are reduced in SQL to the min and max of points * LTTB_PRESELECT_FACTOR buckets
+# before LTTB runs (MinMaxLTTB), so spikes survive and LTTB never sees all raw rows
+LTTB_PRESELECT_FACTOR = 4
+
+def _split_range(device_id, start, end):
+    """
+    Split [start, end] at the watermark of the Parquet archive (SENSOR_DATA_ARCHIVE_DIR).
+    The part before it is read from the archive, the database rows there are already
+    archived (or not deleted yet) and are skipped.
+
+    Returns:
+        tuple: ((archive dir, cold start, cold end exclusive) or None, start of the database part)
+    """
+    if device_id is None:
+        return None, start
+    archive = get_cold_range(current_app.config, start)
+    if archive is None:
+        return None, start
+    archive_dir, watermark = archive
+    cold_end = watermark if end is None else min(end + timedelta(microseconds=1), watermark)
+    return (archive_dir, start, cold_end), watermark
+
+
+def get_series_stats(device_pk, start=None, end=None, device_id=None):
+    """
+    Returns: (count, first timestamp, last timestamp) of the sensor data of a device in the range,
+    answered from the (device_id, timestamp) index of the TimeSeriesStore and the archive
+    """
+    cold, start = _split_range(device_id, start, end)
+    row = get_timeseries_store().stats(device_pk, start, end)
+    if cold is None:
+        return row[0], row[1], row[2]
+
+    cold_count, cold_first, cold_last = cold_stats(cold[0], device_id, cold[1], cold[2])
+    return cold_count + row[0], cold_first or row[1], row[2] or cold_last
+
+
+def query_interval_sampled(device_pk, interval, start=None, end=None, device_id=None):
+    """Every interval-th row of the range in time order, sampled by the TimeSeriesStore with ROW_NUMBER()"""
+    cold, start = _split_range(device_id, start, end)
+    data = []
+    cold_count = 0
+    if cold is not None:
+        table = read_cold_rows(cold[0], device_id, cold[1], cold[2],
+                               ('id', 'value', 'simplified_value', 'timestamp'))
+        cold_count = table.num_rows
+        data = [{
+            'id': row['id'],
+            'value': row['value'],
+            'simplified_value': row['simplified_value'],
+            'timestamp': row['timestamp'].isoformat()
+        } for row in table.take(np.arange(0, cold_count, interval)).to_pylist()]
+
+    # Continue the sampling of the archived rows
+    rows = get_timeseries_store().query_range(device_pk, start, end, every=interval, skip=cold_count)
+    return data + [{
+        # String like the archived and the UUID keys
+        'id': str(row.id),
+        'value': row.value,
+        'simplified_value': row.simplified_value,
+        'timestamp': row.timestamp.isoformat()
+    } for row in rows]
+
+
+def choose_rollup_level(start, bucket_seconds, raw_complete=True):
+    """
+    Coarsest rollup level whose buckets fit into bucket_seconds and that covers start:
+    start is rolled up already and not yet deleted by the retention of the level.
+    If the raw data of the range was partly deleted by the retention (raw_complete False),
+    the finest covering rollup is used even if its buckets are longer than bucket_seconds.
+    Returns: RollupLevel or None for the raw sensor data
+    """
+    # The rollups are built from the sensor_data table of the app database only
+    if not get_timeseries_store().uses_app_database:
+        return None
+    covering = []
+    for level in ROLLUP_LEVELS:
+        watermark = get_rollup_watermark(level)
+        retention_start = get_rollup_retention_start(level)
+        if watermark is not None and watermark > start and (retention_start is None or retention_start <= start):
+            covering.append(level)
+    for level in reversed(covering):
+        if level.bucket_seconds <= bucket_seconds:
+            return level
+    if not raw_complete and covering:
+        return covering[0]
+    return None
+
+
+def get_rollup_first_bucket(device_pk):
+    """Oldest rollup bucket of a device over all levels, None if the device has no rollups"""
+    firsts = [db.session.execute(select(func.min(level.table.c.bucket_start))
+                                 .where(level.table.c.device_id == device_pk)).scalar()
+              for level in ROLLUP_LEVELS]
+    firsts = [first for first in firsts if first is not None]
+    return min(firsts) if firsts else None
+
+
+def _aggregate_raw(device_pk, grid_start, bucket_seconds, start, end, device_id=None):
+    """
+    Rows of (bucket offset, sum, min, max, count, low, mid, high) of the raw sensor data in [start, end],
+    archived rows are aggregated with NumPy. A bucket split at the archive watermark appears twice.
+    """
+    cold, start = _split_range(device_id, start, end)
+    rows = []
+    if cold is not None:
+        table = read_cold_rows(cold[0], device_id, cold[1], cold[2], ('timestamp', 'value_numeric', 'simplified_value'))
+        rows = aggregate_cold_rows(table, to_epoch_seconds(grid_start), bucket_seconds)
+
+    return rows + list(get_timeseries_store().aggregate(device_pk, grid_start, bucket_seconds, start, end))
+
+
+def _query_numeric_rows(device_pk, start, end, device_id=None):
+    """Rows of (timestamp, value_numeric, simplified_value) in [start, end] in time order, archived rows first"""
+    cold, start = _split_range(device_id, start, end)
+    rows = []
+    if cold is not None:
+        table = read_cold_rows(cold[0], device_id, cold[1], cold[2], ('timestamp', 'value_numeric', 'simplified_value'))
+        table = table.filter(table['value_numeric'].is_valid())
+        rows = list(zip(*(table[name].to_pylist() for name in ('timestamp', 'value_numeric', 'simplified_value'))))
+
+    return rows + [(row.timestamp, row.value_numeric, row.simplified_value)
+                   for row in get_timeseries_store().query_range(device_pk, start, end, numeric_only=True)]
+
+
+def _aggregate_rollup(level, device_pk, grid_start, bucket_seconds, end):
+    """Rows of (bucket offset, sum, min, max, count, low, mid, high) of the rollup buckets in [grid_start, end]"""
+    c = level.table.c
+    bucket = bucket_offset(c.bucket_start, grid_start, bucket_seconds)
+    return db.session.execute(
+        select(bucket, func.sum(c.value_sum), func.min(c.value_min), func.max(c.value_max), func.sum(c.count),
+               func.sum(c.low_count), func.sum(c.mid_count), func.sum(c.high_count))
+        .where(c.device_id == device_pk, c.bucket_start >= grid_start, c.bucket_start <= end)
+        .group_by(bucket)
+    ).all()
+
+
+def _merge_bucket_rows(rows):
+    """Merge the rows of buckets split at a watermark. Returns: rows ordered by offset"""
+    merged = {}
+    for row in rows:
+        current = merged.get(row[0])
+        if current is None:
+            merged[row[0]] = list(row)
+            continue
+        current[1] += row[1]
+        current[2] = min(current[2], row[2])
+        current[3] = max(current[3], row[3])
+        for index in (4, 5, 6, 7):
+            current[index] += row[index]
+    return [merged[offset] for offset in sorted(merged)]
+
+
+def _query_bucket_rows(device_pk, start, end, buckets, raw_complete=True, device_id=None):
+    """
+    Aggregate the numeric values of [start, end] into at most buckets equally long time buckets.
+    Reads the coarsest rollup that is fine enough, the part of the range after its watermark
+    (not rolled up yet) from the raw sensor data, archived raw data from the Parquet archive.
+
+    Returns:
+        tuple: (grid start, bucket_seconds, source name, list of [offset, sum, min, max, count, low, mid, high]
+                ordered by offset)
+    """
+    span = max((end - start).total_seconds(), 1.0)
+    bucket_seconds = max(int(math.ceil(span / buckets)), 1)
+    level = choose_rollup_level(start, bucket_seconds, raw_complete)
+
+    if level is None:
+        grid_start = start.replace(microsecond=0)
+        rows = _aggregate_raw(device_pk, grid_start, bucket_seconds, start, end, device_id)
+        return grid_start, bucket_seconds, SOURCE_RAW, _merge_bucket_rows(rows)
+
+    # Align the grid to the rollup buckets, so every rollup bucket falls into exactly one grid bucket
+    bucket_seconds = int(math.ceil(bucket_seconds / level.bucket_seconds)) * level.bucket_seconds
+    grid_start = floor_timestamp(start, level.bucket_seconds)
+    watermark = get_rollup_watermark(level)
+
+    rows = list(_aggregate_rollup(level, device_pk, grid_start, bucket_seconds,
+                                  min(end, watermark - timedelta(microseconds=1))))
+    if watermark <= end:
+        rows += _aggregate_raw(device_pk, grid_start, bucket_seconds, watermark, end, device_id)
+    # A bucket split at the watermark is partly rolled up and partly raw
+    return grid_start, bucket_seconds, level.name, _merge_bucket_rows(rows)
+
+
+def query_time_buckets(device_pk, start, end, buckets, raw_complete=True, device_id=None):
+    """
+    Time-bucket average of the range with the min/max envelope and the simplified value histogram of every bucket.
+    Returns: (bucket_seconds, source name, list of dicts with timestamp, value (avg), min, max, count, histogram)
+    """
+    grid_start, bucket_seconds, source, rows = _query_bucket_rows(device_pk, start, end, buckets, raw_complete,
+                                                                  device_id)
+    return bucket_seconds, source, [{
+        'timestamp': (grid_start + timedelta(seconds=int(row[0]))).isoformat(),
+        'value': float(row[1]) / int(row[4]),
+        'min': float(row[2]),
+        'max': float(row[3]),
+        'count': int(row[4]),
+        'histogram': {'low': int(row[5]), 'mid': int(row[6]), 'high': int(row[7])}
+    } for row in rows]
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: indices of threshold points that keep the visual shape of (x, y).
+    x must be sorted ascending.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    # The first and last point are fixed, the others are spread over threshold - 2 buckets
+    edges = (np.floor(np.arange(threshold - 1) * (n - 2) / (threshold - 2)) + 1).astype(np.int64)
+    edges[-1] = n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        bucket_start, bucket_end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_start = bucket_end if i + 2 < len(edges) else n - 1
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        bucket_x = x[bucket_start:bucket_end]
+        bucket_y = y[bucket_start:bucket_end]
+        areas = np.abs((x[a] - avg_x) * (bucket_y - y[a]) - (x[a] - bucket_x) * (avg_y - y[a]))
+        a = bucket_start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def query_lttb(device_pk, start, end, points, count, raw_complete=True, device_id=None):
+    """
+    LTTB downsampling of the range to points points.
+    Ranges with more than 2 * points * LTTB_PRESELECT_FACTOR rows, or whose raw data was partly deleted,
+    are first reduced in SQL to the min and max of points * LTTB_PRESELECT_FACTOR time buckets.
+    Returns: (source name, list of dicts with timestamp and value)
+    """
+    if count > 2 * points * LTTB_PRESELECT_FACTOR or not raw_complete:
+        grid_start, bucket_seconds, source, buckets = _query_bucket_rows(device_pk, start, end,
+                                                                         points * LTTB_PRESELECT_FACTOR, raw_complete,
+                                                                         device_id)
+        timestamps, x, y = [], [], []
+        for row in buckets:
+            for offset, value in ((row[0], row[2]), (row[0] + bucket_seconds / 2, row[3])):
+                timestamps.append((grid_start + timedelta(seconds=offset)).isoformat())
+                x.append(offset)
+                y.append(value)
+        x = np.array(x, dtype=np.float64)
+        y = np.array(y, dtype=np.float64)
+    else:
+        source = SOURCE_RAW
+        rows = _query_numeric_rows(device_pk, start, end, device_id)
+        timestamps = [row[0].isoformat() for row in rows]
+        x = np.array([(row[0] - start).total_seconds() for row in rows], dtype=np.float64)
+        y = np.array([row[1] for row in rows], dtype=np.float64)
+
+    return source, [{'timestamp': timestamps[i], 'value': float(y[i])} for i in lttb_indices(x, y, points)]
+
+
+def parse_downsample_options(data):
+    """
+    Read mode, points and interval from a request body.
+    Raises: ValueError for an unknown mode or out of range values
+    Returns: (mode, points, interval)
+    """
+    data = data or {}
+    mode = data.get('mode', DOWNSAMPLE_INTERVAL)
+    if mode not in DOWNSAMPLE_MODES:
+        raise ValueError(f"Unknown mode: {mode}, expected one of {', '.join(DOWNSAMPLE_MODES)}")
+
+    interval = data.get('interval', 1)
+    if not isinstance(interval, int) or interval < 1:
+        raise ValueError('interval must be at least 1')
+
+    points = data.get('points', DEFAULT_POINTS)
+    if not isinstance(points, int) or points < 3:
+        raise ValueError('points must be at least 3')
+    return mode, min(points, MAX_POINTS), interval
+
+
+def query_sensor_series(device_pk, mode, points=DEFAULT_POINTS, interval=1, start=None, end=None, device_id=None):
+    """
+    Sensor data of a device in the range [start, end], downsampled according to mode:
+
+    interval: every interval-th raw row (id, value, simplified_value, timestamp)
+    avg:      average of points equally long time buckets, with min, max, count and histogram of every bucket
+    minmax:   like avg with points / 2 buckets, for drawing the min/max envelope (two points per bucket)
+    lttb:     points values chosen by Largest-Triangle-Three-Buckets
+
+    avg, minmax and lttb only use numeric values and read the coarsest sensor data rollup (1m, 1h, 1d)
+    that is fine enough for the requested points. Ranges with at most points numeric rows are
+    returned unaggregated by avg and minmax as well (count 1 per point). Before the raw data retention
+    start (SENSOR_DATA_RETENTION_DAYS) they only read the rollups, interval only returns the raw rows left.
+    With the Parquet archive and the device_id of the device, archived raw data is read from the archive.
+
+    Returns:
+        dict: total (raw rows in the range), source (raw or the rollup level name),
+              bucket_seconds (None if not bucketed) and sensor_data
+    """
+    total, first, last = get_series_stats(device_pk, start, end, device_id)
+    if mode == DOWNSAMPLE_INTERVAL:
+        data = query_interval_sampled(device_pk, interval, start, end, device_id) if total else []
+        return {'total': total, 'source': SOURCE_RAW, 'bucket_seconds': None, 'sensor_data': data}
+
+    raw_retention_start = get_raw_retention_start()
+    if start is None and raw_retention_start is not None:
+        rollup_first = get_rollup_first_bucket(device_pk)
+        first = min(first, rollup_first) if first and rollup_first else first or rollup_first
+    start = start or first
+    end = end or last or datetime.utcnow()
+    raw_complete = raw_retention_start is None or start is None or start >= raw_retention_start
+
+    if start is None or (total == 0 and raw_complete):
+        return {'total': total, 'source': SOURCE_RAW, 'bucket_seconds': None, 'sensor_data': []}
+
+    if mode == DOWNSAMPLE_LTTB:
+        source, data = query_lttb(device_pk, start, end, points, total, raw_complete, device_id)
+        return {'total': total, 'source': source, 'bucket_seconds': None, 'sensor_data': data}
+
+    buckets = points if mode == DOWNSAMPLE_AVG else max(points // 2, 1)
+    if total <= buckets and raw_complete:
+        rows = _query_numeric_rows(device_pk, start, end, device_id)
+        data = [{
+            'timestamp': row[0].isoformat(), 'value': row[1], 'min': row[1], 'max': row[1], 'count': 1,
+            'histogram': {'low': int(row[2] == -1), 'mid': int(row[2] == 0), 'high': int(row[2] == 1)}
+        } for row in rows]
+        return {'total': total, 'source': SOURCE_RAW, 'bucket_seconds': None, 'sensor_data': data}
+
+    bucket_seconds, source, data = query_time_buckets(device_pk, start, end, buckets, raw_complete, device_id)
+    return {'total': total, 'source': source, 'bucket_seconds': bucket_seconds, 'sensor_data': data}
@@ -0,0 +1,89 @@
+"""
+Measure the MQTT ingest throughput of one or more running backend instances.
+
+Publishes sensor messages for devices spread over the floors as fast as the broker accepts them,
+then polls /mqtt/stats of every backend instance until all messages are processed.
+Run it once per consumer setup (MQTT_CONSUMERS / MQTT_PARTITION_COUNT) and compare the ingest rates:
+
+    python benchmark_mqtt_ingest.py --messages 50000 --floors 8 \
+        --stats-url http://localhost:81/mqtt/stats --api-key <key>
+
+The floors and rooms have to exist, messages of unknown rooms are counted as processed but not written.
+Room numbers are unique over the building, --room is formatted with the floor (default 001, 101, 201, ...).
+"""
+import argparse
+import json
+import time
+import uuid
+import requests
+import paho.mqtt.client as mqtt
+
+
+def sensor_payload(device_id, value):
+    return json.dumps({
+        "id": device_id, "name": "Benchmark", "type_name": "temperature", "connector": "bench",
+        "connector_type": "bench", "min": 0, "max": 40, "datatype": "float", "unit": "C",
+        "ai_planing_type": "temperature_s", "read_interval": 5, "notify_interval": "5",
+        "notify_change_precision": 1, "last_value": value,
+    })
+
+
+def processed_messages(stats_urls, api_key):
+    total = 0
+    for url in stats_urls:
+        response = requests.get(url, headers={'X-API-Key': api_key}, timeout=5)
+        response.raise_for_status()
+        total += response.json()['ingest']['processed']
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--prefix', default='SCIoT_G02_2025')
+    parser.add_argument('--floors', type=int, default=4)
+    parser.add_argument('--room', default='{floor}01', help='room number of every floor, formatted with {floor}')
+    parser.add_argument('--devices-per-floor', type=int, default=25)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--qos', type=int, default=1)
+    parser.add_argument('--stats-url', action='append', required=True, help='/mqtt/stats URL, once per backend instance')
+    parser.add_argument('--api-key', required=True)
+    parser.add_argument('--timeout', type=float, default=600)
+    args = parser.parse_args()
+
+    devices = [(floor, f"bench-{floor}-{index}-{uuid.uuid4().hex[:6]}")
+               for floor in range(args.floors) for index in range(args.devices_per_floor)]
+
+    client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
+    client.max_queued_messages_set(0)
+    client.connect(args.host, args.port)
+    client.loop_start()
+
+    processed_before = processed_messages(args.stats_url, args.api_key)
+    start = time.perf_counter()
+    infos = []
+    for i in range(args.messages):
+        floor, device_id = devices[i % len(devices)]
+        topic = f"{args.prefix}/{floor}/{args.room.format(floor=floor)}/sensor/{device_id}/all"
+        infos.append(client.publish(topic, sensor_payload(device_id, i % 40), qos=args.qos))
+    for info in infos:
+        info.wait_for_publish()
+    published = time.perf_counter() - start
+    print(f"Published {args.messages} messages in {published:.2f} s ({args.messages / published:.0f} msg/s)")
+
+    while True:
+        done = processed_messages(args.stats_url, args.api_key) - processed_before
+        elapsed = time.perf_counter() - start
+        if done >= args.messages or elapsed > args.timeout:
+            break
+        time.sleep(0.2)
+
+    client.loop_stop()
+    client.disconnect()
+    print(f"Processed {done} messages in {elapsed:.2f} s ({done / elapsed:.0f} msg/s) "
+          f"over {len(args.stats_url)} instance(s)")
+
+
+if __name__ == "__main__":
+    main()
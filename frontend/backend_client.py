@@ -29,6 +29,15 @@ class Backend:
     async def list_rooms (self, floor:int): return (await self._get(f"/floors/{floor}/rooms/list"))["rooms"]
     async def list_devices(self, floor:int, room:str): return (await self._get(f"/floors/{floor}/rooms/{room}/devices/list"))["devices"]
 
+    async def get_room_state(self, floor:int, room:str, etag:str|None=None, since:int|None=None):
+        """Device states of a room. Returns (etag, state), state is None if nothing changed since etag."""
+        headers = {"If-None-Match": etag} if etag else {}
+        params = {"since": since} if since is not None else {}
+        r = await self.cli.get(f"/floors/{floor}/rooms/{room}/state", headers=headers, params=params)
+        if r.status_code == 304: return etag, None
+        r.raise_for_status()
+        return r.headers.get("ETag"), r.json()
+
     async def list_all_rooms(self)->list[dict]:
         data = await self.list_floors()
         flat=[]
@@ -76,9 +85,11 @@ class Backend:
         """Gets sensor data with interval sampling."""
         return await self._post(f"/devices/{device_id}/sensor_data", {"interval": interval})
 
-    async def get_recent_sensor_data(self, device_id: str, minutes: int, interval: int):
-        """Gets recent sensor data from the last n minutes with interval sampling."""
-        return await self._post(f"/devices/{device_id}/sensor_data/recent", {"minutes": minutes, "interval": interval})
+    async def get_recent_sensor_data(self, device_id: str, minutes: int, interval: int = 1,
+                                     mode: str = "interval", points: int = 300):
+        """Gets recent sensor data from the last n minutes, downsampled by the backend (interval, avg, minmax or lttb)."""
+        return await self._post(f"/devices/{device_id}/sensor_data/recent",
+                                {"minutes": minutes, "interval": interval, "mode": mode, "points": points})
     async def get_mapping_matrices(self):
         """Gets the actuator-sensor mapping matrices."""
         return await self._get("/api/mappings/matrices")
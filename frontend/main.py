@@ -90,30 +90,41 @@ async def show_room(summary_column, floor_no:int, room:dict, fetch_plan_on_load:
     summary_column.clear()
     vm = RoomVM.model_validate(room)
     devices_known: set[str] = set()
+    # Rows by device_id and the version of the room state they show
+    device_rows: dict[str, dict] = {}
+    state_version: int | None = None
 
     # The refresh functions now accept the UI element they need to modify.
     async def refresh_devices(grid: ui.aggrid):
-        nonlocal devices_known
-        devs = await backend.list_devices(floor_no, vm.room_number)
+        nonlocal devices_known, state_version
+        # Only the devices changed since the last refresh are sent
+        _, state = await backend.get_room_state(floor_no, vm.room_number, since=state_version)
         simplified_map = {-1: "Low", 0: "Medium", 1: "High"}
-        rows = []
-        for d in devs:
+        if state["full"]:
+            device_rows.clear()
+        for device_id in state["removed"]:
+            device_rows.pop(device_id, None)
+        changed = []
+        for d in state["devices"]:
             try:
                 d['last_value'] = f"{float(d['last_value']):.2f}"
             except (ValueError, TypeError):
                 pass
             simplified_numeric = d.get('last_value_simplified')
             d['last_value_simplified_string'] = simplified_map.get(simplified_numeric, "")
-            rows.append(DeviceVM.model_validate(d).model_dump())
+            row = DeviceVM.model_validate(d).model_dump()
+            device_rows[row["device_id"]] = row
+            changed.append(row)
+        state_version = state["version"]
 
-        ids = {r["device_id"] for r in rows}
+        ids = set(device_rows)
         if ids != devices_known:
             # We don't need `with grid:` here because we are calling a method on the element itself.
-            grid.options["rowData"] = rows
+            grid.options["rowData"] = list(device_rows.values())
             grid.update()
             devices_known = ids
         else:
-            for row in rows:
+            for row in changed:
                 for k, v in row.items():
                     grid.run_row_method(row["device_id"], "setDataValue", k, v)
 
@@ -610,7 +621,7 @@ async def guest_view(floor: int, room: str):
             dialog.open()
             try:
                 # fetch recent data from the backend
-                res = await backend.get_recent_sensor_data(sensor_id, minutes=5, interval=1)
+                res = await backend.get_recent_sensor_data(sensor_id, minutes=5, mode='lttb', points=300)
                 sensor_data = res.get('sensor_data', [])
 
                 # process the data into a format ECharts can understand
@@ -686,8 +697,15 @@ async def guest_view(floor: int, room: str):
             actuator_table.on('row-dblclick', show_device_dialog)
         ui.space()
 
+    room_state_etag: str | None = None
+
     async def refresh_guest_devices():
-        devs = await backend.list_devices(floor, room)
+        nonlocal room_state_etag
+        room_state_etag, state = await backend.get_room_state(floor, room, etag=room_state_etag)
+        if state is None:
+            # Nothing changed in the room
+            return
+        devs = state["devices"]
         sensor_rows = []
         actuator_rows = []
         simplified_map = {-1: "Low", 0: "Medium", 1: "High"}